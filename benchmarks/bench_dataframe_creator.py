@@ -0,0 +1,84 @@
+""" compare the legacy row by row splitting in DataframeCreator with the vectorized pandas csv parser path on a
+synthetic csv with a header row
+
+usage: python -m benchmarks.bench_dataframe_creator --rows 10000000
+"""
+
+__author__ = 'alsherman'
+
+import csv
+import time
+import argparse
+import pandas as pd
+from types import SimpleNamespace
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+def create_text(rows):
+    """ create a synthetic csv with int, float, and str columns
+
+    :param rows: number of data rows
+    """
+
+    lines = ['id,amount,category,code']
+    lines.extend('{},{}.{},cat{},C{}'.format(i, i % 1000, i % 100, i % 50, i % 9973) for i in range(rows))
+    return '\n'.join(lines) + '\n'
+
+
+def legacy_url(text, sep=','):
+    """ the url path before the vectorized parser: split each row into a list, then promote the first row to headers """
+
+    df = pd.DataFrame([row.split(sep) for row in text.split('\n')])
+    df.columns = df.values[0]
+    df.drop(0, inplace=True)
+    return df
+
+
+def legacy_zip(lines, sep=','):
+    """ the zip path before the vectorized parser: csv.reader over every row, then promote the first row to headers """
+
+    df = pd.DataFrame([row for row in csv.reader((line.decode('utf-8') for line in lines), delimiter=sep)])
+    df.columns = df.values[0]
+    df.drop(0, inplace=True)
+    return df
+
+
+def vectorized(data, download_type, csv_engine='c'):
+    source_metadata = SimpleNamespace(local=False, raw_data_path='synthetic', download_type=download_type,
+                                      downloaded_data=data, stream=False, parallel_parse=False, chunksize=100000,
+                                      csv_engine=csv_engine,
+                                      schema=None, downcast=False, data_category='synthetic',
+                                      sources_metadata={}, fingerprint=None, checkpoints=None)
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    df = func(*args)
+    return time.perf_counter() - start, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000000, help='number of synthetic rows')
+    parser.add_argument('--csv-engine', default='c', choices=['c', 'pyarrow'], help='csv parser of the new path')
+    args = parser.parse_args()
+
+    text = create_text(args.rows)
+    lines = text.encode('utf-8').splitlines(keepends=True)
+    print('input: {} rows, {:.1f} MB'.format(args.rows, len(text) / 2 ** 20))
+
+    for name, legacy, data, download_type in [('url', legacy_url, text, 'url'), ('zip', legacy_zip, lines, 'zip')]:
+        before, legacy_df = timed(legacy, data)
+        legacy_memory = legacy_df.memory_usage(deep=True).sum() / 2 ** 20
+        del legacy_df
+
+        after, df = timed(vectorized, data, download_type, args.csv_engine)
+        memory = df.memory_usage(deep=True).sum() / 2 ** 20
+
+        print('{}: before {:.2f}s ({:.0f} MB frame)  after {:.2f}s ({:.0f} MB frame)  speedup {:.1f}x  dtypes {}'.format(
+            name, before, legacy_memory, after, memory, before / after, dict(df.dtypes.astype(str))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+""" check the import time of the data_pipeline package and its command line interface against a budget, and that
+importing them does not load heavy dependencies (pandas, numpy, requests, pyarrow), which are imported by the
+pipeline stages that use them
+
+Exits with status 1 when a module is over budget or loads a heavy dependency.
+
+usage: python -m benchmarks.bench_import --budget-ms 50 --top 10
+"""
+
+__author__ = 'alsherman'
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+heavy_modules = ['pandas', 'numpy', 'requests', 'pyarrow']
+modules = ['data_pipeline', 'data_pipeline.__main__', 'data_pipeline.data_pipeline', 'data_pipeline.batch_runner']
+
+
+def import_seconds(statement, repeat):
+    """ median wall time of a fresh interpreter running the statement, including interpreter startup """
+
+    script = 'import time; start = time.perf_counter(); {}; print(time.perf_counter() - start)'.format(statement)
+    times = [float(subprocess.check_output([sys.executable, '-c', script])) for _ in range(repeat)]
+    return statistics.median(times)
+
+
+def loaded_heavy_modules(module):
+    script = 'import sys, json, {}; print(json.dumps([m for m in {!r} if m in sys.modules]))'.format(module, heavy_modules)
+    return json.loads(subprocess.check_output([sys.executable, '-c', script]))
+
+
+def slowest_imports(module, top):
+    """ return the modules with the highest cumulative import time, from python -X importtime
+
+    :return: list of (microseconds, module name), excluding the modules imported at interpreter startup
+    """
+
+    startup = {name.strip() for _, name in _importtime('pass')}
+    imports = [(cumulative, name) for cumulative, name in _importtime('import ' + module)
+               if name.strip() not in startup]
+    return sorted(imports, reverse=True)[:top]
+
+
+def _importtime(statement):
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    imports = []
+    for line in output.splitlines()[1:]:
+        _, cumulative, name = line.split('|')  # import time: self [us] | cumulative | imported package
+        imports.append((int(cumulative), name.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=50, help='maximum import time of each module')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters timed per module')
+    parser.add_argument('--top', type=int, default=0, help='show the slowest imports of each module')
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in modules:
+        milliseconds = import_seconds('import ' + module, args.repeat) * 1000
+        heavy = loaded_heavy_modules(module)
+        ok = milliseconds <= args.budget_ms and not heavy
+        over_budget |= not ok
+
+        print('{:<30} {:>7.1f} ms  {}{}'.format(module, milliseconds, 'ok' if ok else 'OVER BUDGET',
+                                                '  loads {}'.format(', '.join(heavy)) if heavy else ''))
+        for microseconds, name in slowest_imports(module, args.top) if args.top else []:
+            print('    {:>7.1f} ms  {}'.format(microseconds / 1000, name))
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+""" compare throughput and peak memory of the BeautifulSoup based XmlElementParser, the iterparse based
+XmlStreamParser, and the sharded ParallelXmlParser on a synthetic XML document
+
+usage: python -m benchmarks.bench_xml_parser --items 100000
+"""
+
+__author__ = 'alsherman'
+
+import os
+import time
+import argparse
+import tempfile
+import resource
+import tracemalloc
+import multiprocessing
+
+
+def write_xml(path, items):
+    """ write a synthetic document with nested, one to many, and attribute elements
+
+    :param path: path of the XML file to create
+    :param items: number of <record> items in the document
+    """
+
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0"?>\n<records>\n')
+        for i in range(items):
+            f.write('<record id="{0}"><name>name {0}</name><meta><info><value kind="k{1}">{0}</value></info></meta>'
+                    '<tags><tag>a{0}</tag><tag>b{0}</tag></tags></record>\n'.format(i, i % 7))
+        f.write('</records>\n')
+
+
+def data_list():
+    return [(['name', ('record', 'id')], None, []),
+            (['tag'], 'tags', []),
+            ([('value', 'kind'), 'value'], ['meta', 'info'], [])]
+
+
+def run_tree(path):
+    """ current path: build the full BeautifulSoup tree, then parse each item """
+
+    from bs4 import BeautifulSoup
+    from data_pipeline.transform_data.xml_parser import XmlElementParser
+
+    specs = data_list()
+    with open(path, 'rb') as f:
+        soup = BeautifulSoup(f, 'xml')
+    for item in soup.find_all('record'):
+        XmlElementParser(item).extract_data(specs, row_start=[item['id']])
+    return sum(len(class_list) for _, _, class_list in specs)
+
+
+def run_stream(path):
+    """ iterparse path: parse each item as soon as it is read, then clear it """
+
+    from data_pipeline.transform_data.xml_stream_parser import XmlStreamParser
+
+    specs = data_list()
+    XmlStreamParser(path, 'record').extract_data(specs, row_start=lambda item: [item['id']])
+    return sum(len(class_list) for _, _, class_list in specs)
+
+
+def record_id(item):
+    return [item['id']]
+
+
+def run_parallel(path):
+    """ sharded path: split the items into shards and parse them across a process pool """
+
+    from data_pipeline.transform_data.xml_parser import XmlElementParser
+    from data_pipeline.transform_data.xml_parallel_parser import ParallelXmlParser
+
+    specs = [(children_names, parent_names, str(table)) for table, (children_names, parent_names, _) in enumerate(data_list())]
+    ParallelXmlParser(path, 'record').extract_data(specs, row_start=record_id)
+    return sum(len(rows) for rows in XmlElementParser.all_data.values())
+
+
+def _measure(engine, path, trace, queue):
+    """ run one engine in a fresh process so peak memory is not shared between engines """
+
+    if trace:
+        tracemalloc.start()  # slows the parsers down, so elapsed time is only comparable between traced runs
+
+    start = time.perf_counter()
+    rows = engine(path)
+    elapsed = time.perf_counter() - start
+
+    peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kilobytes on linux
+    queue.put({'rows': rows, 'seconds': elapsed, 'tracemalloc_peak_mb': peak / 2 ** 20, 'max_rss_mb': max_rss / 2 ** 10})
+
+
+def measure(engine, path, trace=False):
+    """
+    :param engine: run_tree, run_stream, or run_parallel
+    :param path: path of the XML file to parse
+    :param trace: also record the peak of python allocations with tracemalloc
+    :return: dict of rows parsed, elapsed seconds, and peak memory
+    """
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(engine, path, trace, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=100000, help='number of <record> items to generate')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report the peak of python allocations')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'records.xml')
+        write_xml(path, args.items)
+        print('document: {} items, {:.1f} MB'.format(args.items, os.path.getsize(path) / 2 ** 20))
+
+        engines = [('tree (BeautifulSoup)', run_tree),
+                   ('stream (iterparse)', run_stream),
+                   ('parallel ({} procs)'.format(os.cpu_count()), run_parallel)]
+        for name, engine in engines:
+            result = measure(engine, path, trace=args.tracemalloc)
+            line = '{:<22} {:>9} rows  {:>7.2f}s  {:>10.0f} items/s  max rss {:>8.1f} MB'.format(
+                name, result['rows'], result['seconds'], args.items / result['seconds'], result['max_rss_mb'])
+            if args.tracemalloc:
+                line += '  tracemalloc peak {:>8.1f} MB'.format(result['tracemalloc_peak_mb'])
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+""" local stand-ins for the servers that sources are downloaded from, serving the files in a folder from a background
+thread: an HTTP server with HEAD, ETag and Range support, and a minimal passive mode FTP server
+
+usage:
+    with HttpServer(folder) as http, FtpServer(folder) as ftp:
+        http.url('data.csv')  # http://127.0.0.1:<port>/data.csv
+        ftp.url('data.csv')   # ftp://127.0.0.1:<port>/data.csv
+"""
+
+__author__ = 'alsherman'
+
+import os
+import re
+import time
+import email.utils
+import socket
+import threading
+import socketserver
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Server:
+    """ runs a socketserver in a daemon thread while used as a context manager """
+
+    scheme = None
+
+    def __init__(self, folder, host='127.0.0.1', port=0):
+        """
+        :param folder: folder of the files to serve
+        :param host: interface to listen on
+        :param port: port to listen on, 0 picks a free port
+        """
+
+        self.folder = folder
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def url(self, name):
+        """ return the url of a file in the folder """
+
+        return '{}://{}:{}/{}'.format(self.scheme, self.host, self.port, name)
+
+    def start(self):
+        self._server = self._create_server()
+        self._server.folder = self.folder
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _create_server(self):
+        raise NotImplementedError
+
+
+class HttpServer(_Server):
+    """ serves files over HTTP/1.1 with keep-alive, HEAD, ETag, Last-Modified, Range, If-Range and conditional
+    requests (If-None-Match and If-Modified-Since) support. The method, path, Range header and status of every
+    request are recorded in requests, and the most responses sent at a time in max_active """
+
+    scheme = 'http'
+
+    def __init__(self, folder, host='127.0.0.1', port=0, accept_ranges=True, validators=True, truncated_ranges=0):
+        """
+        :param accept_ranges: respond to Range requests, set to False to test the single stream fallbacks
+        :param validators: send ETag and Last-Modified headers, set to False to test servers without them
+        :param truncated_ranges: number of range requests answered with the first half of the range only, with a
+               matching Content-Length, as a misbehaving proxy would
+        """
+
+        _Server.__init__(self, folder, host, port)
+        self.accept_ranges = accept_ranges
+        self.validators = validators
+        self.truncated_ranges = truncated_ranges
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sending(self):
+        """ count the responses whose body is being sent """
+
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def truncate_range(self):
+        """ return True if the next range response should be truncated """
+
+        with self._lock:
+            if self.truncated_ranges <= 0:
+                return False
+            self.truncated_ranges -= 1
+            return True
+
+    def _create_server(self):
+        server = ThreadingHTTPServer((self.host, self.port), _HttpHandler)
+        server.daemon_threads = True
+        server.accept_ranges = self.accept_ranges
+        server.validators = self.validators
+        server.requests = self.requests
+        server.truncate_range = self.truncate_range
+        server.sending = self.sending
+        return server
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def send_response(self, code, message=None):
+        self.server.requests.append((self.command, self.path, self.headers.get('Range'), code))
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def _respond(self, send_body):
+        path = os.path.join(self.server.folder, self.path.lstrip('/').split('?')[0])
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = '"{:x}-{:x}"'.format(stat.st_mtime_ns, size)
+        last_modified = self.date_time_string(stat.st_mtime)
+        start, end = 0, size - 1
+
+        if self.server.validators and self._not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        partial = self.server.accept_ranges and match and (
+            if_range is None or (self.server.validators and if_range in (etag, last_modified)))
+        if partial:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+            if self.server.truncate_range():
+                end = start + (end - start) // 2
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(end - start + 1))
+        if self.server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        if send_body:
+            with self.server.sending(), open(path, 'rb') as f:
+                f.seek(start)
+                _copy(f, self.wfile.write, end - start + 1)
+
+    def _not_modified(self, etag, mtime):
+        """ If-None-Match takes precedence over If-Modified-Since """
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+
+
+class FtpServer(_Server):
+    """ minimal FTP server with anonymous login, passive mode (PASV/EPSV), RETR with REST, SIZE, MDTM, LIST and NLST,
+    enough for urllib and ftplib clients """
+
+    scheme = 'ftp'
+
+    def _create_server(self):
+        server = socketserver.ThreadingTCPServer((self.host, self.port), _FtpHandler)
+        server.daemon_threads = True
+        return server
+
+
+class _FtpHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.cwd = '/'
+        self.rest = 0
+        self.passive = None
+        self.reply('220 benchmark ftp server ready')
+
+        for line in self.rfile:
+            command, _, argument = line.decode('utf-8').rstrip('\r\n').partition(' ')
+            handler = getattr(self, 'ftp_' + command.upper(), None)
+            if handler is None:
+                self.reply('502 command not implemented')
+                continue
+            if handler(argument) is False:
+                break
+
+        if self.passive is not None:
+            self.passive.close()
+
+    def reply(self, message):
+        self.wfile.write((message + '\r\n').encode('utf-8'))
+
+    def ftp_USER(self, argument):
+        self.reply('331 password required')
+
+    def ftp_PASS(self, argument):
+        self.reply('230 logged in')
+
+    def ftp_SYST(self, argument):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_FEAT(self, argument):
+        self.reply('211-features\r\n SIZE\r\n MDTM\r\n REST STREAM\r\n EPSV\r\n211 end')
+
+    def ftp_TYPE(self, argument):
+        self.reply('200 type set to {}'.format(argument))
+
+    def ftp_NOOP(self, argument):
+        self.reply('200 ok')
+
+    def ftp_PWD(self, argument):
+        self.reply('257 "{}"'.format(self.cwd))
+
+    def ftp_CWD(self, argument):
+        cwd = os.path.normpath(os.path.join(self.cwd, argument)).replace(os.sep, '/')
+        if not os.path.isdir(self._local_path(cwd)):
+            self.reply('550 no such directory')
+            return
+        self.cwd = cwd
+        self.reply('250 directory changed')
+
+    def ftp_PASV(self, argument):
+        self._listen()
+        host, port = self.passive.getsockname()[:2]
+        self.reply('227 entering passive mode ({},{},{})'.format(host.replace('.', ','), port >> 8, port & 0xff))
+
+    def ftp_EPSV(self, argument):
+        self._listen()
+        self.reply('229 entering extended passive mode (|||{}|)'.format(self.passive.getsockname()[1]))
+
+    def ftp_SIZE(self, argument):
+        path = self._local_path(argument)
+        if not os.path.isfile(path):
+            self.reply('550 no such file')
+            return
+        self.reply('213 {}'.format(os.path.getsize(path)))
+
+    def ftp_MDTM(self, argument):
+        path = self._local_path(argument)
+        if not os.path.isfile(path):
+            self.reply('550 no such file')
+            return
+        self.reply('213 {}'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime(os.path.getmtime(path)))))
+
+    def ftp_REST(self, argument):
+        self.rest = int(argument)
+        self.reply('350 restarting at {}'.format(self.rest))
+
+    def ftp_RETR(self, argument):
+        path = self._local_path(argument)
+        if not os.path.isfile(path):
+            self.rest = 0
+            self.reply('550 no such file')
+            return
+
+        offset, self.rest = self.rest, 0
+        with self._data_connection() as connection, open(path, 'rb') as f:
+            f.seek(offset)
+            _copy(f, connection.sendall, os.path.getsize(path) - offset)
+        self.reply('226 transfer complete')
+
+    def ftp_LIST(self, argument):
+        self._send_listing(argument, detailed=True)
+
+    def ftp_NLST(self, argument):
+        self._send_listing(argument, detailed=False)
+
+    def ftp_QUIT(self, argument):
+        self.reply('221 goodbye')
+        return False
+
+    def _send_listing(self, argument, detailed):
+        argument = '' if argument.startswith('-') else argument
+        folder = self._local_path(argument)
+        if not os.path.isdir(folder):
+            self.reply('550 no such directory')
+            return
+
+        lines = []
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if detailed:
+                lines.append('{}rw-r--r-- 1 ftp ftp {:>12} {} {}'.format(
+                    'd' if os.path.isdir(path) else '-', os.path.getsize(path),
+                    time.strftime('%b %d %H:%M', time.gmtime(os.path.getmtime(path))), name))
+            else:
+                lines.append(name)
+
+        with self._data_connection() as connection:
+            connection.sendall(''.join(line + '\r\n' for line in lines).encode('utf-8'))
+        self.reply('226 transfer complete')
+
+    def _listen(self):
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.server.server_address[0], 0))
+        self.passive.listen(1)
+
+    def _data_connection(self):
+        """ accept the data connection opened by the client after PASV or EPSV """
+
+        self.reply('150 opening data connection')
+        connection, _ = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        return connection
+
+    def _local_path(self, path):
+        path = os.path.normpath(os.path.join(self.cwd, path)).lstrip('/\\')
+        return os.path.join(self.server.folder, path)
+
+
+def _copy(source, write, length, chunk_size=1024 * 1024):
+    """ write length bytes from a file object in chunks """
+
+    while length > 0:
+        chunk = source.read(min(chunk_size, length))
+        if not chunk:
+            break
+        write(chunk)
+        length -= len(chunk)
@@ -0,0 +1,77 @@
+""" synthetic sources of a configurable size for every download type: plain csv text (url and ftp), a zip with one or
+more csv members, a folder of csv files, a gzip compressed csv, and a nested XML document
+"""
+
+__author__ = 'alsherman'
+
+import os
+import gzip
+import shutil
+import zipfile
+from .bench_xml_parser import write_xml
+
+header = 'id,amount,category,code'
+
+
+def iter_lines(rows):
+    """ yield the lines of a synthetic csv with int, float, and str columns, starting with the header
+
+    :param rows: number of data rows
+    """
+
+    yield header + '\n'
+    for i in range(rows):
+        yield '{},{}.{},cat{},C{}\n'.format(i, i % 1000, i % 100, i % 50, i % 9973)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        f.writelines(iter_lines(rows))
+
+
+def write_zip(path, csv_path, members=1):
+    """ write a zip with copies of a csv
+
+    :param path: path of the zip to create
+    :param csv_path: csv added to the zip
+    :param members: number of copies, named data_0.csv, data_1.csv, ...
+    """
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zfile:
+        for member in range(members):
+            zfile.write(csv_path, 'data_{}.csv'.format(member))
+
+
+def write_gzip(path, csv_path):
+    with open(csv_path, 'rb') as source, gzip.open(path, 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target)
+
+
+def write_sources(folder, rows, items, zip_members=2):
+    """ write every synthetic source to a folder
+
+    :param folder: folder to write the sources to
+    :param rows: number of rows in the csv sources
+    :param items: number of <record> items in the XML source
+    :param zip_members: number of csv files in the multi member zip, and in the folder of files fetched over ftp
+    :return: dict of source name to file (or folder) name in the folder
+    """
+
+    sources = {'csv': 'data.csv',
+               'zip': 'data.zip',
+               'zip_members': 'members.zip',
+               'gzip': 'data.csv.gz',
+               'xml': 'records.xml',
+               'ftp_files': 'files/'}
+
+    csv_path = os.path.join(folder, sources['csv'])
+    write_csv(csv_path, rows)
+    write_zip(os.path.join(folder, sources['zip']), csv_path)
+    write_zip(os.path.join(folder, sources['zip_members']), csv_path, members=zip_members)
+    write_gzip(os.path.join(folder, sources['gzip']), csv_path)
+    write_xml(os.path.join(folder, sources['xml']), items)
+
+    os.makedirs(os.path.join(folder, sources['ftp_files']))
+    for member in range(zip_members):
+        shutil.copyfile(csv_path, os.path.join(folder, sources['ftp_files'], 'data_{}.csv'.format(member)))
+    return sources
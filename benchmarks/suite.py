@@ -0,0 +1,428 @@
+""" benchmark every download type, parser and export format, per stage and end to end through
+DataPipeline.run_pipeline, on synthetic sources served from local HTTP and FTP stand-ins
+
+Each case runs in a fresh process, so peak memory is not shared between cases. Results can be saved as a baseline and
+later runs compared against it; the comparison exits with status 1 when a case is slower or uses more memory than the
+baseline by more than the tolerance. Baselines are only comparable on the same machine with the same arguments.
+
+usage:
+    python -m benchmarks.suite --rows 1000000 --save benchmarks/baseline.json
+    python -m benchmarks.suite --rows 1000000 --compare benchmarks/baseline.json
+    python -m benchmarks.suite --only 'download.*'
+"""
+
+__author__ = 'alsherman'
+
+import io
+import os
+import sys
+import json
+import time
+import fnmatch
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from .servers import HttpServer, FtpServer
+from .sources import write_sources
+from data_pipeline.stream_pipeline import streaming
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+def source(context, download_type, name, data_category='benchmark', server='http', **options):
+    """ return the sources_metadata for a synthetic source
+
+    :param context: benchmark context, see main
+    :param download_type: url, zip, gzip or ftp
+    :param name: name of the source in context['sources'], e.g. csv
+    :param data_category: name of the data category
+    :param server: http or ftp
+    :param options: data category options, e.g. stream or zip_members
+    """
+
+    output_names = options.pop('output_names', [data_category])
+    return {'source_name': 'benchmark',
+            'full_name': 'benchmark',
+            'website': '',
+            'source_path': '',
+            'headers': dict.fromkeys(output_names + [data_category]),
+            'output_path': {output_name: output_name + '.csv' for output_name in output_names + [data_category]},
+            'data_categories': {data_category: dict({'download_type': download_type,
+                                                     'external': context[server] + context['sources'][name],
+                                                     'cache': False}, **options)}}
+
+
+def download(context, sources_metadata):
+    """ time DownloadData.download, consuming streamed downloads """
+
+    from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+    from data_pipeline.download_data.download_data import DownloadData
+
+    source_metadata = SourceMetadata(sources_metadata, 'benchmark')
+
+    def run():
+        data = DownloadData(source_metadata).download(source_metadata.download_type)
+        members = data if isinstance(data, dict) else {None: data}
+        size = rows = 0
+        for member in members.values():
+            for chunk in ([member] if isinstance(member, (str, bytes)) else member):
+                size += len(chunk)
+                rows += chunk.count('\n' if isinstance(chunk, str) else b'\n')  # chunks may be lines or blocks
+        return {'bytes': size, 'rows': rows}
+
+    return run
+
+
+def parse(context, sources_metadata):
+    """ download outside of the timed section, then time DataframeCreator.create_dataframe """
+
+    from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+    from data_pipeline.download_data.download_data import DownloadData
+    from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+    source_metadata = SourceMetadata(sources_metadata, 'benchmark')
+    source_metadata.downloaded_data = DownloadData(source_metadata).download(source_metadata.download_type)
+
+    def run():
+        return _count(DataframeCreator(source_metadata).create_dataframe())
+
+    return run
+
+
+def parse_local(context, parallel):
+    """ time DataframeCreator.create_dataframe on the local csv source, in one process or split across processes """
+
+    from data_pipeline.sources_metadata.source_metadata import SourceMetadata, config
+    from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+    if not config.has_section('PARALLELPARSE'):
+        config.add_section('PARALLELPARSE')
+    config['PARALLELPARSE']['min_file_size_mb'] = '0'
+
+    path = os.path.join(context['folder'], context['sources']['csv'])
+    sources_metadata = source(context, 'url', 'csv', local=path, parallel_parse=parallel)
+    source_metadata = SourceMetadata(sources_metadata, 'benchmark', local=True)
+
+    def run():
+        return dict(_count(DataframeCreator(source_metadata).create_dataframe()), bytes=os.path.getsize(path))
+
+    return run
+
+
+def parse_xml(context, engine):
+    """ time parsing the XML source with the tree, stream or parallel engine """
+
+    from . import bench_xml_parser
+
+    path = os.path.join(context['folder'], context['sources']['xml'])
+    engines = {'tree': bench_xml_parser.run_tree,
+               'stream': bench_xml_parser.run_stream,
+               'parallel': bench_xml_parser.run_parallel}
+
+    def run():
+        return {'rows': engines[engine](path), 'bytes': os.path.getsize(path)}
+
+    return run
+
+
+def export(context, output_format):
+    """ parse the csv source outside of the timed section, then time exporting it with CSVCreator """
+
+    import pandas as pd
+    from types import SimpleNamespace
+    from data_pipeline.export_data.create_csv import CSVCreator
+
+    df = pd.read_csv(os.path.join(context['folder'], context['sources']['csv']))
+    path = os.path.join(context['output_folder'], 'export')
+    source_metadata = SimpleNamespace(output_path=path, data_category='export', dataframe=None,
+                                      create_output_path=lambda data_category, sources_metadata: path)
+
+    def run():
+        source_metadata.dataframe = df
+        output = CSVCreator(source_metadata).create_csv({'output_format': output_format})[0]
+        return {'rows': len(df), 'bytes': os.path.getsize(output)}
+
+    return run
+
+
+def export_delta(context, output_format):
+    """ export the csv source once outside of the timed section, then time exporting it again with delta_keys, with
+    0.1% of the rows changed """
+
+    import pandas as pd
+    from types import SimpleNamespace
+    from data_pipeline.export_data.create_csv import CSVCreator
+
+    df = pd.read_csv(os.path.join(context['folder'], context['sources']['csv']))
+    path = os.path.join(context['output_folder'], 'delta.' + output_format)
+    source_metadata = SimpleNamespace(output_path=path, data_category='export', dataframe=df,
+                                      create_output_path=lambda data_category, sources_metadata: path)
+    sources_metadata = {'output_format': output_format, 'delta_keys': ['id']}
+    CSVCreator(source_metadata).create_csv(sources_metadata)
+
+    changed = df.copy()
+    changed.loc[changed.index[::1000], 'amount'] = -1
+
+    def run():
+        source_metadata.dataframe = changed
+        output = CSVCreator(source_metadata).create_csv(sources_metadata)[0]
+        return {'rows': len(df), 'bytes': os.path.getsize(output)}
+
+    return run
+
+
+def end_to_end(context, sources_metadata, func=None):
+    """ time DataPipeline.run_pipeline, and break the time down by stage with the pipeline metrics """
+
+    from data_pipeline.sources_metadata.source_metadata import config
+    from data_pipeline.data_pipeline import DataPipeline
+
+    if not config.has_section('INSTRUMENTATION'):
+        config.add_section('INSTRUMENTATION')
+    metrics_file = os.path.join(context['output_folder'], 'metrics.{}.jsonl'.format(os.getpid()))
+    config['INSTRUMENTATION']['metrics_file'] = metrics_file
+
+    pipeline = DataPipeline(name='benchmark', sources_metadata=sources_metadata, data_category='benchmark',
+                            func=func or clean_csv, force=True)
+
+    def run():
+        pipeline.run_pipeline()
+        with open(metrics_file) as f:
+            record = json.loads(f.readlines()[-1])
+        return {'rows': record.get('rows'),
+                'bytes': record.get('downloaded_bytes'),
+                'stages': {stage: record['stages'][stage]['wall_seconds']
+                           for stage in ('extract', 'fingerprint', 'parse', 'transform', 'load') if stage in record['stages']}}
+
+    return run
+
+
+def clean_csv(source_metadata):
+    from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+@streaming
+def clean_csv_chunks(source_metadata, chunks):
+    return chunks
+
+
+def clean_xml(source_metadata):
+    from data_pipeline.transform_data.xml_parser import XmlElementParser
+    from data_pipeline.transform_data.xml_stream_parser import XmlStreamParser
+    from .bench_xml_parser import record_id
+
+    XmlElementParser.all_data = {'records': [], 'tags': []}
+    data_list = [(['name', ('record', 'id')], None, XmlElementParser.all_data['records']),
+                 (['tag'], 'tags', XmlElementParser.all_data['tags'])]
+    XmlStreamParser(io.BytesIO(source_metadata.downloaded_data.encode('utf-8')), 'record').extract_data(
+        data_list, row_start=record_id)
+    XmlElementParser.create_dataframes(source_metadata.sources_metadata)
+    return XmlElementParser.all_data
+
+
+def _count(dataframe):
+    dataframes = dataframe.values() if isinstance(dataframe, dict) else [dataframe]
+    return {'rows': sum(len(df) for df in dataframes),
+            'bytes': sum(int(df.memory_usage(deep=True).sum()) for df in dataframes)}
+
+
+def cases(context):
+    """ return the benchmark cases as (name, function, arguments) """
+
+    members = ['data_{}.csv'.format(member) for member in range(context['zip_members'])]
+    xml_source = dict(source(context, 'url', 'xml'), headers={'benchmark': None,
+                                                              'records': ['id', 'name', 'record_id'],
+                                                              'tags': ['id', 'tag']},
+                      output_path={'benchmark': 'benchmark.csv', 'records': 'records.csv', 'tags': 'tags.csv'})
+
+    sources = [('url', source(context, 'url', 'csv')),
+               ('url_stream', source(context, 'url', 'csv', stream=True)),
+               ('zip', source(context, 'zip', 'zip')),
+               ('zip_members', source(context, 'zip', 'zip_members', zip_members='*.csv', output_names=members)),
+               ('zip_remote', source(context, 'zip', 'zip_members', zip_members='*.csv', output_names=members,
+                                     remote_zip=True)),
+               ('gzip', source(context, 'gzip', 'gzip')),
+               ('gzip_stream', source(context, 'gzip', 'gzip', stream=True)),
+               ('ftp', source(context, 'ftp', 'csv', server='ftp')),
+               ('ftp_stream', source(context, 'ftp', 'csv', server='ftp', stream=True)),
+               ('ftp_files', source(context, 'ftp', 'ftp_files', server='ftp', ftp_files='*.csv', output_names=members))]
+
+    return ([('download.' + name, download, (metadata,)) for name, metadata in sources] +
+            [('parse.' + name, parse, (metadata,)) for name, metadata in sources] +
+            [('parse.local', parse_local, (False,)), ('parse.local_parallel', parse_local, (True,))] +
+            [('parse.xml_' + engine, parse_xml, (engine,)) for engine in context['xml_engines']] +
+            [('export.' + output_format, export, (output_format,))
+             for output_format in ['csv', 'csv.gz', 'csv.zst', 'parquet', 'feather']] +
+            [('export.delta_' + output_format, export_delta, (output_format,)) for output_format in ['csv', 'parquet']] +
+            [('end_to_end.' + name, end_to_end, (metadata,)) for name, metadata in sources] +
+            [('end_to_end.url_stream_chunks', end_to_end, (source(context, 'url', 'csv', stream=True), clean_csv_chunks)),
+             ('end_to_end.xml', end_to_end, (xml_source, clean_xml))])
+
+
+def _measure(case, context, args, trace, queue):
+    """ run one case in a fresh process so peak memory is not shared between cases """
+
+    try:
+        from data_pipeline.sources_metadata.source_metadata import SourceMetadata, config
+        SourceMetadata.users_local_raw_data_folder = context['output_folder']
+        # every run downloads the ftp files again, rather than skipping the files downloaded by the previous run
+        config.read_dict({'FTP': {'download_folder': tempfile.mkdtemp(dir=context['folder'])}})
+
+        run = case(context, *args)
+        if trace:
+            tracemalloc.start()  # slows the case down, so seconds are only comparable between traced runs
+
+        start = time.perf_counter()
+        result = run()
+        result['seconds'] = time.perf_counter() - start
+
+        result['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20 if trace else None
+        result['max_rss_mb'] = None
+        if resource is not None:
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result['max_rss_mb'] = max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def measure(case, context, args, repeat=1, trace=False):
+    """ run a case repeat times, each in a fresh process
+
+    :return: dict with the median, min and max seconds, throughput, and the highest peak memory of the runs
+    """
+
+    runs = []
+    for _ in range(repeat):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_measure, args=(case, context, args, trace, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        if 'error' in result:
+            return result
+        runs.append(result)
+
+    seconds = statistics.median(run['seconds'] for run in runs)
+    summary = {'seconds': seconds,
+               'min_seconds': min(run['seconds'] for run in runs),
+               'max_seconds': max(run['seconds'] for run in runs),
+               'rows': runs[0]['rows'],
+               'rows_per_second': runs[0]['rows'] / seconds if runs[0]['rows'] else None,
+               'mb_per_second': runs[0]['bytes'] / 2 ** 20 / seconds if runs[0]['bytes'] else None,
+               'max_rss_mb': max((run['max_rss_mb'] for run in runs), default=None),
+               'tracemalloc_peak_mb': max((run['tracemalloc_peak_mb'] or 0 for run in runs), default=None) or None}
+    if 'stages' in runs[0]:
+        summary['stages'] = {stage: statistics.median(run['stages'][stage] for run in runs)
+                             for stage in runs[0]['stages']}
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """ return the cases that are slower or use more memory than the baseline by more than the tolerance
+
+    :param results: cases of the current run
+    :param baseline: cases of the baseline
+    :param tolerance: allowed increase, e.g. 0.2 for 20%
+    :return: list of (case, metric, baseline value, current value)
+    """
+
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or 'error' in result or 'error' in previous:
+            continue
+        for metric in ('seconds', 'max_rss_mb'):
+            if previous.get(metric) and result.get(metric) and result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append((name, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def _format(name, result, previous=None):
+    if 'error' in result:
+        return '{:<28} error: {}'.format(name, result['error'])
+
+    line = '{:<28} {:>8.3f}s  {:>12}  {:>9}  max rss {:>7.1f} MB'.format(
+        name, result['seconds'],
+        '{:.0f} rows/s'.format(result['rows_per_second']) if result['rows_per_second'] else '',
+        '{:.1f} MB/s'.format(result['mb_per_second']) if result['mb_per_second'] else '',
+        result['max_rss_mb'] or 0)
+    if previous and previous.get('seconds'):
+        line += '  {:+.0%} vs baseline'.format(result['seconds'] / previous['seconds'] - 1)
+    if result.get('stages'):
+        line += '  ({})'.format(', '.join('{} {:.3f}s'.format(stage, seconds)
+                                          for stage, seconds in result['stages'].items()))
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='number of rows in the csv sources')
+    parser.add_argument('--items', type=int, default=50000, help='number of <record> items in the XML source')
+    parser.add_argument('--zip-members', type=int, default=2, help='number of csv files in the multi member zip')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each case')
+    parser.add_argument('--only', action='append', help='run the cases that match a pattern, e.g. "parse.*"')
+    parser.add_argument('--with-tree', action='store_true', help='include the slow BeautifulSoup XML parser')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report the peak of python allocations')
+    parser.add_argument('--save', help='save the results as a baseline to this path')
+    parser.add_argument('--compare', help='compare the results to the baseline at this path')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed increase over the baseline')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['arguments'] != {'rows': args.rows, 'items': args.items, 'zip_members': args.zip_members}:
+            print('warning: the baseline was run with {}'.format(baseline['arguments']))
+
+    with tempfile.TemporaryDirectory() as folder, HttpServer(folder) as http, FtpServer(folder) as ftp:
+        output_folder = os.path.join(folder, 'output')
+        os.makedirs(output_folder)
+
+        start = time.perf_counter()
+        context = {'folder': folder,
+                   'output_folder': output_folder,
+                   'sources': write_sources(folder, args.rows, args.items, zip_members=args.zip_members),
+                   'http': http.url(''),
+                   'ftp': ftp.url(''),
+                   'zip_members': args.zip_members,
+                   'xml_engines': ['stream', 'parallel'] + (['tree'] if args.with_tree else [])}
+        print('sources: {} rows, {} XML items, generated in {:.1f}s'.format(
+            args.rows, args.items, time.perf_counter() - start))
+
+        results = {}
+        for name, case, case_args in cases(context):
+            if args.only and not any(fnmatch.fnmatch(name, pattern) for pattern in args.only):
+                continue
+            results[name] = measure(case, context, case_args, repeat=args.repeat, trace=args.tracemalloc)
+            previous = baseline['cases'].get(name) if baseline else None
+            print(_format(name, results[name], previous))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'arguments': {'rows': args.rows, 'items': args.items, 'zip_members': args.zip_members},
+                       'machine': {'python': platform.python_version(),
+                                   'platform': platform.platform(),
+                                   'cpus': os.cpu_count()},
+                       'cases': results}, f, indent=2, sort_keys=True)
+        print('saved baseline to {}'.format(args.save))
+
+    if baseline:
+        regressions = compare(results, baseline['cases'], args.tolerance)
+        for name, metric, previous, current in regressions:
+            print('regression: {} {} {:.3f} -> {:.3f}'.format(name, metric, previous, current))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+""" framework to simplify repetitive code when downloading, cleaning, and exporting open source datasets from the web
+
+The public classes are imported when they are first used, so importing the package (e.g. to run the command line
+interface, python -m data_pipeline) does not import pandas, requests or read config.ini until they are needed.
+"""
+
+__author__ = 'alsherman'
+
+import importlib
+
+# public name: module that defines it
+_exports = {'DataPipeline': '.data_pipeline',
+            'BatchRunner': '.batch_runner',
+            'BatchSummary': '.batch_runner',
+            'SourceMetadata': '.sources_metadata.source_metadata',
+            'config': '.sources_metadata.source_metadata',
+            'FingerprintManifest': '.fingerprint',
+            'PipelineMetrics': '.instrumentation',
+            'streaming': '.stream_pipeline'}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value  # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,212 @@
+""" command line interface to run and inspect data pipelines
+
+The jobs are read from a python module (a dotted module name or a path to a .py file) that defines a list named jobs
+of (sources_metadata, data_category, func) tuples, as passed to BatchRunner. Keep heavy imports (e.g. pandas) inside
+the cleaning functions, so list, dry-run and status start quickly.
+
+usage:
+    python -m data_pipeline run my_jobs.py --only 'census*'
+    python -m data_pipeline list my_jobs.py
+    python -m data_pipeline dry-run my_jobs.py
+    python -m data_pipeline status my_jobs.py
+    python -m data_pipeline --config /etc/data_pipeline/config.ini run my_jobs
+"""
+
+__author__ = 'alsherman'
+
+import os
+import sys
+import time
+import fnmatch
+import logging
+import argparse
+import importlib
+import importlib.util
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_jobs(jobs_module, only=None):
+    """ import the jobs module and return its jobs
+
+    :param jobs_module: dotted module name, or path to a .py file, that defines a list named jobs
+    :param only: patterns matched against the job names ('source_name - data_category'), None returns every job
+    :return: list of (name, sources_metadata, data_category, func)
+    """
+
+    if jobs_module.endswith('.py') or os.path.sep in jobs_module:
+        name = os.path.splitext(os.path.basename(jobs_module))[0]
+        spec = importlib.util.spec_from_file_location(name, jobs_module)
+        module = importlib.util.module_from_spec(spec)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(jobs_module)))  # allow imports next to the jobs file
+        sys.modules[name] = module  # cleaning functions are pickled by module name to run in the process pool
+        spec.loader.exec_module(module)
+    else:
+        sys.path.insert(0, os.getcwd())
+        module = importlib.import_module(jobs_module)
+
+    jobs = []
+    for sources_metadata, data_category, func in module.jobs:
+        name = '{} - {}'.format(sources_metadata['source_name'], data_category)
+        if only and not any(fnmatch.fnmatch(name, pattern) for pattern in only):
+            continue
+        jobs.append((name, sources_metadata, data_category, func))
+    return jobs
+
+
+def run(args):
+    """ run the jobs with BatchRunner, or one at a time with --serial """
+
+    from .batch_runner import BatchRunner, BatchSummary, JobResult
+    from .data_pipeline import DataPipeline
+
+    jobs = load_jobs(args.jobs, args.only)
+    if not jobs:
+        logger.error('no jobs to run')
+        return 1
+
+    if args.serial:
+        results = []
+        for name, sources_metadata, data_category, func in jobs:
+            result = JobResult(name)
+            result.started = time.time()
+            try:
+                pipeline = DataPipeline(name, sources_metadata, data_category, func, local=args.local, force=args.force)
+                result.succeed(pipeline.run_pipeline())
+            except Exception as e:
+                result.fail('run', e)
+                logger.error('{} failed: {!r}'.format(name, e))
+            results.append(result)
+        summary = BatchSummary(results)
+        logger.info(summary.report())
+    else:
+        summary = BatchRunner([(sources_metadata, data_category, func) for _, sources_metadata, data_category, func in jobs],
+                              download_workers=args.workers,
+                              transform_workers=args.transform_workers,
+                              per_host_limit=args.per_host_limit,
+                              timeout=args.timeout,
+                              use_processes=not args.threads,
+                              local=args.local,
+                              force=args.force).run()
+
+    print(summary.report())
+    return 1 if summary.failures else 0
+
+
+def list_jobs(args):
+    """ print each job's download type, source and output """
+
+    from .sources_metadata.source_metadata import SourceMetadata
+
+    for name, sources_metadata, data_category, func in load_jobs(args.jobs, args.only):
+        data_category_metadata = sources_metadata['data_categories'][data_category]
+        print('{}\n    {}: {}\n    output: {}'.format(
+            name,
+            data_category_metadata['download_type'],
+            data_category_metadata.get('external') or data_category_metadata.get('local'),
+            os.path.join(SourceMetadata.users_local_raw_data_folder, sources_metadata['output_path'][data_category])))
+    return 0
+
+
+def dry_run(args):
+    """ validate the metadata of each job and print what a run would do, without downloading anything """
+
+    from .sources_metadata.source_metadata import SourceMetadata
+    from .fingerprint import FingerprintManifest
+
+    invalid = 0
+    for name, sources_metadata, data_category, func in load_jobs(args.jobs, args.only):
+        try:
+            source_metadata = SourceMetadata(sources_metadata, data_category, local=args.local)
+            source = source_metadata.raw_data_path
+        except (KeyError, TypeError) as e:
+            invalid += 1
+            print('{}\n    invalid metadata, missing {}'.format(name, e))
+            continue
+
+        entry = FingerprintManifest(os.path.dirname(source_metadata.output_path)).entries().get(
+            '{}/{}'.format(sources_metadata['source_name'], data_category))
+        if args.force or entry is None:
+            plan = 'rebuild, {}'.format('forced' if args.force else 'never exported')
+        else:
+            plan = 'rebuild if the source, cleaning function or metadata changed since the last export'
+
+        print('{}\n    download: {} {}{}\n    clean: {}\n    export: {}\n    plan: {}'.format(
+            name, source_metadata.download_type, source, ' (stream)' if source_metadata.stream else '',
+            getattr(func, '__qualname__', repr(func)) + (' (streaming)' if getattr(func, 'streaming', False) else ''),
+            source_metadata.output_path, plan))
+
+    return 1 if invalid else 0
+
+
+def status(args):
+    """ print when each job was last exported, from the fingerprint manifest, and whether its outputs still exist """
+
+    from .sources_metadata.source_metadata import SourceMetadata
+    from .fingerprint import FingerprintManifest
+
+    for name, sources_metadata, data_category, func in load_jobs(args.jobs, args.only):
+        output_path = os.path.join(SourceMetadata.users_local_raw_data_folder, sources_metadata['output_path'][data_category])
+        entry = FingerprintManifest(os.path.dirname(output_path)).entries().get(
+            '{}/{}'.format(sources_metadata['source_name'], data_category))
+
+        if entry is None:
+            print('{}\n    never exported'.format(name))
+            continue
+
+        print(name)
+        for output in entry['outputs']:
+            if os.path.exists(output):
+                print('    {}  {:.1f} MB  modified {}'.format(output, os.path.getsize(output) / 2 ** 20,
+                                                            time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                          time.localtime(os.path.getmtime(output)))))
+            else:
+                print('    {}  missing, the next run will rebuild it'.format(output))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m data_pipeline', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', help='path to config.ini, defaults to $DATA_PIPELINE_CONFIG, ./config.ini, or the '
+                                         'config.ini next to the package')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log debug messages')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(name, func, help_text):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('jobs', help='module or .py file that defines a list named jobs')
+        command.add_argument('--only', action='append', help="run the jobs whose name matches a pattern, e.g. 'census*'")
+        command.set_defaults(func=func)
+        return command
+
+    run_command = add_command('run', run, 'download, clean and export the jobs')
+    run_command.add_argument('--force', action='store_true', help='rebuild sources that have not changed')
+    run_command.add_argument('--local', action='store_true', help='use local files instead of downloading')
+    run_command.add_argument('--serial', action='store_true', help='run one job at a time with DataPipeline')
+    run_command.add_argument('--threads', action='store_true', help='run cleaning functions in threads, not processes')
+    run_command.add_argument('--workers', type=int, default=8, help='download and export threads')
+    run_command.add_argument('--transform-workers', type=int, help='cleaning processes, defaults to the number of cpus')
+    run_command.add_argument('--per-host-limit', type=int, default=2, help='concurrent downloads from one host')
+    run_command.add_argument('--timeout', type=float, help='seconds each job may run')
+
+    add_command('list', list_jobs, 'list the jobs')
+    dry_run_command = add_command('dry-run', dry_run, 'validate the jobs and show what a run would do')
+    dry_run_command.add_argument('--force', action='store_true', help='show the plan of a forced run')
+    dry_run_command.add_argument('--local', action='store_true', help='use local files instead of downloading')
+    add_command('status', status, 'show when each job was last exported')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    if args.config:
+        from .sources_metadata.source_metadata import config
+        config.load(args.config)
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+__author__ = 'alsherman'
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+from .data_pipeline import DataPipeline
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner:
+    """ Runs many data pipelines concurrently and isolates failures, so one dead source does not abort the batch.
+
+    Each job moves through the same stages as DataPipeline.run_pipeline:
+    1. Download the data on a bounded thread pool (network bound), limited to a number of concurrent downloads per host
+    2. Apply the custom data cleaning function in a process pool (CPU bound, e.g. XML parsing). Streamed downloads are
+       read by the cleaning function, so they are cleaned in the download task, within the limit of downloads per host
+    3. Export the data on the thread pool
+
+    Jobs with a streaming cleaning function download, parse, clean and export their data in one task on the thread pool,
+    holding their download slot for the host until the stream is consumed, see DataPipeline.stream
+    """
+
+    def __init__(self, jobs, download_workers=8, transform_workers=None, per_host_limit=2, timeout=None,
+                 use_processes=True, local=False, force=False):
+        """
+        :param jobs: list of (sources_metadata, data_category, func) tuples, one for each data_category to run
+        :param download_workers: number of threads used to download and export data
+        :param transform_workers: number of processes used to run cleaning functions, defaults to the number of cpus
+        :param per_host_limit: maximum number of concurrent downloads from a single host
+        :param timeout: seconds each job may run before it is recorded as failed, None means no timeout
+        :param use_processes: run cleaning functions in a process pool. Set to False for cleaning functions that
+               cannot be pickled (e.g. lambdas)
+        :param local: specifies whether to use a local file or download data (used for testing purposes)
+        :param force: clean and export every source, even those that have not changed since the last run
+        """
+
+        self.pipelines = [DataPipeline(name='{} - {}'.format(sources_metadata['source_name'], data_category),
+                                       sources_metadata=sources_metadata,
+                                       data_category=data_category,
+                                       func=func,
+                                       local=local,
+                                       force=force)
+                          for sources_metadata, data_category, func in jobs]
+        self.download_workers = download_workers
+        self.transform_workers = transform_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+
+    def run(self):
+        """ run every job and collect the outcome of each
+
+        :return: BatchSummary of successes and failures
+        """
+
+        logger.info('start batch of {} jobs'.format(len(self.pipelines)))
+
+        # jobs are tracked by their index, as several jobs may share a name (e.g. the same source and data category)
+        results = [JobResult(pipeline.name) for pipeline in self.pipelines]
+        pending = {}
+
+        thread_pool = ThreadPoolExecutor(max_workers=self.download_workers)
+        process_pool = thread_pool
+        if self.use_processes:
+            from concurrent.futures import ProcessPoolExecutor  # imports multiprocessing, so only when it is used
+            process_pool = ProcessPoolExecutor(max_workers=self.transform_workers)
+
+        try:
+            for index, pipeline in enumerate(self.pipelines):
+                extract = self._extract_and_stream if pipeline.streaming else self._extract
+                future = thread_pool.submit(extract, pipeline, results[index])
+                pending[future] = index
+
+            while pending:
+                done, _ = wait(pending, timeout=self._next_deadline(pending, results), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    index = pending.pop(future)
+                    pipeline, result = self.pipelines[index], results[index]
+
+                    if result.status is not None:
+                        continue  # already recorded as timed out
+
+                    try:
+                        output = future.result()
+                    except Exception as e:
+                        result.fail(result.stage, e)
+                        logger.error('{} failed during {}: {!r}'.format(pipeline.name, result.stage, e))
+                        continue
+
+                    if result.stage == 'extract' and output is None:
+                        result.succeed(outcome='skipped')
+                        logger.info('skipped {}, source is unchanged since the last run'.format(pipeline.name))
+                    elif result.stage == 'extract':
+                        result.stage = 'transform'
+                        pending[process_pool.submit(_transform, pipeline, output)] = index
+                    elif result.stage == 'transform':
+                        result.stage = 'load'
+                        pending[thread_pool.submit(_load, pipeline, output)] = index
+                    else:
+                        result.succeed(outcome='rebuilt')
+                        logger.info('completed {} in {:.2f}s'.format(pipeline.name, result.elapsed))
+
+                self._expire(pending, results)
+        finally:
+            thread_pool.shutdown(wait=False, cancel_futures=True)
+            if process_pool is not thread_pool:
+                process_pool.shutdown(wait=False, cancel_futures=True)
+
+        summary = BatchSummary(results)
+        logger.info(summary.report())
+        return summary
+
+    def _extract(self, pipeline, result):
+        """ download data for a single job, limiting concurrent downloads from the same host
+
+        :param pipeline: DataPipeline for the job
+        :param result: JobResult for the job, the job timeout starts when the download begins
+        :return: source metadata, including the downloaded data, or None if the source is unchanged since the last run.
+                 Streamed downloads are also cleaned, and the cleaned source metadata is returned
+        """
+
+        result.started = time.time()
+        result.stage = 'extract'
+        with self._host_semaphore(pipeline):
+            source_metadata = pipeline.extract()
+            if not _is_picklable_data(source_metadata.downloaded_data):
+                # a streamed download is only read by the cleaning function, so the job keeps its download slot for
+                # the host until the cleaning function has consumed it
+                source_metadata = self._check_unchanged(pipeline, source_metadata)
+                if source_metadata is None:
+                    return None
+                result.stage = 'transform'
+                return _transform(pipeline, source_metadata)
+
+        return self._check_unchanged(pipeline, source_metadata)
+
+    def _extract_and_stream(self, pipeline, result):
+        """ download, parse, clean and export the data of a streaming job in one task
+
+        A streamed download is only read as the chunks are parsed, so the job keeps its download slot for the host
+        until the stream is consumed. The stages of a streaming job run in threads that share the chunks, see
+        DataPipeline.stream
+
+        :param pipeline: DataPipeline for the job
+        :param result: JobResult for the job, the job timeout starts when the download begins
+        :return: source metadata, or None if the source is unchanged since the last run
+        """
+
+        result.started = time.time()
+        result.stage = 'extract'
+        with self._host_semaphore(pipeline):
+            source_metadata = self._check_unchanged(pipeline, pipeline.extract())
+            if source_metadata is None:
+                return None
+
+            result.stage = 'stream'
+            _stream(pipeline, source_metadata)
+        return source_metadata
+
+    @staticmethod
+    def _check_unchanged(pipeline, source_metadata):
+        """ return None if the source is unchanged since the last run, otherwise the source metadata """
+
+        if pipeline.is_unchanged(source_metadata):
+            pipeline.skip(source_metadata)
+            return None
+        return source_metadata
+
+    def _host_semaphore(self, pipeline):
+        """ return the semaphore shared by every job that downloads from the same host
+
+        :param pipeline: DataPipeline for the job
+        """
+
+        data_category = pipeline.sources_metadata['data_categories'][pipeline.data_category]
+        host = urlparse(data_category.get('external', '')).netloc
+
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def _next_deadline(self, pending, results):
+        """ seconds until the earliest running job times out, or None to wait until any job finishes a stage """
+
+        if self.timeout is None:
+            return None
+
+        started = [results[index].started for index in pending.values() if results[index].started is not None]
+        if not started:
+            return 1  # jobs are queued behind the thread pool, check again once they start
+
+        return max(0, min(started) + self.timeout - time.time())
+
+    def _expire(self, pending, results):
+        """ record jobs that exceeded the timeout as failed and stop tracking them
+
+        Note: running downloads and cleaning functions cannot be interrupted, their output is discarded instead
+        """
+
+        if self.timeout is None:
+            return
+
+        now = time.time()
+        for future, index in list(pending.items()):
+            result = results[index]
+            if result.started is not None and now - result.started > self.timeout:
+                future.cancel()
+                del pending[future]
+                result.fail(result.stage, TimeoutError('exceeded timeout of {}s'.format(self.timeout)))
+                logger.error('{} timed out during {}'.format(self.pipelines[index].name, result.stage))
+
+
+def _transform(pipeline, source_metadata):
+    """ apply the cleaning function, run in a worker process so must be defined at the module level
+
+    :return: source metadata including the cleaned dataframe(s), without the raw data to avoid sending it back
+    """
+
+    pipeline.transform(source_metadata)
+    source_metadata.downloaded_data = None
+    return source_metadata
+
+
+def _load(pipeline, source_metadata):
+    """ export the cleaned data, then emit the metrics of the run, which were returned with the source metadata from
+    the worker process """
+
+    pipeline.load(source_metadata)
+    source_metadata.metrics.emit('rebuilt')
+
+
+def _stream(pipeline, source_metadata):
+    """ parse, clean and export the data of a streaming job one chunk at a time, then emit the metrics of the run """
+
+    pipeline.stream(source_metadata)
+    source_metadata.metrics.emit('rebuilt')
+
+
+def _is_picklable_data(downloaded_data):
+    """ streamed downloads are lazy iterators, which cannot be sent to a worker process """
+
+    if isinstance(downloaded_data, dict):  # members of a zip
+        return all(_is_picklable_data(data) for data in downloaded_data.values())
+    return downloaded_data is None or isinstance(downloaded_data, (str, bytes, list, tuple))
+
+
+class JobResult:
+    """ outcome of a single job in a batch """
+
+    def __init__(self, name):
+        """
+        :param name: name of the job
+        """
+
+        self.name = name
+        self.status = None
+        self.outcome = None
+        self.stage = None  # the stage that is running, or that failed
+        self.error = None
+        self.started = None
+        self.elapsed = None
+
+    def __repr__(self):
+        return "<class: job_result>: {} - {}".format(self.name, self.status)
+
+    def succeed(self, outcome):
+        """
+        :param outcome: 'skipped' if the source was unchanged since the last run, otherwise 'rebuilt'
+        """
+
+        self.status = 'success'
+        self.outcome = outcome
+        self.elapsed = time.time() - self.started
+
+    def fail(self, stage, error):
+        """
+        :param stage: the stage that failed (extract, transform, load, or stream)
+        :param error: the exception raised
+        """
+
+        self.status = 'failure'
+        self.stage = stage
+        self.error = error
+        if self.started is not None:
+            self.elapsed = time.time() - self.started
+
+
+class BatchSummary:
+    """ summary of successes and failures for a batch of jobs """
+
+    def __init__(self, results):
+        """
+        :param results: list of JobResults in the order the jobs were passed in
+        """
+
+        self.results = results
+
+    @property
+    def successes(self):
+        return [result for result in self.results if result.status == 'success']
+
+    @property
+    def skipped(self):
+        return [result for result in self.results if result.outcome == 'skipped']
+
+    @property
+    def rebuilt(self):
+        return [result for result in self.results if result.outcome == 'rebuilt']
+
+    @property
+    def failures(self):
+        return [result for result in self.results if result.status == 'failure']
+
+    def report(self):
+        """ return a readable summary of the batch """
+
+        lines = ['batch completed: {} succeeded ({} rebuilt, {} skipped), {} failed'.format(
+            len(self.successes), len(self.rebuilt), len(self.skipped), len(self.failures))]
+        for result in self.failures:
+            lines.append('  FAILED {} during {}: {!r}'.format(result.name, result.stage, result.error))
+        return '\n'.join(lines)
@@ -0,0 +1,328 @@
+__author__ = 'alsherman'
+
+import os
+import json
+import time
+import uuid
+import shutil
+import pickle
+import hashlib
+import logging
+from .sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore:
+    """ on-disk store of the output of each stage of a pipeline run, used to resume a failed run from the last
+    completed stage instead of downloading and cleaning the data again
+
+    The stages are 'raw' (the downloaded data), 'parsed' (the dataframe created by DataframeCreator) and 'cleaned'
+    (the output of the cleaning function). Downloaded data is pickled and dataframes are written as feather (or
+    parquet) files, falling back to pickle for dataframes that arrow cannot store exactly (e.g. with a custom index,
+    or object columns whose type changes when read back).
+
+    The checkpoints of a run are stored in their own folder, with a JSON file for each stage that is written once the
+    stage's files are complete, so a crash never leaves a partial checkpoint behind. They are removed once the run
+    completes, and ignored once they are older than max_age. When the store grows past max_size, the oldest
+    checkpoints of other runs are removed.
+    """
+
+    stages = ('raw', 'parsed', 'cleaned')
+
+    def __init__(self, checkpoint_folder, max_size=None, max_age=None, file_format='feather'):
+        """
+        :param checkpoint_folder: folder to store the checkpoints in
+        :param max_size: maximum size of all checkpoints in bytes, None means no limit
+        :param max_age: seconds a checkpoint can be resumed from, None means no limit
+        :param file_format: 'feather', 'parquet' or 'pickle', the format of checkpointed dataframes
+        """
+
+        self.checkpoint_folder = checkpoint_folder
+        self.max_size = max_size
+        self.max_age = max_age
+        self.file_format = file_format
+        os.makedirs(checkpoint_folder, exist_ok=True)
+
+    @classmethod
+    def from_config(cls):
+        """ return the store set in the CHECKPOINT section of config.ini
+
+        :return: CheckpointStore, or None if checkpoints are not enabled
+        """
+
+        if not config.has_section('CHECKPOINT') or not config['CHECKPOINT'].getboolean('enabled', fallback=False):
+            return None
+
+        settings = config['CHECKPOINT']
+        return cls(checkpoint_folder=settings['checkpoint_folder'],
+                   max_size=settings.getint('max_size_mb', fallback=0) * 1024 * 1024 or None,
+                   max_age=settings.getfloat('max_age_hours', fallback=0) * 3600 or None,
+                   file_format=settings.get('format', fallback='feather'))
+
+    def save(self, key, stage, data, version=None):
+        """ checkpoint the output of a stage
+
+        :param key: key of the pipeline run, e.g. 'source_name/data_category'
+        :param stage: raw, parsed or cleaned
+        :param data: downloaded data (str, bytes, a list of rows or a dict of them), a dataframe, or a dict of
+               dataframes. Anything else (e.g. a lazy iterator) is not checkpointed
+        :param version: JSON serializable value that must match for the checkpoint to be loaded, e.g. the fingerprint
+               of the data and cleaning function
+        :return: True if the data was checkpointed
+        """
+
+        import pandas as pd  # imported when used, so importing the package stays fast
+
+        if isinstance(data, pd.DataFrame):
+            kind, frames = 'dataframe', {None: data}
+        elif isinstance(data, dict) and data and all(isinstance(df, pd.DataFrame) for df in data.values()):
+            kind, frames = 'dataframes', data
+        elif _is_materialized(data):
+            kind, frames = 'data', None
+        else:
+            logger.debug('{} data of {} cannot be checkpointed'.format(stage, key))
+            return False
+
+        folder = self._folder(key)
+        os.makedirs(folder, exist_ok=True)
+        self._remove(key, stage)
+        start = time.perf_counter()
+
+        files = []
+        try:
+            if frames is None:
+                files.append(self._write(folder, stage, None, data, 'pickle'))
+            else:
+                files.extend(self._write(folder, stage, name, df, self.file_format) for name, df in frames.items())
+        except OSError as e:
+            logger.error('unable to checkpoint {} data of {}: {}'.format(stage, key, e))
+            for file in files:
+                _remove_file(os.path.join(folder, file['path']))
+            return False
+
+        entry = {'key': key, 'stage': stage, 'kind': kind, 'version': _to_json(version), 'created': time.time(),
+                 'size': sum(file['size'] for file in files), 'files': files}
+        _write_json(os.path.join(folder, stage + '.json'), entry)
+        logger.info('checkpointed {} data of {} ({:.1f} MB) in {:.2f}s'.format(
+            stage, key, entry['size'] / 2 ** 20, time.perf_counter() - start))
+
+        self._evict(keep=key)
+        return True
+
+    def load(self, key, stage, version=None):
+        """ return the checkpointed output of a stage
+
+        :param key: key of the pipeline run
+        :param stage: raw, parsed or cleaned
+        :param version: value the checkpoint was saved with
+        :return: the checkpointed data, or None if there is no checkpoint, or it is expired or was saved with another
+                 version
+        """
+
+        entry = self._entry(key, stage)
+        if entry is None:
+            return None
+        if self.max_age is not None and time.time() - entry['created'] > self.max_age:
+            logger.info('{} checkpoint of {} expired'.format(stage, key))
+            self._remove(key, stage)
+            return None
+        if entry['version'] != _to_json(version):
+            logger.info('{} checkpoint of {} is out of date'.format(stage, key))
+            return None
+
+        folder = self._folder(key)
+        try:
+            data = {file['name']: self._read(folder, file) for file in entry['files']}
+        except (OSError, ValueError, pickle.UnpicklingError) as e:
+            logger.error('unable to load the {} checkpoint of {}: {!r}'.format(stage, key, e))
+            self._remove(key, stage)
+            return None
+
+        logger.info('resuming {} from the {} checkpoint of {}'.format(
+            key, stage, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created']))))
+        return data if entry['kind'] == 'dataframes' else data[None]
+
+    def clear(self, key):
+        """ remove every checkpoint of a pipeline run, once it is complete
+
+        :param key: key of the pipeline run
+        """
+
+        shutil.rmtree(self._folder(key), ignore_errors=True)
+
+    def entries(self):
+        """ return the entry of every checkpoint in the store """
+
+        entries = []
+        for folder in os.scandir(self.checkpoint_folder):
+            if not folder.is_dir():
+                continue
+            for stage in self.stages:
+                entry = _read_json(os.path.join(folder.path, stage + '.json'))
+                if entry is not None:
+                    entries.append(entry)
+        return entries
+
+    def _evict(self, keep):
+        """ remove expired checkpoints, then the oldest checkpoints until the store fits in max_size
+
+        :param keep: key of the run that was just checkpointed, never evicted
+        """
+
+        entries = sorted(self.entries(), key=lambda entry: entry['created'])
+        now = time.time()
+        total_size = sum(entry['size'] for entry in entries)
+
+        for entry in entries:
+            expired = self.max_age is not None and now - entry['created'] > self.max_age
+            over_size = self.max_size is not None and total_size > self.max_size
+            if entry['key'] == keep or not (expired or over_size):
+                continue
+
+            logger.info('Evicting the {} checkpoint of {}'.format(entry['stage'], entry['key']))
+            total_size -= entry['size']
+            self._remove(entry['key'], entry['stage'])
+            try:
+                os.rmdir(self._folder(entry['key']))  # only once every stage of the run is removed
+            except OSError:
+                pass
+
+    def _write(self, folder, stage, name, data, file_format):
+        """ write the data of a stage to a temp file and rename it once complete
+
+        :return: dict with the name, path, format and size of the file
+        """
+
+        if file_format not in ('feather', 'parquet', 'pickle'):
+            raise ValueError('unknown checkpoint format {}'.format(file_format))
+
+        path = '{}.{}.{}'.format(stage, hashlib.sha256(repr(name).encode('utf-8')).hexdigest()[:16], file_format)
+        temp_path = os.path.join(folder, '{}.{}.tmp'.format(path, uuid.uuid4().hex))
+        try:
+            if file_format != 'pickle':
+                try:
+                    if file_format == 'feather':
+                        data.to_feather(temp_path)
+                    else:
+                        data.to_parquet(temp_path)
+                except (ImportError, ValueError, TypeError, NotImplementedError) as e:
+                    # e.g. pyarrow is not installed, or the dataframe has a custom index or non string column names
+                    logger.debug('checkpointing {} as pickle: {!r}'.format(name, e))
+                    return self._write(folder, stage, name, data, 'pickle')
+                if not self._round_trips(data, temp_path, file_format):
+                    return self._write(folder, stage, name, data, 'pickle')
+            else:
+                with open(temp_path, 'wb') as f:
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, os.path.join(folder, path))
+        finally:
+            _remove_file(temp_path)
+
+        return {'name': name, 'path': path, 'format': file_format, 'size': os.path.getsize(os.path.join(folder, path))}
+
+    @staticmethod
+    def _round_trips(data, path, file_format):
+        """ feather and parquet do not store every pandas type, e.g. an object column of ints with missing values is
+        read back as floats, and object columns of strings as StringDtype. A resumed run must export the same data as
+        a run that was never interrupted, so dataframes whose types change are checkpointed as pickle
+
+        :return: True if the file is read back with the columns and types of the dataframe
+        """
+
+        import pandas as pd
+
+        stored = pd.read_feather(path) if file_format == 'feather' else pd.read_parquet(path)
+        if list(stored.columns) == list(data.columns) and stored.dtypes.equals(data.dtypes):
+            return True
+        logger.debug('checkpointing as pickle, {} does not store the types {}'.format(
+            file_format, {column: str(dtype) for column, dtype in data.dtypes.items()
+                          if stored.dtypes.get(column) != dtype}))
+        return False
+
+    @staticmethod
+    def _read(folder, file):
+        import pandas as pd
+
+        path = os.path.join(folder, file['path'])
+        if file['format'] == 'feather':
+            return pd.read_feather(path)
+        if file['format'] == 'parquet':
+            return pd.read_parquet(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _entry(self, key, stage):
+        return _read_json(os.path.join(self._folder(key), stage + '.json'))
+
+    def _remove(self, key, stage):
+        """ remove the checkpoint of a stage, the JSON file first so the checkpoint is never partially loaded """
+
+        folder = self._folder(key)
+        entry = self._entry(key, stage)
+        _remove_file(os.path.join(folder, stage + '.json'))
+        for file in entry['files'] if entry else []:
+            _remove_file(os.path.join(folder, file['path']))
+
+    def _folder(self, key):
+        return os.path.join(self.checkpoint_folder, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32])
+
+
+class RunCheckpoints:
+    """ the checkpoints of a single pipeline run, set on the SourceMetadata so every stage can save and resume its
+    output, including cleaning functions run in a BatchRunner worker process """
+
+    def __init__(self, store, key):
+        """
+        :param store: CheckpointStore
+        :param key: key of the pipeline run, e.g. 'source_name/data_category'
+        """
+
+        self.store = store
+        self.key = key
+
+    def save(self, stage, data, version=None):
+        return self.store.save(self.key, stage, data, version=version)
+
+    def load(self, stage, version=None):
+        return self.store.load(self.key, stage, version=version)
+
+    def clear(self):
+        self.store.clear(self.key)
+
+
+def _is_materialized(data):
+    """ downloaded data that is held in memory, rather than a lazy iterator over a stream """
+
+    if isinstance(data, dict):  # members of a zip
+        return bool(data) and all(isinstance(rows, (list, tuple)) for rows in data.values())
+    return isinstance(data, (str, bytes, list, tuple))
+
+
+def _to_json(value):
+    """ the value as it is read back from the JSON file, e.g. tuples as lists """
+
+    return json.loads(json.dumps(value, default=str))
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path, value):
+    temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    with open(temp_path, 'w') as f:
+        json.dump(value, f, default=str)
+    os.replace(temp_path, path)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
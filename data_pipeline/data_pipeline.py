@@ -1,9 +1,12 @@
 __author__ = "alsherman"
 
+import os
 import logging
+from .checkpoint import CheckpointStore, RunCheckpoints
+from .fingerprint import create_fingerprint, FingerprintManifest
+from .instrumentation import PipelineMetrics
+from .stream_pipeline import StreamPipeline, is_streaming
 from .sources_metadata.source_metadata import SourceMetadata
-from Get_Data import download_data
-from Export_Data.create_csv import CSVCreator
 
 
 logger = logging.getLogger(__name__)
@@ -18,33 +21,214 @@ class DataPipeline:
     3. Download the data
     4. Apply custom data cleaning functions
     5. Export the data
+
+    Each stage is measured (see PipelineMetrics), and a JSON record of the metrics is logged once the run is complete
+
+    When checkpoints are enabled in config.ini, the downloaded data, parsed dataframe and cleaned data are saved as each
+    stage completes (see CheckpointStore), so a failed run resumes from its last completed stage. The checkpoints are
+    removed once the run completes
+
+    When the cleaning function is marked as streaming (see stream_pipeline.streaming), steps 3 to 5 overlap: the data is
+    parsed, cleaned and exported one chunk at a time, each in its own thread
     """
 
-    def __init__(self, name, sources_metadata, data_category, func, local=False):
+    def __init__(self, name, sources_metadata, data_category, func, local=False, force=False):
         """
         :param name: the name of the script
         :param sources_metadata: metadata about the source, used to identify correct download methods
         :param data_category: data category, used specific file to download when one source has many files
-        :param func: custom data cleaning function
+        :param func: custom data cleaning function, called with the source metadata and returning the cleaned
+               dataframe(s), or a streaming cleaning function that receives and yields dataframe chunks
         :param local: specifies whether to use a local file or download data (used for testing purposes)
+        :param force: clean and export the data even if the source has not changed since the last run
         """
 
         self.name = name
         self.sources_metadata = sources_metadata
         self.data_category = data_category
         self.local = local
+        self.force = force
         self._func = func
 
     def run_pipeline(self):
-        """ get dataset metadata, download data, clean data, and export data """
+        """ get dataset metadata, download data, clean data, and export data
+
+        :return: 'skipped' if the downloaded data, cleaning function, and metadata are unchanged since the last run,
+                 otherwise 'rebuilt'
+        """
 
         logger.info('start {}'.format(self.name))
 
-        source_metadata = SourceMetadata(sources_metadata=self.sources_metadata, data_category=self.data_category, local=self.local)
-        downloader = download_data.DownloadData(source_metadata)
-        source_metadata.downloaded_data = downloader.download(source_metadata.download_type)
-        source_metadata.dataframe = self._func(source_metadata)
-        CSVCreator(source_metadata).create_csv(self.sources_metadata)
+        source_metadata = self.extract()
+        if self.is_unchanged(source_metadata):
+            logger.info('skipped {}, source is unchanged since the last run'.format(self.name))
+            self.skip(source_metadata)
+            return 'skipped'
+
+        if self.streaming:
+            self.stream(source_metadata)
+        else:
+            self.transform(source_metadata)
+            self.load(source_metadata)
 
         logger.info('completed {}'.format(self.name))
+        source_metadata.metrics.emit('rebuilt')
+        return 'rebuilt'
+
+    def extract(self):
+        """ get dataset metadata and download data
+
+        :return: source metadata, including the downloaded data
+        """
+
+        # requests and pandas are imported by the stages that use them, so importing the package stays fast
+        from .download_data import download_data
+
+        source_metadata = SourceMetadata(sources_metadata=self.sources_metadata, data_category=self.data_category, local=self.local)
+        source_metadata.metrics = PipelineMetrics.from_config(self.name)
+        source_metadata.checkpoints = self._checkpoints(source_metadata)
+        checkpoints = source_metadata.checkpoints
+
+        # the downloaded data is only resumed if it was downloaded from the same url with the same options
+        raw_version = self._raw_version(source_metadata)
+
+        with source_metadata.metrics.stage('extract'):
+            downloaded_data = checkpoints.load('raw', raw_version) if checkpoints is not None else None
+            if downloaded_data is not None:
+                source_metadata.metrics.record(resumed_from='raw')
+            else:
+                downloader = download_data.DownloadData(source_metadata)
+                downloaded_data = downloader.download(source_metadata.download_type)
+                if checkpoints is not None:
+                    checkpoints.save('raw', downloaded_data, raw_version)
+            source_metadata.downloaded_data = source_metadata.metrics.record_downloaded(downloaded_data)
+        return source_metadata
+
+    def transform(self, source_metadata):
+        """ apply the custom data cleaning function
+
+        :param source_metadata: source metadata returned by extract
+        :return: source metadata, including the cleaned dataframe(s)
+        """
+
+        # the cleaned data is only resumed if the downloaded data, cleaning function and metadata are unchanged
+        checkpoints = source_metadata.checkpoints if source_metadata.fingerprint is not None else None
+
+        with source_metadata.metrics.stage('transform'):
+            dataframe = checkpoints.load('cleaned', source_metadata.fingerprint) if checkpoints is not None else None
+            if dataframe is not None:
+                source_metadata.metrics.record(resumed_from='cleaned')
+            else:
+                dataframe = self._func(source_metadata)
+                if checkpoints is not None:
+                    checkpoints.save('cleaned', dataframe, source_metadata.fingerprint)
+            source_metadata.dataframe = dataframe
+            source_metadata.metrics.record_dataframes(source_metadata.dataframe)
+        return source_metadata
+
+    @property
+    def streaming(self):
+        return is_streaming(self._func)
+
+    def stream(self, source_metadata):
+        """ parse, clean and export the data one chunk at a time with a streaming cleaning function
+
+        parsing and cleaning each run in their own thread, and the export in this thread, connected by bounded queues,
+        so only a few chunks are held in memory at a time
+
+        :param source_metadata: source metadata returned by extract
+        """
+
+        from .transform_data.dataframe_creator import DataframeCreator
+
+        if isinstance(source_metadata.downloaded_data, dict):
+            raise ValueError('{} extracts several files from a zip or ftp directory, streaming cleaning functions take '
+                             'a single file, set zip_members or ftp_files to one file name'.format(self.name))
+
+        metrics = source_metadata.metrics
+        creator = DataframeCreator(source_metadata, **self._func.streaming_options)
+
+        with StreamPipeline.from_config() as pipeline:
+            chunks = pipeline.stage('parse', metrics.measure('parse', creator.iter_dataframes()))
+            cleaned = pipeline.stage('transform', metrics.measure('transform', self._func(source_metadata, chunks)))
+            source_metadata.dataframe = metrics.record_chunks(cleaned)
+            self.load(source_metadata)
+
+    def load(self, source_metadata):
+        """ export the cleaned data
+
+        :param source_metadata: source metadata returned by transform
+        """
+
+        from .export_data.create_csv import CSVCreator
+
+        with source_metadata.metrics.stage('load'):
+            outputs = CSVCreator(source_metadata).create_csv(self.sources_metadata)
+            source_metadata.metrics.record_outputs(outputs)
+
+        if source_metadata.fingerprint is not None:
+            self._manifest(source_metadata).record(self._manifest_key(), source_metadata.fingerprint, outputs)
+        self.clear_checkpoints(source_metadata)
+
+    def is_unchanged(self, source_metadata):
+        """ fingerprint the downloaded data, cleaning function, and metadata and compare them to the last run
+
+        :param source_metadata: source metadata returned by extract
+        :return: True if the transform and export can be skipped
+        """
+
+        with source_metadata.metrics.stage('fingerprint'):
+            source_metadata.fingerprint = create_fingerprint(source_metadata, self._func)
+
+        if self.force:
+            return False
+        return self._manifest(source_metadata).is_unchanged(self._manifest_key(), source_metadata.fingerprint)
+
+    def skip(self, source_metadata):
+        """ finish a run that is skipped because the source is unchanged: empty the change sets of outputs with
+        delta_keys, which still hold the changes of the last run, and remove the checkpoints
+
+        :param source_metadata: source metadata returned by extract
+        """
+
+        from .export_data.create_csv import CSVCreator
+
+        entry = self._manifest(source_metadata).entries().get(self._manifest_key())
+        if self.sources_metadata.get('delta_keys') and entry is not None:
+            CSVCreator(source_metadata).clear_deltas(self.sources_metadata, entry['outputs'])
+        self.clear_checkpoints(source_metadata)
+        source_metadata.metrics.emit('skipped')
+
+    def clear_checkpoints(self, source_metadata):
+        """ remove the checkpoints of the run once it is complete
+
+        :param source_metadata: source metadata returned by extract
+        """
+
+        if source_metadata.checkpoints is not None:
+            source_metadata.checkpoints.clear()
+
+    def _checkpoints(self, source_metadata):
+        """ return the checkpoints of the run, or None if checkpoints are not enabled or the data category sets
+        'checkpoint': False """
+
+        store = CheckpointStore.from_config()
+        if store is None or not source_metadata.use_checkpoints:
+            return None
+        return RunCheckpoints(store, self._manifest_key())
+
+    def _raw_version(self, source_metadata):
+        """ version of the raw checkpoint: the url and the sources_metadata entries that determine the download """
+
+        return {'raw_data_path': source_metadata.raw_data_path,
+                'source_path': self.sources_metadata['source_path'],
+                'data_category': self.sources_metadata['data_categories'][self.data_category]}
+
+    def _manifest(self, source_metadata):
+        """ the manifest is stored next to the exported data """
+
+        return FingerprintManifest(os.path.dirname(source_metadata.output_path))
+
+    def _manifest_key(self):
+        return '{}/{}'.format(self.sources_metadata['source_name'], self.data_category)
 
@@ -0,0 +1,204 @@
+__author__ = 'alsherman'
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from .download_error import DownloadError
+from .http_session import send, with_retries
+from ..sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadCache:
+    """ on-disk cache of downloaded files, keyed by the source url (SourceMetadata.raw_data_path)
+
+    Each cached payload is stored with the ETag and Last-Modified headers returned by the server. Later downloads send
+    If-None-Match/If-Modified-Since and are served from the cache when the server responds with 304 Not Modified.
+    When the cache grows past max_size, the least recently used payloads are evicted.
+    """
+
+    index_name = 'index.json'
+    _configured = None
+
+    def __init__(self, cache_folder, max_size=None):
+        """
+        :param cache_folder: folder to store cached payloads and the cache index
+        :param max_size: maximum size of all cached payloads in bytes, None means no limit
+        """
+
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @classmethod
+    def from_config(cls):
+        """ return the cache set in the DOWNLOADCACHE section of config.ini, shared by every downloader so that
+        concurrent downloads update the same index
+
+        :return: DownloadCache, or None if the cache is not enabled
+        """
+
+        if not config.has_section('DOWNLOADCACHE') or not config['DOWNLOADCACHE'].getboolean('enabled', fallback=False):
+            return None
+
+        if cls._configured is None:
+            max_size_mb = config['DOWNLOADCACHE'].getint('max_size_mb', fallback=0)
+            cls._configured = cls(cache_folder=config['DOWNLOADCACHE']['cache_folder'],
+                                  max_size=max_size_mb * 1024 * 1024 or None)
+        return cls._configured
+
+    def fetch(self, url, chunk_size=1024 * 1024, range_downloader=None):
+        """ download a file, or reuse the cached copy if the server reports it has not changed
+
+        :param url: source url
+        :param chunk_size: bytes written to disk at a time
+        :param range_downloader: RangeDownloader used to download large files in parallel byte ranges
+        :return: path to the cached payload
+        """
+
+        key = self._key(url)
+        payload_path = self._payload_path(key)
+
+        with self._lock:
+            entry = self._read_index().get(key)
+
+        if range_downloader is not None:
+            return self._download_ranges(url, key, entry, range_downloader)
+
+        headers = {}
+        if entry is not None and os.path.exists(payload_path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        # retry the whole download, so a connection dropped while reading the body is also retried
+        return with_retries(lambda: self._download(url, key, entry, headers, chunk_size), url)
+
+    def _download(self, url, key, entry, headers, chunk_size):
+        """ send the conditional request and store the payload if it changed
+
+        :return: path to the cached payload
+        """
+
+        payload_path = self._payload_path(key)
+        r = send(url, headers=headers, stream=True)
+
+        if r.status_code == 304:
+            r.close()
+            if entry is not None and os.path.exists(payload_path):
+                logger.info('Not modified, using cached copy of {}'.format(url))
+                self._update_entry(key, entry)
+                return payload_path
+            if 'Cache-Control' in headers:
+                raise DownloadError(url, '304 Not Modified, and there is no cached copy')
+
+            # e.g. the index was lost and a proxy answered with its own validators, so request the full payload
+            logger.warning('Not modified, but there is no cached copy of {}, downloading it again'.format(url))
+            return self._download(url, key, None, {'Cache-Control': 'no-cache'}, chunk_size)
+
+        # write to a temp file first so an interrupted download never replaces a complete cached copy
+        temp_path = '{}.{}.tmp'.format(payload_path, threading.get_ident())
+        with r, open(temp_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+        os.replace(temp_path, payload_path)
+        logger.info('Cached {}'.format(url))
+
+        self._update_entry(key, {'url': url,
+                                 'etag': r.headers.get('ETag'),
+                                 'last_modified': r.headers.get('Last-Modified'),
+                                 'encoding': r.encoding,
+                                 'size': os.path.getsize(payload_path)})
+        return payload_path
+
+    def _download_ranges(self, url, key, entry, range_downloader):
+        """ reuse the cached payload if the size, ETag and Last-Modified reported by the server have not changed,
+        otherwise download it with the range downloader, resuming a previously interrupted download
+
+        :return: path to the cached payload
+        """
+
+        payload_path = self._payload_path(key)
+        probe = range_downloader.probe(url)
+        if entry is not None and os.path.exists(payload_path) and (entry.get('etag') or entry.get('last_modified')):
+            if all(entry.get(header) == probe[header] for header in ('size', 'etag', 'last_modified')):
+                logger.info('Not modified, using cached copy of {}'.format(url))
+                self._update_entry(key, entry)
+                return payload_path
+
+        downloaded = range_downloader.download(url, payload_path, probe=probe)
+        logger.info('Cached {}'.format(url))
+        self._update_entry(key, dict(downloaded, url=url, encoding=None))
+        return payload_path
+
+    def entry(self, url):
+        """ return the cached headers and size for a url, or None if it has not been cached
+
+        :param url: source url
+        """
+
+        with self._lock:
+            return self._read_index().get(self._key(url))
+
+    def _update_entry(self, key, entry):
+        """ record the entry as most recently used and evict old entries if the cache is too large """
+
+        with self._lock:
+            index = self._read_index()
+            entry['last_access'] = time.time()
+            index[key] = entry
+            self._evict(index, keep=key)
+            self._write_index(index)
+
+    def _evict(self, index, keep):
+        """ remove least recently used payloads until the cache fits in max_size
+
+        :param index: cache index to update in place
+        :param keep: key of the payload that was just used, never evicted
+        """
+
+        if self.max_size is None:
+            return
+
+        total_size = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_access']):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+
+            total_size -= index[key]['size']
+            logger.info('Evicting {} from the download cache'.format(index[key]['url']))
+            del index[key]
+            try:
+                os.remove(self._payload_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_folder, self.index_name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_index(self, index):
+        index_path = os.path.join(self.cache_folder, self.index_name)
+        temp_path = index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_path, index_path)
+
+    def _payload_path(self, key):
+        return os.path.join(self.cache_folder, key)
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
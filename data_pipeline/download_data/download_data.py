@@ -1,10 +1,21 @@
 __author__ = 'alsherman'
 
-import urllib
-import zipfile
+import io
+import os
 import gzip
-import requests
+import fnmatch
+import zipfile
+import itertools
+import hashlib
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .download_cache import DownloadCache
+from .download_error import DownloadError
+from .ftp_download import FtpDownloader
+from .http_session import request, send, with_retries
+from .range_download import RangeDownloader, RangeFile
+from ..sources_metadata.source_metadata import config
 
 
 logger = logging.getLogger(__name__)
@@ -13,19 +24,37 @@ logger = logging.getLogger(__name__)
 class DownloadData:
     """ includes various methods to download data depending on the data format """
 
-    def __init__(self, source_metadata):
+    def __init__(self, source_metadata, cache=None):
         """
         :param source_metadata: includes metadata about a data source, including the source data location and data format
+        :param cache: DownloadCache used to skip downloading files that have not changed, defaults to the cache
+               configured in config.ini. Set 'cache': False for a data category to always download it
+
+        Set 'large_file': True for a zip or gzip data category to download it in parallel byte ranges, resuming only
+        the missing ranges if the download is interrupted (see RangeDownloader)
+
+        Set 'remote_zip': True for a zip data category to read it in place with range requests, so only the central
+        directory and the extracted members are downloaded (see RangeFile). This suits large zips of which only a few
+        members are extracted, from servers that send an ETag or Last-Modified header
         """
 
         self.local = source_metadata.local
         self.raw_data_path = source_metadata.raw_data_path
         self.download_type = source_metadata.download_type
+        self.stream = source_metadata.stream
+        self.large_file = source_metadata.large_file
+        self.remote_zip = source_metadata.remote_zip
+        self.zip_members = source_metadata.zip_members
+        self.ftp_files = source_metadata.ftp_files
+        self.cache = cache or DownloadCache.from_config()
+        if not source_metadata.use_cache:
+            self.cache = None
 
     def download(self, download_type):
         """ determines which download type to call
         :param download_type: specifies source data format
-        :return: downloaded data or None for local files
+        :return: downloaded data or None for local files. When the source is set to stream, a lazy iterator over the
+                 decompressed lines is returned instead, so the full file is never held in memory
         """
 
         if self.local:
@@ -41,50 +70,159 @@ class DownloadData:
     def _download_and_extract_zip_data(self, list_of_files_to_skip=[], records_to_extract=None):
         """ download and extract zip file
 
+        Set 'zip_members' for a data category to a file name or pattern (e.g. '*.csv'), or a list of them, to extract
+        every matching file in the zip, each as its own table. Otherwise only the first file is extracted
+
         :param list_of_files_to_skip: notates files not to skip in the zip
-        :param records_to_extract: notates the number of rows of data to extract, defaults uses all data
+        :param records_to_extract: notates the number of rows (including any header row) to extract from each file,
+               defaults uses all data
 
-        :return: data extracted from a zip
+        :return: data extracted from a zip, or a dict of file name to the data extracted from each file when
+                 zip_members is set
         """
 
         zfile = self._download_zip_helper()
 
-        for filename in zfile.namelist()[0:records_to_extract]:  # get name of zipfile
-            if filename in list_of_files_to_skip:
-                continue
+        filenames = [filename for filename in zfile.namelist()
+                     if filename not in list_of_files_to_skip and not filename.endswith('/')]
+        if self.zip_members is None:
+            filenames = filenames[:1]
+        else:
+            filenames = self._select_zip_members(filenames)
+
+        if self.stream:
+            logger.info('Streaming zip_files: {}'.format(filenames))
+            members = {filename: self._yield_zip_member(zfile, filename, records_to_extract) for filename in filenames}
+        else:
+            # members are decompressed concurrently, zipfile serializes reads from the shared archive
+            with ThreadPoolExecutor(max_workers=min(len(filenames), os.cpu_count() or 1)) as pool:
+                members = dict(zip(filenames, pool.map(
+                    lambda filename: self._read_zip_member(zfile, filename, records_to_extract), filenames)))
+
+        if self.zip_members is None:
+            return next(iter(members.values()), None)
+        return members
+
+    def _select_zip_members(self, filenames):
+        """ return the file names in the zip that match zip_members, in the order they appear in the zip
+
+        :param filenames: file names in the zip
+        """
+
+        patterns = [self.zip_members] if isinstance(self.zip_members, str) else self.zip_members
+        selected = [filename for filename in filenames
+                    if any(fnmatch.fnmatchcase(filename, pattern) for pattern in patterns)]
+        if not selected:
+            logger.error('no files in {} match {}: {}'.format(self.raw_data_path, patterns, filenames))
+        return selected
 
-            with zfile.open(filename) as f:
-                logger.info('Collected zip_file: {}'.format(filename))
-                return f.readlines()  # extract data
+    @staticmethod
+    def _read_zip_member(zfile, filename, records_to_extract=None):
+        """ extract the rows of a single file in a zip
+
+        :param zfile: opened zip file
+        :param filename: name of the file in the zip to extract
+        :param records_to_extract: number of rows to extract, None extracts every row
+        """
+
+        with zfile.open(filename) as f:
+            rows = list(itertools.islice(f, records_to_extract))  # extract data
+        logger.info('Collected zip_file: {}'.format(filename))
+        return rows
+
+    @staticmethod
+    def _yield_zip_member(zfile, filename, records_to_extract=None):
+        """ lazily yield decompressed lines from a single file in a zip
+
+        :param zfile: opened zip file
+        :param filename: name of the file in the zip to extract
+        :param records_to_extract: number of rows to extract, None extracts every row
+        """
+
+        with zfile.open(filename) as f:
+            for line in itertools.islice(f, records_to_extract):
+                yield line
 
     def _download_zip_helper(self):
         """ helper function to download a zip and handle errors
 
+        The zip is downloaded to a temp file, held in memory unless it is large. With 'remote_zip', it is instead read
+        in place with range requests when the server supports them and sends a validator to detect changes
+
         :return: downloaded zip file
         """
 
         try:
-            zfile, _ = urllib.urlretrieve(self.raw_data_path)  # download zip file
-            logger.info('Collected Zfile: {}'.format(zfile))
+            zfile = None
+            if self.remote_zip and not (self.cache or self.large_file):
+                probe = RangeDownloader.probe(self.raw_data_path)
+                validator = probe['etag'] or probe['last_modified']
+                if probe['accept_ranges'] and probe['size'] and validator:
+                    zfile = io.BufferedReader(RangeFile(self.raw_data_path, probe['size'], validator=validator))
+                else:
+                    logger.info('{} does not support range requests with a validator, downloading the whole zip'.format(
+                        self.raw_data_path))
+            if zfile is None:
+                zfile = self._retrieve()  # download zip file
+            logger.info('Collected Zfile: {}'.format(self.raw_data_path))
         except DownloadError as e:
-            logger.info('URL ERROR: {} no longer a valid URL'.format(self.raw_data_path))
+            logger.error('URL ERROR: {} no longer a valid URL: {}'.format(self.raw_data_path, e))
+            raise
         zfile = zipfile.ZipFile(zfile)  # open zip file
         return zfile
 
     def _download_and_extract_gzip(self):
         """ download and extract gzip with a single file
 
-        :return: opened gzip file
+        Unless the gzip is cached or a large_file, it is decompressed as it is read from the response, without first
+        being written to disk
+
+        :return: lines of the decompressed file
         """
 
         try:
-            gzip_file, _ = urllib.urlretrieve(self.raw_data_path)  # download gzip file
-            logger.info('Collected gzip_file: {}'.format(gzip_file))
-            decompressedFile = gzip.GzipFile(gzip_file)  # open gzip file
+            if self.cache or self.large_file:
+                decompressedFile = gzip.GzipFile(fileobj=self._retrieve())  # open gzip file
+                data = self._yield_lines(decompressedFile) if self.stream else decompressedFile.readlines()
+            elif self.stream:
+                data = self._yield_gzip_response(request(self.raw_data_path, stream=True))
+            else:
+                # retry the whole download, so a connection dropped while decompressing is also retried
+                data = with_retries(self._read_gzip_response, self.raw_data_path)
+            logger.info('Collected gzip_file: {}'.format(self.raw_data_path))
         except DownloadError as e:
-            logger.info('URL ERROR: {} no longer a valid URL'.format(self.raw_data_path))
+            logger.error('URL ERROR: {} no longer a valid URL: {}'.format(self.raw_data_path, e))
+            raise
 
-        return decompressedFile.readlines()
+        return data
+
+    def _read_gzip_response(self):
+        """ decompress every line of the gzip as it is downloaded """
+
+        with send(self.raw_data_path, stream=True) as r, gzip.GzipFile(fileobj=r.raw) as f:
+            return f.readlines()
+
+    @staticmethod
+    def _yield_gzip_response(response):
+        """ lazily yield decompressed lines as they are downloaded, and close the response once exhausted
+
+        :param response: streamed requests.Response of a gzip file
+        """
+
+        with response, gzip.GzipFile(fileobj=response.raw) as f:
+            for line in f:
+                yield line
+
+    @staticmethod
+    def _yield_lines(decompressed_file):
+        """ lazily yield lines from an opened file and close it once exhausted
+
+        :param decompressed_file: opened file-like object (e.g. a GzipFile)
+        """
+
+        with decompressed_file:
+            for line in decompressed_file:
+                yield line
 
     def _download_and_extract_url(self):
         """ download data from a given url
@@ -94,35 +232,166 @@ class DownloadData:
 
         url = self.raw_data_path
 
+        if self.cache:
+            return self._read_cached_url()
+
         try:
-            r = requests.get(url)
+            if self.stream:
+                data = request(url, stream=True).iter_content(chunk_size=1024 * 1024)
+            else:
+                # retry the whole download, so a connection dropped while reading the body is also retried
+                data = with_retries(lambda: send(url).text, url)
             logger.info('collected data from {}'.format(url))
         except DownloadError as e:
-            logger.info('URL ERROR: {} is no longer a valid URL'.format(url))
+            logger.error('URL ERROR: {} is no longer a valid URL: {}'.format(url, e))
+            raise
 
-        data = r.text
         return data
 
+    def _read_cached_url(self):
+        """ download text data from a given url through the download cache
+
+        :return: downloaded text data from url, or a lazy iterator over its lines when streaming
+        """
+
+        path = self.cache.fetch(self.raw_data_path)
+        encoding = self.cache.entry(self.raw_data_path).get('encoding') or 'utf-8'
+        logger.info('collected data from {}'.format(self.raw_data_path))
+
+        if self.stream:
+            return self._yield_lines(open(path, encoding=encoding, newline=''))
+
+        with open(path, encoding=encoding, newline='') as f:
+            return f.read()
+
+    def _retrieve(self, chunk_size=1024 * 1024, spool_size=64 * 1024 * 1024):
+        """ download a file to disk, through the download cache when one is set
+
+        :param chunk_size: bytes written to disk at a time
+        :param spool_size: bytes held in memory before the temp file is written to disk
+        :return: downloaded file, opened for reading. Without a cache, it is a temp file deleted once closed, held in
+                 memory until it grows past spool_size
+        """
+
+        if self.large_file:
+            return self._retrieve_large_file()
+
+        if self.cache:
+            return open(self.cache.fetch(self.raw_data_path), 'rb')
+
+        def download():
+            temp_file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+            try:
+                with send(self.raw_data_path, stream=True) as r:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        temp_file.write(chunk)
+            except BaseException:
+                temp_file.close()
+                raise
+            temp_file.seek(0)
+            return temp_file
+
+        # retry the whole download, so a connection dropped while reading the body is also retried
+        return with_retries(download, self.raw_data_path)
+
+    def _retrieve_large_file(self):
+        """ download a file in parallel byte ranges, through the download cache when one is set
+
+        Without a cache, the file is downloaded to the download_folder in the RANGEDOWNLOAD section of config.ini,
+        where an interrupted download is resumed the next time it runs
+
+        :return: downloaded file, opened for reading
+        """
+
+        range_downloader = RangeDownloader.from_config()
+        if self.cache:
+            return open(self.cache.fetch(self.raw_data_path, range_downloader=range_downloader), 'rb')
+
+        download_folder = tempfile.gettempdir()
+        if config.has_section('RANGEDOWNLOAD'):
+            download_folder = config['RANGEDOWNLOAD'].get('download_folder') or download_folder
+        os.makedirs(download_folder, exist_ok=True)
+
+        path = os.path.join(download_folder, hashlib.sha256(self.raw_data_path.encode('utf-8')).hexdigest())
+        range_downloader.download(self.raw_data_path, path)
+
+        f = open(path, 'rb')
+        try:
+            os.remove(path)  # the open file is still readable, and its space is freed once it is closed
+        except OSError:
+            pass  # windows cannot remove open files, it is replaced by the next download of the same url
+        return f
+
     def _download_ftp(self):
         """ download data from ftp
 
-        :return: downloaded data
+        Set 'ftp_files' for a data category to a file name or pattern (e.g. '*.csv'), or a list of them, to download
+        every matching file in the directory at the source path, each as its own table. The files are downloaded in
+        parallel to the download_folder in the FTP section of config.ini, and files whose size and modification time
+        are unchanged since the last download are not downloaded again (see FtpDownloader)
+
+        :return: downloaded bytes, or a dict of file name to the lines of each file when ftp_files is set. When the
+                 source is set to stream, a lazy iterator over the downloaded blocks is returned instead
         """
 
         url = self.raw_data_path
+        downloader = FtpDownloader.from_config()
+
+        if self.ftp_files is not None:
+            return self._download_ftp_files(downloader)
+
+        if self.stream:
+            logger.info('Streaming {}'.format(url))
+            return downloader.stream(url)
 
-        # TODO: need to refacto urllib2 into requests
         try:
-            request = urllib2.Request(url)
-            logger.info('collected data from {}'.format(url))
+            with downloader:
+                data = downloader.read(url)
         except DownloadError as e:
-            logger.info('URL ERROR: {} is no longer a valid URL'.format(url))
-        r = urllib2.urlopen(request)
-        data = (row for row in r)
+            logger.error('URL ERROR: {} is no longer a valid URL: {}'.format(url, e))
+            raise
+        logger.info('collected data from {}'.format(url))
 
         return data
 
+    def _download_ftp_files(self, downloader):
+        """ download the files in an ftp directory that match ftp_files
+
+        :param downloader: FtpDownloader
+        :return: dict of file name to the lines of each file, or a lazy iterator over its blocks when streaming
+        """
+
+        download_folder = os.path.join(tempfile.gettempdir(), 'ftp_downloads')
+        if config.has_section('FTP'):
+            download_folder = config['FTP'].get('download_folder') or download_folder
+        # each directory has its own folder, with the size and modification time of the files downloaded to it
+        folder = os.path.join(download_folder, hashlib.sha256(self.raw_data_path.encode('utf-8')).hexdigest()[:32])
+
+        try:
+            with downloader:
+                paths = downloader.fetch(self.raw_data_path, self.ftp_files, folder)
+        except DownloadError as e:
+            logger.error('URL ERROR: {} is no longer a valid URL: {}'.format(self.raw_data_path, e))
+            raise
+
+        if self.stream:
+            logger.info('Streaming ftp_files: {}'.format(list(paths)))
+            return {filename: self._yield_file_blocks(path) for filename, path in paths.items()}
+
+        members = {}
+        for filename, path in paths.items():
+            with open(path, 'rb') as f:
+                members[filename] = f.readlines()
+        return members
+
+    @staticmethod
+    def _yield_file_blocks(path, block_size=1024 * 1024):
+        """ lazily yield the blocks of a local file
+
+        :param path: path of the file
+        :param block_size: bytes read at a time
+        """
 
-class DownloadError(Exception):
-    def __init__(self):
-        Exception.__init__(self, "Download error occurred")
\ No newline at end of file
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                yield block
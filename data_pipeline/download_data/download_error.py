@@ -0,0 +1,16 @@
+__author__ = 'alsherman'
+
+
+class DownloadError(Exception):
+    def __init__(self, url=None, reason=None):
+        """
+        :param url: url that failed to download
+        :param reason: error or http status that caused the failure
+        """
+
+        self.url = url
+        self.reason = reason
+        if url is None:
+            Exception.__init__(self, "Download error occurred")
+        else:
+            Exception.__init__(self, "Download error occurred: {} - {}".format(url, reason))
@@ -0,0 +1,404 @@
+__author__ = 'alsherman'
+
+import os
+import json
+import time
+import queue
+import ftplib
+import random
+import fnmatch
+import logging
+import posixpath
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, unquote, quote
+from .download_error import DownloadError
+from .http_session import with_retries, get_setting
+from ..sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+# errors that may succeed if the transfer is resumed: dropped or refused connections, timeouts and 4xx replies
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, EOFError, ftplib.error_temp, ftplib.error_reply)
+
+
+class FtpDownloader:
+    """ downloads files over FTP with ftplib, over a small pool of connections to each server
+
+    Transfers are streamed in blocks. A transfer that is interrupted, or ends before the size reported by the server,
+    is resumed from the last received byte with REST, with the same retries and backoff as HTTP downloads (see the
+    HTTP section of config.ini). Downloads to a file keep the partial file, so a later run resumes it too, unless the
+    size or modification time of the file on the server changed.
+
+    Directories are listed with MLSD, or NLST, SIZE and MDTM on servers without MLSD, and the files that match a
+    pattern are downloaded in parallel. Files whose size and modification time are unchanged since they were last
+    downloaded to the folder are not downloaded again.
+    """
+
+    state_name = '.ftp_state.json'
+
+    def __init__(self, workers=4, block_size=1024 * 1024, timeout=60.0):
+        """
+        :param workers: maximum connections to each server, and files downloaded at a time
+        :param block_size: bytes read from a transfer at a time
+        :param timeout: seconds to wait for the server before retrying
+        """
+
+        self.workers = workers
+        self.block_size = block_size
+        self.timeout = timeout
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """ return a downloader with the settings in the FTP section of config.ini """
+
+        timeout = get_setting('timeout', 60.0)
+        if not config.has_section('FTP'):
+            return cls(timeout=timeout)
+        return cls(workers=config['FTP'].getint('workers', fallback=4),
+                   block_size=config['FTP'].getint('block_size_kb', fallback=1024) * 1024,
+                   timeout=timeout)
+
+    def read(self, url):
+        """ download a file into memory
+
+        :param url: ftp url of the file
+        :return: bytes of the file
+        """
+
+        return b''.join(self.iter_file(url))
+
+    def stream(self, url):
+        """ lazily yield the blocks of a file as they are downloaded, and close the connections once exhausted
+
+        :param url: ftp url of the file
+        """
+
+        with self:
+            yield from self.iter_file(url)
+
+    def iter_file(self, url, offset=0, size=None):
+        """ yield the blocks of a file as they are downloaded, resuming the transfer if it is interrupted
+
+        :param url: ftp url of the file
+        :param offset: byte to start the transfer at
+        :param size: size of the file, requested from the server when None
+        """
+
+        size = self.size(url) if size is None else size
+        retries = get_setting('retries', 5)
+        position = offset
+        failures = 0
+
+        while True:
+            try:
+                for block in self._retrieve(url, position):
+                    position += len(block)
+                    yield block
+                if size is None or position >= size:
+                    return
+                error = EOFError('transfer ended at {} of {} bytes'.format(position, size))
+            except TRANSIENT_ERRORS as e:
+                error = e
+            except (ftplib.error_perm, OSError) as e:  # e.g. the file does not exist, or the host is unknown
+                raise DownloadError(url, e)
+
+            failures += 1
+            if failures > retries:
+                logger.error('URL ERROR: {} failed after {} attempts'.format(url, failures))
+                raise DownloadError(url, error)
+
+            wait = random.uniform(0, min(get_setting('backoff_max', 60.0), get_setting('backoff_factor', 0.5) * 2 ** failures))
+            logger.warning('transfer of {} interrupted at byte {}: {!r}, resuming in {:.1f}s'.format(
+                url, position, error, wait))
+            time.sleep(wait)
+
+    def download(self, url, path, size=None, modified=None):
+        """ download a file to a path, resuming a partial download left by an earlier run
+
+        The size and modification time of the file are recorded next to the partial download, which is only resumed if
+        they are unchanged, so a file that changed on the server is downloaded again from the start
+
+        :param url: ftp url of the file
+        :param path: output path. The file is downloaded to path.part and renamed once complete
+        :param size: size of the file, requested from the server when None
+        :param modified: modification time of the file as reported by the server, requested from the server when None
+        :return: path
+        """
+
+        size = self.size(url) if size is None else size
+        modified = self.modified(url) if modified is None else modified
+
+        part_path = path + '.part'
+        state_path = part_path + '.json'
+        state = {'url': url, 'size': size, 'modified': modified}
+
+        offset = 0
+        if os.path.exists(part_path) and (size is not None or modified is not None):
+            if _read_state(state_path) == state and (size is None or os.path.getsize(part_path) <= size):
+                offset = os.path.getsize(part_path)
+            else:
+                logger.info('{} has changed since the last download, restarting the download'.format(url))
+        if offset:
+            logger.info('resuming {} at byte {}'.format(url, offset))
+        _write_state(state_path, state)
+
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for block in self.iter_file(url, offset=offset, size=size):
+                f.write(block)
+
+        os.replace(part_path, path)
+        os.remove(state_path)
+        logger.info('collected data from {}'.format(url))
+        return path
+
+    def modified(self, url):
+        """ return the modification time of a file as reported by the server (e.g. '20240131120000'), or None if the
+        server does not support MDTM
+
+        :param url: ftp url of the file
+        """
+
+        def modified(ftp):
+            try:
+                return ftp.voidcmd('MDTM ' + _path(url))[4:].strip()
+            except ftplib.error_perm:
+                return None
+
+        return self._call(url, modified)
+
+    def size(self, url):
+        """ return the size of a file, or None if the server does not support SIZE
+
+        :param url: ftp url of the file
+        """
+
+        def size(ftp):
+            try:
+                return ftp.size(_path(url))
+            except ftplib.error_perm as e:
+                if str(e).startswith('550'):
+                    raise DownloadError(url, e)
+                return None
+
+        return self._call(url, size)
+
+    def list(self, url):
+        """ list the files in a directory
+
+        :param url: ftp url of the directory
+        :return: list of dicts with the name, url, size and modified time (as reported by the server) of each file
+        """
+
+        folder = _path(url)
+
+        def list_files(ftp):
+            try:
+                return [{'name': name, 'size': int(facts['size']) if 'size' in facts else None,
+                         'modified': facts.get('modify')}
+                        for name, facts in ftp.mlsd(folder, facts=['type', 'size', 'modify'])
+                        if facts.get('type') == 'file']
+            except ftplib.error_perm:  # MLSD is not supported
+                pass
+
+            files = []
+            for name in ftp.nlst(folder):
+                name = posixpath.basename(name.rstrip('/'))
+                file_path = posixpath.join(folder, name)
+                try:
+                    size = ftp.size(file_path)
+                except ftplib.error_perm:  # directories have no size
+                    continue
+                try:
+                    modified = ftp.voidcmd('MDTM ' + file_path)[4:].strip()
+                except ftplib.error_perm:
+                    modified = None
+                files.append({'name': name, 'size': size, 'modified': modified})
+            return files
+
+        files = self._call(url, list_files)
+        for file in files:
+            file['url'] = url.rstrip('/') + '/' + quote(file['name'])
+        return sorted(files, key=lambda file: file['name'])
+
+    def fetch(self, url, patterns, folder):
+        """ download the files in a directory that match the patterns to a folder, in parallel. Files whose size and
+        modification time are unchanged since they were downloaded to the folder are not downloaded again
+
+        :param url: ftp url of the directory
+        :param patterns: file name or pattern (e.g. '*.csv'), or a list of them
+        :param folder: folder to download the files to
+        :return: dict of file name to local path, sorted by file name
+        """
+
+        patterns = [patterns] if isinstance(patterns, str) else patterns
+        files = [file for file in self.list(url) if any(fnmatch.fnmatchcase(file['name'], pattern) for pattern in patterns)]
+        if not files:
+            raise DownloadError(url, 'no files match {}'.format(patterns))
+
+        os.makedirs(folder, exist_ok=True)
+        state = _read_state(os.path.join(folder, self.state_name))
+        changed = [file for file in files if self._is_changed(file, state.get(file['name']), folder)]
+        logger.info('downloading {} of {} files from {}, the others are unchanged'.format(len(changed), len(files), url))
+
+        def fetch_file(file):
+            self.download(file['url'], os.path.join(folder, file['name']), size=file['size'], modified=file['modified'])
+            return file
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(changed)) or 1) as pool:
+                for file in pool.map(fetch_file, changed):
+                    state[file['name']] = {'size': file['size'], 'modified': file['modified']}
+        finally:
+            _write_state(os.path.join(folder, self.state_name), state)
+
+        return {file['name']: os.path.join(folder, file['name']) for file in files}
+
+    @staticmethod
+    def _is_changed(file, previous, folder):
+        """ a file is unchanged if it was downloaded to the folder with the same size and modification time """
+
+        if previous is None or not os.path.exists(os.path.join(folder, file['name'])):
+            return True
+        if file['size'] is None and file['modified'] is None:
+            return True
+        return previous != {'size': file['size'], 'modified': file['modified']}
+
+    def _retrieve(self, url, offset):
+        """ yield the blocks of a single transfer of a file, starting at offset, over a pooled connection """
+
+        with self._pool(url).connection() as ftp:
+            connection = ftp.transfercmd('RETR ' + _path(url), rest=offset or None)
+            with connection, connection.makefile('rb') as f:
+                for block in iter(lambda: f.read(self.block_size), b''):
+                    yield block
+            ftp.voidresp()
+
+    def _call(self, url, func):
+        """ call func with a pooled connection, retrying transient errors
+
+        :param func: function called with an ftplib.FTP connection
+        """
+
+        def call():
+            try:
+                with self._pool(url).connection() as ftp:
+                    return func(ftp)
+            except TRANSIENT_ERRORS:
+                raise
+            except (ftplib.error_perm, OSError) as e:
+                raise DownloadError(url, e)
+
+        return with_retries(call, url, retry_exceptions=TRANSIENT_ERRORS)
+
+    def _pool(self, url):
+        """ return the connection pool of the server in the url """
+
+        parts = urlparse(url)
+        key = (parts.hostname, parts.port or 21, unquote(parts.username or 'anonymous'))
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = FtpConnectionPool(*key, password=unquote(parts.password or 'anonymous@'),
+                                                     size=self.workers, timeout=self.timeout)
+            return self._pools[key]
+
+    def close(self):
+        """ close the idle connections to every server """
+
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FtpConnectionPool:
+    """ logged in connections to an FTP server, reused between transfers """
+
+    def __init__(self, host, port, user, password, size=4, timeout=60.0):
+        """
+        :param host: host of the server
+        :param port: port of the server
+        :param user: user name, anonymous by default
+        :param password: password
+        :param size: maximum idle connections kept open
+        :param timeout: seconds to wait for the server
+        """
+
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        """ yield an idle connection, or a new one. A connection that fails, or is left mid transfer, is closed
+        instead of returned to the pool """
+
+        try:
+            ftp = self._idle.get_nowait()
+        except queue.Empty:
+            ftp = self._connect()
+
+        try:
+            yield ftp
+        except BaseException:
+            ftp.close()
+            raise
+
+        if self._idle.qsize() < self.size:
+            self._idle.put(ftp)
+        else:
+            _quit(ftp)
+
+    def _connect(self):
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(self.host, self.port)
+        ftp.login(self.user, self.password)
+        ftp.voidcmd('TYPE I')
+        return ftp
+
+    def close(self):
+        while True:
+            try:
+                _quit(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _quit(ftp):
+    try:
+        ftp.quit()
+    except (OSError, EOFError, ftplib.Error):
+        ftp.close()
+
+
+def _path(url):
+    return unquote(urlparse(url).path) or '/'
+
+
+def _read_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_state(path, state):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
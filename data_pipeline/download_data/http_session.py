@@ -0,0 +1,173 @@
+__author__ = 'alsherman'
+
+import os
+import time
+import random
+import logging
+import threading
+import urllib3
+import requests
+from requests.adapters import HTTPAdapter
+from .download_error import DownloadError
+from ..sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+# responses that are worth retrying, every other error status fails immediately
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# urllib3 errors are raised when reading response.raw, rather than the requests errors that wrap them. IncompleteRead
+# is also raised by the range downloads when a response body is shorter than the requested range
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError,
+                    urllib3.exceptions.IncompleteRead)
+# requests that can never succeed, e.g. a url without a scheme, fail immediately
+PERMANENT_EXCEPTIONS = (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+                        requests.exceptions.InvalidSchema, requests.exceptions.InvalidHeader,
+                        requests.exceptions.URLRequired)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_setting(name, fallback):
+    """ return a setting from the HTTP section of config.ini
+
+    :param name: setting name
+    :param fallback: default value, also used to determine the type of the setting
+    """
+
+    if not config.has_section('HTTP'):
+        return fallback
+    if isinstance(fallback, float):
+        return config['HTTP'].getfloat(name, fallback=fallback)
+    return config['HTTP'].getint(name, fallback=fallback)
+
+
+def get_session():
+    """ return the process-wide session shared by every downloader, so connections to the same host are kept alive
+    and reused. The pool size per host is set by pool_maxsize in the HTTP section of config.ini
+
+    :return: requests.Session
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=get_setting('pool_connections', 20),
+                                  pool_maxsize=get_setting('pool_maxsize', 10),
+                                  max_retries=0)  # retries are handled by request, with backoff
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def _reset_session():
+    """ open connections cannot be shared with a forked process (e.g. a process pool worker) """
+
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_session)
+
+
+def request(url, method='GET', headers=None, stream=False, timeout=None):
+    """ send a request through the shared session, retrying connection errors and transient http errors
+
+    :param url: url to request
+    :param method: http method
+    :param headers: request headers
+    :param stream: do not read the response body until it is accessed
+    :param timeout: seconds to wait to connect and between bytes, defaults to the timeout in config.ini
+    :return: requests.Response, a successful (or 304 Not Modified) response
+    :raises DownloadError: when the server responds with an error, or the request fails after every retry
+    """
+
+    return with_retries(lambda: send(url, method=method, headers=headers, stream=stream, timeout=timeout), url)
+
+
+def send(url, method='GET', headers=None, stream=False, timeout=None):
+    """ send a single request through the shared session, used inside with_retries when reading the response body
+    should also be retried
+
+    :return: requests.Response, a successful (or 304 Not Modified) response
+    :raises TransientHttpError: when the server responds with an error that may succeed if retried
+    :raises DownloadError: when the server responds with any other error
+    """
+
+    timeout = timeout or get_setting('timeout', 60.0)
+    r = get_session().request(method, url, headers=headers, stream=stream, timeout=timeout)
+
+    if r.status_code in RETRY_STATUSES:
+        r.close()
+        raise TransientHttpError(r)
+    if r.status_code >= 400:
+        r.close()
+        raise DownloadError(url, '{} {}'.format(r.status_code, r.reason))
+    return r
+
+
+def with_retries(func, url, retries=None, backoff_factor=None, backoff_max=None, retry_exceptions=RETRY_EXCEPTIONS):
+    """ call func, retrying transient failures with jittered exponential backoff
+
+    The wait before each retry is a random duration between 0 and backoff_factor * 2 ** attempt seconds (capped at
+    backoff_max), so many workers retrying the same host do not retry in lockstep. Any other error, including errors
+    writing to local disk, is raised immediately
+
+    :param func: function to call, without arguments
+    :param url: url being downloaded, used in logs and errors
+    :param retries: number of retries, defaults to the retries in config.ini
+    :param backoff_factor: base wait in seconds, defaults to the backoff_factor in config.ini
+    :param backoff_max: maximum wait in seconds, defaults to the backoff_max in config.ini
+    :param retry_exceptions: exceptions that are retried, in addition to TransientHttpError
+    :return: the result of func
+    :raises DownloadError: when every attempt fails, or the url is invalid
+    """
+
+    retries = get_setting('retries', 5) if retries is None else retries
+    backoff_factor = get_setting('backoff_factor', 0.5) if backoff_factor is None else backoff_factor
+    backoff_max = get_setting('backoff_max', 60.0) if backoff_max is None else backoff_max
+
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except DownloadError:
+            raise
+        except PERMANENT_EXCEPTIONS as e:
+            logger.error('URL ERROR: {} is not a valid URL: {!r}'.format(url, e))
+            raise DownloadError(url, e)
+        except (TransientHttpError,) + tuple(retry_exceptions) as e:
+            error = e
+            if attempt == retries:
+                break
+
+            wait = random.uniform(0, min(backoff_max, backoff_factor * 2 ** attempt))
+            if isinstance(e, TransientHttpError) and e.retry_after is not None:
+                wait = min(backoff_max, max(wait, e.retry_after))
+
+            logger.warning('attempt {} of {} failed for {}: {!r}, retrying in {:.1f}s'.format(
+                attempt + 1, retries + 1, url, e, wait))
+            time.sleep(wait)
+
+    logger.error('URL ERROR: {} failed after {} attempts'.format(url, retries + 1))
+    raise DownloadError(url, error)
+
+
+class TransientHttpError(Exception):
+    """ a response that may succeed if retried (e.g. 503 Service Unavailable) """
+
+    def __init__(self, response):
+        """
+        :param response: requests.Response
+        """
+
+        Exception.__init__(self, '{} {}'.format(response.status_code, response.reason))
+        self.retry_after = None
+        try:
+            self.retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
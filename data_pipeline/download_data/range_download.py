@@ -0,0 +1,300 @@
+__author__ = 'alsherman'
+
+import io
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib3.exceptions import IncompleteRead
+from .download_error import DownloadError
+from .http_session import send, with_retries
+from ..sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class RangeDownloader:
+    """ downloads large files as byte ranges fetched in parallel, resuming only the missing ranges after an interruption
+
+    The server is probed with a HEAD request. When it reports Accept-Ranges: bytes and a Content-Length, a file of that
+    size is preallocated and each segment of segment_size bytes is requested with a Range header and written at its
+    offset. Completed segments are recorded in a sidecar json file, so a later download of the same url to the same
+    path only requests the segments that are missing, as long as the server reports the same size, ETag and
+    Last-Modified. Partial downloads from servers that report neither an ETag nor Last-Modified are never resumed.
+    Servers that do not support ranges are downloaded in a single stream.
+
+    The file is written to <path>.part and renamed to the path once every segment is complete.
+    """
+
+    def __init__(self, segment_size=16 * 1024 * 1024, workers=4):
+        """
+        :param segment_size: bytes requested in each range request
+        :param workers: number of segments downloaded at a time
+        """
+
+        self.segment_size = segment_size
+        self.workers = workers
+
+    @classmethod
+    def from_config(cls):
+        """ return a downloader with the settings in the RANGEDOWNLOAD section of config.ini """
+
+        if not config.has_section('RANGEDOWNLOAD'):
+            return cls()
+        return cls(segment_size=config['RANGEDOWNLOAD'].getint('segment_size_mb', fallback=16) * 1024 * 1024,
+                   workers=config['RANGEDOWNLOAD'].getint('workers', fallback=4))
+
+    def download(self, url, path, chunk_size=1024 * 1024, probe=None):
+        """ download a url to a path
+
+        :param url: url to download
+        :param path: output path
+        :param chunk_size: bytes written to disk at a time
+        :param probe: result of probe(url), if the server has already been probed
+        :return: dict with the size, etag and last_modified reported by the server
+        """
+
+        probe = probe or self.probe(url)
+        if probe['accept_ranges'] and probe['size']:
+            self._download_segments(url, path, probe, chunk_size)
+        else:
+            logger.info('{} does not support range requests, downloading in a single stream'.format(url))
+            with_retries(lambda: self._download_stream(url, path, chunk_size), url)
+
+        return {'size': os.path.getsize(path), 'etag': probe['etag'], 'last_modified': probe['last_modified']}
+
+    @staticmethod
+    def probe(url):
+        """ send a HEAD request to find if the server supports range requests
+
+        :param url: url to download
+        :return: dict with accept_ranges, size, etag and last_modified
+        """
+
+        try:
+            r = with_retries(lambda: send(url, method='HEAD'), url)
+        except DownloadError as e:
+            logger.info('HEAD request failed for {}: {}'.format(url, e.reason))
+            return {'accept_ranges': False, 'size': None, 'etag': None, 'last_modified': None}
+
+        r.close()
+        size = r.headers.get('Content-Length')
+        return {'accept_ranges': r.headers.get('Accept-Ranges', '').lower() == 'bytes',
+                'size': int(size) if size and size.isdigit() else None,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified')}
+
+    def _download_segments(self, url, path, probe, chunk_size):
+        """ download the missing segments in parallel, then rename the part file to the path """
+
+        part_path = path + '.part'
+        sidecar = _Sidecar(part_path + '.json')
+        state = {'url': url,
+                 'size': probe['size'],
+                 'etag': probe['etag'],
+                 'last_modified': probe['last_modified'],
+                 'segment_size': self.segment_size}
+
+        completed = None
+        if not (probe['etag'] or probe['last_modified']):
+            # without a validator, a changed file of the same size cannot be told apart from the partial download
+            logger.info('{} has no ETag or Last-Modified, downloading every segment'.format(url))
+        elif os.path.exists(part_path) and os.path.getsize(part_path) == probe['size']:
+            completed = sidecar.read(state)
+        if completed is None:
+            completed = set()
+            with open(part_path, 'wb') as f:
+                f.truncate(probe['size'])  # preallocate, so each segment can be written at its offset
+            sidecar.write(state, completed)
+
+        segments = [(index, start, min(start + self.segment_size, probe['size']) - 1)
+                    for index, start in enumerate(range(0, probe['size'], self.segment_size))]
+        missing = [segment for segment in segments if segment[0] not in completed]
+        logger.info('Downloading {} of {} segments of {}'.format(len(missing), len(segments), url))
+
+        # If-Range makes the server send the whole file, rather than a range of a newer version, if it has changed
+        validator = probe['etag'] or probe['last_modified']
+
+        def download_segment(segment):
+            index, start, end = segment
+            with_retries(lambda: self._download_range(url, part_path, start, end, validator, chunk_size), url)
+            sidecar.complete(state, completed, index)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for _ in pool.map(download_segment, missing):
+                pass
+
+        os.replace(part_path, path)
+        sidecar.remove()
+        logger.info('Downloaded {} in {} segments'.format(url, len(segments)))
+
+    @staticmethod
+    def _download_range(url, part_path, start, end, validator, chunk_size):
+        """ download the bytes from start to end (inclusive) and write them at the same offset in the part file """
+
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if validator:
+            headers['If-Range'] = validator
+
+        r = send(url, headers=headers, stream=True)
+        with r:
+            if r.status_code != 206:
+                raise DownloadError(url, 'expected 206 Partial Content for bytes {}-{}, the file may have changed during '
+                                         'the download: {} {}'.format(start, end, r.status_code, r.reason))
+
+            written = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                # ranges are offsets in the encoded body, so the body must not be decoded (e.g. Content-Encoding: gzip)
+                for chunk in r.raw.stream(chunk_size, decode_content=False):
+                    f.write(chunk)
+                    written += len(chunk)
+
+        if written != end - start + 1:
+            raise IncompleteRead(written, end - start + 1 - written)  # retried by with_retries, see RETRY_EXCEPTIONS
+
+    @staticmethod
+    def _download_stream(url, path, chunk_size):
+        """ download the whole file in a single request """
+
+        part_path = path + '.part'
+        with send(url, stream=True) as r, open(part_path, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+        os.replace(part_path, path)
+
+
+class RangeFile(io.RawIOBase):
+    """ read-only, seekable file-like object over a remote file, read with range requests
+
+    Used to open zip files without downloading them: zipfile reads the central directory at the end of the file and
+    then only the members that are extracted. Blocks of block_size bytes are requested and the most recently used
+    blocks are kept, so reading several members in turn does not request the same blocks again.
+
+    Each request sends If-Range with the validator of the probed file, so a file that changes while it is read raises
+    DownloadError instead of returning blocks of two versions of the file.
+    """
+
+    def __init__(self, url, size, validator=None, block_size=8 * 1024 * 1024, max_blocks=4):
+        """
+        :param url: url of a server that supports range requests (see RangeDownloader.probe)
+        :param size: size of the remote file in bytes
+        :param validator: ETag or Last-Modified of the probed file, None to read without checking for changes
+        :param block_size: bytes requested in each range request
+        :param max_blocks: number of blocks kept in memory
+        """
+
+        io.RawIOBase.__init__(self)
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._position = 0
+        self._blocks = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position {}'.format(offset))
+        self._position = offset
+        return self._position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        read = 0
+        while read < len(view) and self._position < self.size:
+            index, offset = divmod(self._position, self.block_size)
+            block = self._block(index)
+            n = min(len(view) - read, len(block) - offset)
+            view[read:read + n] = block[offset:offset + n]
+            read += n
+            self._position += n
+        return read
+
+    def _block(self, index):
+        """ return a block from memory, or request it """
+
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+
+        start = index * self.block_size
+        end = min(start + self.block_size, self.size) - 1
+        block = with_retries(lambda: self._request_block(start, end), self.url)
+
+        self._blocks[index] = block
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def _request_block(self, start, end):
+        headers = {'Range': 'bytes={}-{}'.format(start, end)}
+        if self.validator:
+            headers['If-Range'] = self.validator
+
+        with send(self.url, headers=headers, stream=True) as r:
+            if r.status_code != 206:
+                raise DownloadError(self.url, 'expected 206 Partial Content for bytes {}-{}, the file may have changed '
+                                              'while it was read: {} {}'.format(start, end, r.status_code, r.reason))
+            block = r.raw.read(decode_content=False)
+
+        if len(block) != end - start + 1:
+            raise IncompleteRead(len(block), end - start + 1 - len(block))
+        return block
+
+
+class _Sidecar:
+    """ json file recording the segments of a part file that are complete """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def read(self, state):
+        """ return the completed segments, or None if the sidecar is missing or was written for another version of
+        the file (a different size, ETag, Last-Modified or segment size)
+        """
+
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if any(saved.get(key) != value for key, value in state.items()):
+            logger.info('{} has changed since the last download, restarting the download'.format(state['url']))
+            return None
+        return set(saved['completed'])
+
+    def complete(self, state, completed, index):
+        with self._lock:
+            completed.add(index)
+            self.write(state, completed)
+
+    def write(self, state, completed):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(dict(state, completed=sorted(completed)), f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
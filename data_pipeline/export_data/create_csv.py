@@ -1,36 +1,137 @@
 __author__ = 'alsherman'
 
+import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from .delta_export import DeltaExport
+from .writers import create_writer
 
 
 logger = logging.getLogger(__name__)
 
 
 class CSVCreator:
-    """ creates and exports a csv from input data """
+    """ creates and exports a csv from input data
 
-    def __init__(self, source_metadata):
+    Other formats are selected from the extension of the output_path (e.g. .parquet, .feather, .csv.gz, .csv.zst), or
+    set in the sources_metadata, either for every output or for each data category:
+
+        'output_format': 'parquet',
+        'output_options': {'compression': 'zstd', 'row_group_size': 100000},
+
+        'output_format': {'data_category': 'parquet'},
+        'output_options': {'data_category': {'compression': 'zstd', 'row_group_size': 100000}}
+
+    When there are many outputs, they are written concurrently. Each output is written to a temp file and renamed once
+    complete, so a failed export never leaves a truncated file behind.
+
+    Set 'delta_keys' to also write the rows that were inserted, updated and deleted since the previous export of each
+    output, identified by the key columns (see DeltaExport):
+
+        'delta_keys': {'data_category': ['id']}
+
+    The change sets are returned with the outputs, and emptied by clear_deltas when the export is skipped.
+    """
+
+    def __init__(self, source_metadata, workers=None, batch_size=100000):
         """
-        :param source_metadata: includes the data to export
+        :param source_metadata: includes the data to export. Each dataframe may also be an iterable of dataframe chunks
+        :param workers: maximum number of outputs written at a time, defaults to the number of cpus
+        :param batch_size: maximum rows converted and written at a time
         """
 
         self.source_metadata = source_metadata
         self.csv_name = source_metadata.output_path
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
 
     def create_csv(self, sources_metadata):
         """ export one or more csvs
 
         :param sources_metadata: metadata about the source
+        :return: paths of the created csvs, each followed by the paths of its change sets if delta_keys are set
         """
 
         # if only one dataframe, add it to a dict to add name
         if not isinstance(self.source_metadata.dataframe, dict):
-            self.source_metadata.dataframe = {self.csv_name:self.source_metadata.dataframe}
+            self.source_metadata.dataframe = {self.source_metadata.data_category:self.source_metadata.dataframe}
+
+        outputs = list(self.source_metadata.dataframe.items())
+        if len(outputs) == 1 or self.workers == 1:
+            return [path for data_category, dataframe in outputs
+                    for path in self._export(data_category, dataframe, sources_metadata)]
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(outputs))) as pool:
+            futures = [pool.submit(self._export, data_category, dataframe, sources_metadata)
+                       for data_category, dataframe in outputs]
+
+        # raise the first error only after every export has finished, so the other outputs are complete
+        return [path for future in futures for path in future.result()]
+
+    def clear_deltas(self, sources_metadata, outputs):
+        """ write empty change sets for the outputs with delta_keys, when the export is skipped because the source has
+        not changed, so downstream loaders do not ingest the changes of the previous export again
+
+        :param sources_metadata: metadata about the source
+        :param outputs: paths of the outputs of the previous export
+        """
+
+        for data_category in sources_metadata['output_path']:
+            csv_name = self.source_metadata.create_output_path(data_category, sources_metadata)
+            delta_keys = self._get_option(sources_metadata, 'delta_keys', data_category)
+            if delta_keys and csv_name in outputs:
+                DeltaExport(csv_name, delta_keys).clear(self._writer(csv_name, data_category, sources_metadata))
+
+    def _export(self, data_category, dataframe, sources_metadata):
+        """ export a single output
+
+        :param data_category: name of the output
+        :param dataframe: dataframe, or iterable of dataframe chunks, to export
+        :param sources_metadata: metadata about the source
+        :return: paths of the created file and of its change sets
+        """
+
+        csv_name = self.source_metadata.create_output_path(data_category, sources_metadata)
+        writer = self._writer(csv_name, data_category, sources_metadata)
+        delta_keys = self._get_option(sources_metadata, 'delta_keys', data_category)
+        delta = DeltaExport(csv_name, delta_keys) if delta_keys else None
+
+        writer.write(delta.track(dataframe) if delta else dataframe, csv_name)
+        logger.info('Created {}: {}'.format(writer.format, csv_name))
+
+        if delta and delta.finish(writer) is not None:
+            return [csv_name] + delta.delta_paths()
+        return [csv_name]
+
+    def _writer(self, csv_name, data_category, sources_metadata):
+        """ create the writer of an output, with its output_format and output_options """
+
+        options = dict({'batch_size': self.batch_size},
+                       **(self._get_option(sources_metadata, 'output_options', data_category) or {}))
+        return create_writer(csv_name,
+                             output_format=self._get_option(sources_metadata, 'output_format', data_category),
+                             **options)
+
+    @staticmethod
+    def _get_option(sources_metadata, option, data_category):
+        """ return an export option set for every output, or for a single data category
+
+        output_options are themselves a dict, so they are set for each data category when every value is a dict of
+        options, e.g. {'data_category': {'compression': 'zstd'}}, and for every output otherwise, e.g.
+        {'compression': 'zstd'}
+
+        :param sources_metadata: metadata about the source
+        :param option: output_format, output_options or delta_keys
+        :param data_category: name of the output
+        """
 
-        for csv_name, dataframe in self.source_metadata.dataframe.items():
-            csv_name = self.source_metadata.create_output_path(csv_name, sources_metadata)
-            dataframe.to_csv(csv_name, index=False)
-            logger.info('Created CSV: {}'.format(csv_name))
+        value = sources_metadata.get(option)
+        if option == 'output_options' and isinstance(value, dict) and not all(
+                isinstance(options, dict) for options in value.values()):
+            return value
+        if isinstance(value, dict):
+            return value.get(data_category)
+        return value
 
 
 if __name__ == "__main__":
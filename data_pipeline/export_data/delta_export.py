@@ -0,0 +1,186 @@
+__author__ = 'alsherman'
+
+import os
+import uuid
+import shutil
+import logging
+import numpy as np
+import pandas as pd
+from .writers import atomic_output, extensions, iter_batches
+
+
+logger = logging.getLogger(__name__)
+
+
+class DeltaExport:
+    """ writes the rows that were inserted, updated and deleted since the previous export of an output, next to the
+    full snapshot, so downstream loaders only ingest the changes
+
+    The previous export is kept as a compact index next to the output, with the key columns of each row and two 64 bit
+    hashes, one of the key columns and one of the whole row, computed with pd.util.hash_pandas_object. Rows are hashed
+    as the snapshot is written, one chunk at a time, and looked up in a hash table of the previous keys, so the diff
+    is much cheaper than the export. Only the changed rows are held in memory, and none on the first export.
+
+    The key columns are set in the sources_metadata, either for every output or for each data category:
+
+        'delta_keys': {'data_category': ['state', 'county']}
+
+    For an output of data.csv, the changes are written to data.inserted.csv, data.updated.csv (the new version of each
+    changed row) and data.deleted.csv (the key columns of each deleted row), in the format of the snapshot. They are
+    written on every export, empty when nothing changed, and emptied when a run is skipped because the source is
+    unchanged (see clear). The first export has no index to compare to, so the snapshot is copied as the inserted
+    rows. The hashes depend on the column types, so set a schema for columns whose inferred type can change between
+    exports (e.g. integers with missing values).
+    """
+
+    def __init__(self, path, keys):
+        """
+        :param path: path of the full snapshot
+        :param keys: key columns that identify a row across exports
+        """
+
+        self.path = path
+        self.keys = list(keys)
+        self.index_path = os.path.join(os.path.dirname(path), '.{}.delta_index.pkl'.format(os.path.basename(path)))
+        self._previous = None
+        self._previous_keys = None
+        self._seen = None
+        self._template = None
+        self._index = []
+        self._changes = {'inserted': [], 'updated': []}
+
+    def delta_path(self, change):
+        """ return the path of a change set, e.g. data.inserted.csv.gz for data.csv.gz
+
+        :param change: inserted, updated or deleted
+        """
+
+        lower_path = self.path.lower()
+        extension = next((extension for extension, _ in extensions if lower_path.endswith(extension)),
+                         os.path.splitext(self.path)[1])
+        base = self.path[:len(self.path) - len(extension)]
+        return '{}.{}{}'.format(base, change, self.path[len(base):])
+
+    def delta_paths(self):
+        """ return the paths of the inserted, updated and deleted change sets """
+
+        return [self.delta_path(change) for change in ('inserted', 'updated', 'deleted')]
+
+    def track(self, data):
+        """ hash the rows of each chunk as it is exported, and keep the rows that changed since the previous export
+
+        :param data: dataframe, or an iterable of dataframe chunks
+        :return: generator over the chunks, to pass to the writer of the snapshot
+        """
+
+        self._previous = self._read_index()['index']
+        if self._previous is not None:
+            self._previous_keys = pd.Index(self._previous['_key_hash'].to_numpy())  # hash table of the unique keys
+            self._seen = np.zeros(len(self._previous), dtype=bool)
+
+        for chunk in iter_batches(data, None):
+            self._compare(chunk)
+            yield chunk
+
+    def _compare(self, chunk):
+        missing = [key for key in self.keys if key not in chunk.columns]
+        if missing:
+            raise KeyError('delta key columns {} are not in {}'.format(missing, self.path))
+
+        if self._template is None:
+            self._template = chunk.iloc[:0]
+
+        key_hash = pd.util.hash_pandas_object(chunk[self.keys], index=False).to_numpy()
+        row_hash = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        self._index.append(pd.DataFrame(dict({key: chunk[key].to_numpy() for key in self.keys},
+                                             _key_hash=key_hash, _row_hash=row_hash)))
+
+        if self._previous is None:  # every row is inserted, the snapshot is copied once it is written
+            return
+
+        position = self._previous_keys.get_indexer(key_hash)
+        found = position >= 0
+        changed = found & (self._previous['_row_hash'].to_numpy()[position] != row_hash)
+        self._seen[position[found]] = True
+
+        self._changes['inserted'].append(chunk[~found])
+        self._changes['updated'].append(chunk[changed])
+
+    def finish(self, writer):
+        """ write the change sets and replace the index, once the snapshot has been written
+
+        :param writer: writer of the snapshot, used to write the change sets in the same format
+        :return: dict of change to the number of rows, or None if the key columns are not unique
+        """
+
+        index = pd.concat(self._index, ignore_index=True) if self._index else pd.DataFrame(
+            columns=self.keys + ['_key_hash', '_row_hash'])
+        if index['_key_hash'].duplicated().any():
+            logger.error('{} rows of {} have the same delta keys {}, the changes are not exported'.format(
+                int(index['_key_hash'].duplicated().sum()), self.path, self.keys))
+            self._remove_changes()  # never leave the changes of an earlier export behind
+            return None
+
+        template = self._template if self._template is not None else pd.DataFrame(columns=self.keys)
+        changes = {change: pd.concat(chunks, ignore_index=True) if chunks else template
+                   for change, chunks in self._changes.items()}
+        if self._previous is None:
+            del changes['inserted']
+            changes['deleted'] = template[self.keys]
+            with atomic_output(self.delta_path('inserted')) as temp_path:
+                shutil.copyfile(self.path, temp_path)
+        else:
+            changes['deleted'] = self._previous.loc[~self._seen, self.keys].reset_index(drop=True)
+
+        for change, df in changes.items():
+            writer.write(df, self.delta_path(change))
+
+        # the index is replaced once every change set is written, so a failed export is compared to the same index.
+        # The empty snapshot is kept with it to write empty change sets when the export is skipped
+        temp_path = '{}.{}.tmp'.format(self.index_path, uuid.uuid4().hex)
+        pd.to_pickle({'index': index, 'template': template}, temp_path)
+        os.replace(temp_path, self.index_path)
+
+        counts = {change: len(df) for change, df in changes.items()}
+        if self._previous is None:
+            counts['inserted'] = len(index)
+        logger.info('delta of {}: {inserted} inserted, {updated} updated, {deleted} deleted rows'.format(
+            self.path, **counts))
+        return counts
+
+    def clear(self, writer):
+        """ write empty change sets, when the export is skipped because the source has not changed since the previous
+        export, and keep the index
+
+        :param writer: writer of the snapshot, used to write the change sets in the same format
+        """
+
+        template = self._read_index()['template']
+        if template is None:
+            self._remove_changes()
+            return
+
+        for change in ('inserted', 'updated'):
+            writer.write(template, self.delta_path(change))
+        writer.write(template[self.keys], self.delta_path('deleted'))
+        logger.info('delta of {}: unchanged since the previous export'.format(self.path))
+
+    def _remove_changes(self):
+        for delta_path in self.delta_paths():
+            if os.path.exists(delta_path):
+                os.remove(delta_path)
+
+    def _read_index(self):
+        """ return a dict of the index and the empty snapshot of the previous export, each None if there is no
+        previous export with the same keys """
+
+        try:
+            saved = pd.read_pickle(self.index_path)
+        except FileNotFoundError:
+            logger.info('no previous export of {}, every row is exported as inserted'.format(self.path))
+            return {'index': None, 'template': None}
+
+        if not isinstance(saved, dict) or list(saved['index'].columns[:-2]) != self.keys:
+            logger.info('the delta keys of {} changed, every row is exported as inserted'.format(self.path))
+            return {'index': None, 'template': None}
+        return saved
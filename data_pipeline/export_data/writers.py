@@ -0,0 +1,295 @@
+__author__ = 'alsherman'
+
+import os
+import gzip
+import uuid
+import logging
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class CsvWriter:
+    """ writes a dataframe to a csv, optionally compressed with gzip or zstd """
+
+    format = 'csv'
+
+    def __init__(self, compression=None, compression_level=None, batch_size=100000):
+        """
+        :param compression: None, 'gzip', or 'zstd' (requires the zstandard package)
+        :param compression_level: compression level, defaults to 6 for gzip (its default of 9 is several times slower
+               for little gain) and 3 for zstd
+        :param batch_size: maximum rows converted to text and written at a time
+        """
+
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstandard is required to export zstd compressed csvs, install it with: pip install zstandard')
+
+        self.compression = compression
+        self.compression_level = compression_level
+        self.batch_size = batch_size
+
+    def write(self, data, path):
+        """
+        :param data: dataframe, or an iterable of dataframe chunks, to export
+        :param path: output path, written to a temp file that is renamed once the export is complete
+        """
+
+        with atomic_output(path) as temp_path, self._open(temp_path) as f:
+            for index, batch in enumerate(iter_batches(data, self.batch_size)):
+                batch.to_csv(f, index=False, header=index == 0)
+
+    def _open(self, path):
+        """ open a text file handle, compressing the output if needed """
+
+        if self.compression == 'gzip':
+            level = 6 if self.compression_level is None else self.compression_level
+            return gzip.open(path, 'wt', compresslevel=level, newline='')
+        elif self.compression == 'zstd':
+            level = 3 if self.compression_level is None else self.compression_level
+            return zstandard.open(path, 'wt', cctx=zstandard.ZstdCompressor(level=level), newline='')
+        return open(path, 'w', newline='')
+
+
+class ParquetWriter:
+    """ writes a dataframe to parquet with pyarrow, keeping column types for downstream loaders """
+
+    format = 'parquet'
+
+    def __init__(self, compression='snappy', compression_level=None, row_group_size=None, batch_size=100000):
+        """
+        :param compression: 'snappy', 'gzip', 'brotli', 'lz4', 'zstd', or None
+        :param compression_level: compression level, defaults to the codec's default
+        :param row_group_size: maximum rows in each row group, defaults to the batch_size
+        :param batch_size: maximum rows converted to arrow and written at a time
+        """
+
+        _require_pyarrow(self.format)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.batch_size = batch_size
+
+    def write(self, data, path):
+        """
+        :param data: dataframe, or an iterable of dataframe chunks, to export
+        :param path: output path, written to a temp file that is renamed once the export is complete
+        """
+
+        with atomic_output(path) as temp_path:
+            writer = None
+            try:
+                for table in iter_schema_tables(data, self.batch_size):
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(temp_path, table.schema,
+                                                               compression=self.compression,
+                                                               compression_level=self.compression_level)
+                    writer.write_table(table, row_group_size=self.row_group_size)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:
+                raise ValueError('no dataframe chunks to export to {}'.format(path))
+
+
+class FeatherWriter:
+    """ writes a dataframe to feather (arrow ipc) with pyarrow, the fastest format to write and load """
+
+    format = 'feather'
+
+    def __init__(self, compression='lz4', compression_level=None, row_group_size=None, batch_size=100000):
+        """
+        :param compression: 'lz4', 'zstd', or 'uncompressed'
+        :param compression_level: compression level, defaults to the codec's default
+        :param row_group_size: maximum rows in each record batch, defaults to the batch_size
+        :param batch_size: maximum rows converted to arrow and written at a time
+        """
+
+        _require_pyarrow(self.format)
+        self.compression = None if compression == 'uncompressed' else compression
+        self.compression_level = compression_level
+        self.row_group_size = row_group_size
+        self.batch_size = batch_size
+
+    def write(self, data, path):
+        """
+        :param data: dataframe, or an iterable of dataframe chunks, to export
+        :param path: output path, written to a temp file that is renamed once the export is complete
+        """
+
+        codec = None
+        if self.compression:
+            codec = pyarrow.Codec(self.compression, compression_level=self.compression_level)
+        options = pyarrow.ipc.IpcWriteOptions(compression=codec)
+
+        with atomic_output(path) as temp_path:
+            writer = None
+            try:
+                for table in iter_schema_tables(data, self.batch_size):
+                    if writer is None:
+                        writer = pyarrow.ipc.new_file(temp_path, table.schema, options=options)
+                    writer.write_table(table, max_chunksize=self.row_group_size)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:
+                raise ValueError('no dataframe chunks to export to {}'.format(path))
+
+
+def _require_pyarrow(output_format):
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to export {} files, install it with: pip install pyarrow'.format(output_format))
+
+
+@contextmanager
+def atomic_output(path):
+    """ yield a temp path next to the output path, and rename it to the output path only if the export succeeds, so
+    downstream loaders never read a partially written file
+
+    :param path: output path
+    """
+
+    temp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def iter_batches(data, batch_size):
+    """ yield dataframes of at most batch_size rows
+
+    :param data: dataframe, or an iterable of dataframe chunks (e.g. a streamed source)
+    :param batch_size: maximum rows in each batch, None to yield a dataframe whole
+    """
+
+    chunks = [data] if isinstance(data, pd.DataFrame) else data
+    for chunk in chunks:
+        if batch_size is None or len(chunk) <= batch_size:
+            yield chunk
+            continue
+        for start in range(0, len(chunk), batch_size):
+            yield chunk.iloc[start:start + batch_size]
+
+
+def iter_tables(data, batch_size):
+    """ yield pyarrow tables of at most batch_size rows, an empty dataframe still yields one table for the schema """
+
+    for batch in iter_batches(data, batch_size):
+        yield pyarrow.Table.from_pandas(batch, preserve_index=False)
+
+
+def iter_schema_tables(data, batch_size, max_pending=10):
+    """ yield pyarrow tables of at most batch_size rows, cast to a single schema for the whole file
+
+    The schema is the schema of the first table, except for columns that are all null in the first table (e.g. a
+    chunk of a streamed source without values in a column), which arrow types as null. Tables are held until every
+    such column has values, and the column takes the type of its first values. Columns that are still null after
+    max_pending tables are written as strings, which values of any type can be cast to
+
+    :param data: dataframe, or an iterable of dataframe chunks
+    :param batch_size: maximum rows in each table
+    :param max_pending: maximum tables held while the type of a column is unknown
+    """
+
+    schema = None
+    pending = []
+    for table in iter_tables(data, batch_size):
+        if schema is not None:
+            yield table.cast(schema)
+            continue
+
+        pending.append(table)
+        resolved = _resolve_null_types([table.schema for table in pending])
+        if len(pending) >= max_pending or not any(pyarrow.types.is_null(field.type) for field in resolved):
+            schema = pyarrow.schema([field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+                                     for field in resolved], metadata=resolved.metadata)
+            for table in pending:
+                yield table.cast(schema)
+            pending = []
+
+    if pending:  # columns without any values are written as null
+        schema = _resolve_null_types([table.schema for table in pending])
+        for table in pending:
+            yield table.cast(schema)
+
+
+def _resolve_null_types(schemas):
+    """ return the first schema, with each null typed column given its type in the first schema where it has one """
+
+    fields = []
+    for field in schemas[0]:
+        if pyarrow.types.is_null(field.type):
+            field = next((schema.field(field.name) for schema in schemas[1:]
+                          if not pyarrow.types.is_null(schema.field(field.name).type)), field)
+        fields.append(field)
+    return pyarrow.schema(fields, metadata=schemas[0].metadata)
+
+
+# output format name: (writer class, default options)
+writers = {'csv': (CsvWriter, {}),
+           'csv.gz': (CsvWriter, {'compression': 'gzip'}),
+           'csv.zst': (CsvWriter, {'compression': 'zstd'}),
+           'parquet': (ParquetWriter, {}),
+           'feather': (FeatherWriter, {})}
+
+# file extensions used to infer the output format when one is not set
+extensions = [('.csv.gz', 'csv.gz'),
+              ('.gz', 'csv.gz'),
+              ('.csv.zst', 'csv.zst'),
+              ('.zst', 'csv.zst'),
+              ('.parquet', 'parquet'),
+              ('.pq', 'parquet'),
+              ('.feather', 'feather'),
+              ('.arrow', 'feather')]
+
+
+def infer_format(path):
+    """ determine the output format from the output path's extension, defaults to csv
+
+    :param path: output path
+    """
+
+    lower_path = path.lower()
+    for extension, output_format in extensions:
+        if lower_path.endswith(extension):
+            return output_format
+    return 'csv'
+
+
+def create_writer(path, output_format=None, **options):
+    """ create the writer for an output
+
+    :param path: output path, used to infer the format when output_format is None
+    :param output_format: one of the formats in writers (e.g. 'parquet' or 'csv.gz')
+    :param options: writer options (e.g. compression, compression_level, row_group_size, batch_size)
+    :return: writer with a write(data, path) method
+    """
+
+    output_format = output_format or infer_format(path)
+    try:
+        writer_class, defaults = writers[output_format]
+    except KeyError:
+        logger.error('{} is not a supported output format: {}'.format(output_format, sorted(writers)))
+        raise ValueError('{} is not a supported output format'.format(output_format))
+
+    return writer_class(**dict(defaults, **options))
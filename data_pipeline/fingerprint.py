@@ -0,0 +1,280 @@
+__author__ = 'alsherman'
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+    import msvcrt
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_fingerprint(source_metadata, func):
+    """ hash everything that determines the exported data: the raw downloaded data, the code of the cleaning function
+    and the sources_metadata entries for the data category, including its schema and export options
+
+    :param source_metadata: source metadata, including the downloaded data
+    :param func: custom data cleaning function
+    :return: dict of hashes, or None if the downloaded data is streamed and cannot be hashed without consuming it
+    """
+
+    data_hash = _hash_data(source_metadata)
+    if data_hash is None:
+        return None
+
+    sources_metadata = source_metadata.sources_metadata
+    data_category = source_metadata.data_category
+    # the schema is keyed by data category, or by the name of each file extracted from a zip or ftp directory
+    metadata = {'source_path': sources_metadata['source_path'],
+                'data_category': sources_metadata['data_categories'][data_category],
+                'headers': sources_metadata['headers'],
+                'output_path': sources_metadata['output_path'],
+                'schema': sources_metadata.get('schema'),
+                'output_format': sources_metadata.get('output_format'),
+                'output_options': sources_metadata.get('output_options'),
+                'delta_keys': sources_metadata.get('delta_keys')}
+
+    return {'data': data_hash,
+            'func': _hash_bytes(_func_code(func)),
+            'metadata': _hash_bytes(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))}
+
+
+def _hash_data(source_metadata, chunk_size=1024 * 1024):
+    """ hash the downloaded data, or the local file when using local files """
+
+    data = source_metadata.downloaded_data
+    sha = hashlib.sha256()
+
+    if data is None:
+        with open(source_metadata.raw_data_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+    elif isinstance(data, (str, bytes)):
+        sha.update(_to_bytes(data))
+    elif isinstance(data, (list, tuple)):
+        for row in data:
+            sha.update(_to_bytes(row))
+    elif isinstance(data, dict) and all(isinstance(rows, (list, tuple)) for rows in data.values()):
+        for name in sorted(data):  # members of a zip
+            sha.update(_to_bytes(name))
+            for row in data[name]:
+                sha.update(_to_bytes(row))
+    else:
+        return None
+
+    return sha.hexdigest()
+
+
+def _func_code(func):
+    """ return the code of the cleaning function and of the helpers it uses: the functions, classes and modules it
+    references by name or through a closure, recursively, and the values of the constants it references
+
+    Only helpers outside of the python installation and the data_pipeline package are included, so changes to
+    installed packages (e.g. pandas) do not change the fingerprint. Helpers that are only reached through an object
+    (e.g. a method of an instance passed in, or a function called by a method of a class) are not included
+
+    :param func: cleaning function, or a functools.partial of one
+    """
+
+    parts = []
+    _add_code(func, parts, set())
+    return b'\n'.join(parts)
+
+
+def _add_code(obj, parts, seen):
+    """ append the code of a function, class or module, and of the helpers that a function references, to parts """
+
+    import inspect  # slow to import, and only needed once the data is downloaded
+
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, functools.partial):
+        _add_code(obj.func, parts, seen)
+        _add_values(list(enumerate(obj.args)) + sorted(obj.keywords.items()), parts, seen)
+        return
+
+    try:
+        parts.append(inspect.getsource(obj).encode('utf-8'))
+    except (OSError, TypeError):
+        code = getattr(obj, '__code__', None)
+        if code is not None:
+            parts.append(code.co_code + repr(code.co_consts).encode('utf-8'))
+        else:
+            parts.append(repr(getattr(obj, '__qualname__', getattr(obj, '__name__', obj))).encode('utf-8'))
+
+    code = getattr(obj, '__code__', None)
+    if code is None or not inspect.isfunction(obj):
+        return  # the source of classes and modules already includes their methods
+
+    _add_values([(name, obj.__globals__[name]) for name in _code_names(code) if name in obj.__globals__], parts, seen)
+    # mutable values of a closure are usually state that the function updates (e.g. a counter), rather than settings
+    _add_values([(name, cell.cell_contents) for name, cell in zip(code.co_freevars, obj.__closure__ or ())
+                 if _has_contents(cell)], parts, seen, mutable=False)
+
+
+def _add_values(values, parts, seen, mutable=True):
+    """ append the code of the helpers, and the repr of the constants, in a list of (name, value) to parts
+
+    :param mutable: include lists and dicts of constants, otherwise only numbers, strings and tuples
+    """
+
+    for name, value in values:
+        if _is_user_code(value):
+            _add_code(value, parts, seen)
+        elif _is_constant(value, mutable):
+            parts.append('{} = {!r}'.format(name, value).encode('utf-8'))
+
+
+def _code_names(code):
+    """ return the global names used by a code object and by the functions, lambdas and comprehensions inside it """
+
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names.extend(_code_names(const))
+    return names
+
+
+def _is_constant(value, mutable=True):
+    """ determine if a value is a number, string, or a tuple (or list or dict, if mutable) of them, whose repr is the
+    same in every run (unlike, e.g., the repr of a function, which includes its address) """
+
+    if isinstance(value, (bool, int, float, complex, str, bytes, type(None))):
+        return True
+    if isinstance(value, tuple) or (mutable and isinstance(value, list)):
+        return all(_is_constant(item, mutable) for item in value)
+    if mutable and isinstance(value, dict):
+        return all(_is_constant(key, mutable) and _is_constant(item, mutable) for key, item in value.items())
+    return False
+
+
+def _has_contents(cell):
+    try:
+        cell.cell_contents
+    except ValueError:  # a closure variable that is not assigned yet
+        return False
+    return True
+
+
+def _is_user_code(value):
+    """ determine if a value is a function, class or module defined outside of the python installation and the
+    data_pipeline package """
+
+    import inspect
+    import sysconfig
+
+    if not (inspect.isfunction(value) or inspect.isclass(value) or inspect.ismodule(value)):
+        return False
+
+    try:
+        path = os.path.realpath(inspect.getfile(value))
+    except TypeError:  # built in modules and classes
+        return False
+
+    library_folders = {os.path.dirname(os.path.realpath(__file__))}
+    library_folders.update(os.path.realpath(folder) for key, folder in sysconfig.get_paths().items()
+                           if key in ('stdlib', 'platstdlib', 'purelib', 'platlib'))
+    return not any(path.startswith(folder + os.sep) for folder in library_folders)
+
+
+def _hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _to_bytes(data):
+    return data.encode('utf-8') if isinstance(data, str) else data
+
+
+class FingerprintManifest:
+    """ stores the fingerprint of the last successful run of each source and data category in a manifest file in the
+    export folder, used to skip the transform and export of sources that have not changed """
+
+    manifest_name = '.data_pipeline_manifest.json'
+    _lock = threading.Lock()
+
+    def __init__(self, export_folder):
+        """
+        :param export_folder: folder that the data is exported to
+        """
+
+        self.path = os.path.join(export_folder, self.manifest_name)
+
+    def is_unchanged(self, key, fingerprint):
+        """ determine if a source was already exported with the same fingerprint and its exported files still exist
+
+        :param key: identifies the source and data category
+        :param fingerprint: fingerprint of the current run
+        """
+
+        if fingerprint is None:
+            return False
+
+        with self._lock:
+            entry = self._read().get(key)
+
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return all(os.path.exists(output) for output in entry['outputs'])
+
+    def record(self, key, fingerprint, outputs):
+        """ store the fingerprint of a successful run
+
+        The manifest is read, updated and replaced while holding a lock file next to it, so the records of pipelines
+        run in other processes (e.g. BatchRunner workers, or another run of the same jobs) are never overwritten
+
+        :param key: identifies the source and data category
+        :param fingerprint: fingerprint of the current run
+        :param outputs: paths of the exported files
+        """
+
+        with self._locked():
+            manifest = self._read()
+            manifest[key] = {'fingerprint': fingerprint, 'outputs': outputs}
+
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+    @contextmanager
+    def _locked(self):
+        """ hold the lock of the manifest, across the threads of this process and across processes """
+
+        with self._lock, open(self.path + '.lock', 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def entries(self):
+        """ return every recorded source and data category """
+
+        with self._lock:
+            return self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
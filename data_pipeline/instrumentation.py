@@ -0,0 +1,372 @@
+__author__ = 'alsherman'
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+from .sources_metadata.source_metadata import config
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineMetrics:
+    """ records the wall time, cpu time and memory of each stage of a pipeline run, along with the bytes downloaded,
+    the rows and columns produced, and the bytes exported
+
+    The metrics are stored on the SourceMetadata, so they follow the run through every stage, including cleaning
+    functions run in a BatchRunner worker process. Once the run is complete, emit logs a JSON record and, when set in
+    the INSTRUMENTATION section of config.ini, appends it to a metrics file and writes a Prometheus textfile.
+
+    CPU time is the time of the thread running the stage. Peak RSS and traced memory are measured for the whole
+    process, so they are only exact for a stage when stages are not run concurrently.
+    """
+
+    def __init__(self, name, trace_memory=False, profiler=None, metrics_file=None, prometheus_folder=None):
+        """
+        :param name: name of the pipeline
+        :param trace_memory: record the peak memory allocated by python in each stage with tracemalloc, which slows
+               down the pipeline
+        :param profiler: function called with the pipeline name and stage that returns a context manager to profile
+               the stage (e.g. sampling_profiler). It must be picklable to profile cleaning functions run in a process
+        :param metrics_file: file that a JSON record of each run is appended to
+        :param prometheus_folder: folder that a Prometheus textfile for each pipeline is written to, e.g. the folder
+               read by the node_exporter textfile collector
+        """
+
+        self.name = name
+        self.trace_memory = trace_memory
+        self.profiler = profiler
+        self.metrics_file = metrics_file
+        self.prometheus_folder = prometheus_folder
+        self.stages = {}
+        self.values = {}
+
+    @classmethod
+    def from_config(cls, name):
+        """ return metrics with the settings in the INSTRUMENTATION section of config.ini
+
+        :param name: name of the pipeline
+        """
+
+        if not config.has_section('INSTRUMENTATION'):
+            return cls(name)
+
+        settings = config['INSTRUMENTATION']
+        profiler = None
+        if settings.get('profile_folder'):
+            profiler = partial(sampling_profiler, settings['profile_folder'],
+                               interval=settings.getfloat('profile_interval', fallback=0.005))
+
+        return cls(name,
+                   trace_memory=settings.getboolean('trace_memory', fallback=False),
+                   profiler=profiler,
+                   metrics_file=settings.get('metrics_file') or None,
+                   prometheus_folder=settings.get('prometheus_folder') or None)
+
+    @contextmanager
+    def stage(self, stage):
+        """ measure a stage of the pipeline
+
+        :param stage: name of the stage (e.g. extract, transform or load)
+        """
+
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        profile = self.profiler(self.name, stage) if self.profiler else _no_profile()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+
+        try:
+            with profile:
+                yield
+        finally:
+            metrics = self.stages.setdefault(stage, {})
+            metrics['wall_seconds'] = time.perf_counter() - wall_start
+            metrics['cpu_seconds'] = time.thread_time() - cpu_start
+            metrics['peak_rss_bytes'] = peak_rss()
+            if self.trace_memory:
+                metrics['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+
+    def measure(self, stage, iterable):
+        """ measure a stage that is a generator, in the thread that iterates it (e.g. a StreamPipeline stage)
+
+        :param stage: name of the stage
+        :param iterable: items of the stage
+        :return: generator over the items. The wall time includes the time waiting for the other stages
+        """
+
+        with self.stage(stage):
+            yield from iterable
+
+    def record(self, **values):
+        """ record values of the run, e.g. downloaded_bytes """
+
+        self.values.update(values)
+
+    def record_downloaded(self, downloaded_data):
+        """ record the bytes of the downloaded data
+
+        :param downloaded_data: downloaded data, as returned by DownloadData.download
+        :return: the downloaded data. Lazy iterators are wrapped to count the bytes as they are consumed
+        """
+
+        if isinstance(downloaded_data, dict):
+            return {name: self.record_downloaded(data) for name, data in downloaded_data.items()}
+
+        size = data_size(downloaded_data)
+        if size is not None or downloaded_data is None:
+            self.values['downloaded_bytes'] = self.values.get('downloaded_bytes', 0) + (size or 0)
+            return downloaded_data
+        return self._count_bytes(downloaded_data)
+
+    def _count_bytes(self, iterator):
+        self.values.setdefault('downloaded_bytes', 0)
+        for chunk in iterator:
+            self.values['downloaded_bytes'] += len(chunk)
+            yield chunk
+
+    def record_dataframes(self, dataframe):
+        """ record the rows and columns of each cleaned dataframe
+
+        :param dataframe: dataframe, dict of dataframes, or iterables of dataframe chunks which are not counted
+        """
+
+        import pandas as pd  # imported when used, so importing the package stays fast
+
+        dataframes = dataframe if isinstance(dataframe, dict) else {None: dataframe}
+        tables = {name: {'rows': len(df), 'columns': len(df.columns)}
+                  for name, df in dataframes.items() if isinstance(df, pd.DataFrame)}
+        if not tables:
+            return
+
+        self.values['rows'] = sum(table['rows'] for table in tables.values())
+        self.values['columns'] = sum(table['columns'] for table in tables.values())
+        if None not in tables:
+            self.values['tables'] = tables
+
+    def record_chunks(self, chunks):
+        """ record the rows and columns of cleaned dataframe chunks as they are consumed
+
+        :param chunks: iterable of dataframe chunks
+        :return: generator over the chunks
+        """
+
+        self.values['rows'] = 0
+        for chunk in chunks:
+            self.values['rows'] += len(chunk)
+            self.values['columns'] = len(chunk.columns)
+            yield chunk
+
+    def record_outputs(self, outputs):
+        """ record the bytes of the exported files
+
+        :param outputs: paths of the exported files
+        """
+
+        self.values['exported_bytes'] = sum(os.path.getsize(output) for output in outputs if os.path.exists(output))
+
+    def to_dict(self, outcome=None):
+        """ return the JSON record of the run
+
+        :param outcome: outcome of the run, e.g. 'skipped' or 'rebuilt'
+        """
+
+        return dict({'pipeline': self.name,
+                     'outcome': outcome,
+                     'timestamp': time.time(),
+                     'stages': self.stages}, **self.values)
+
+    def emit(self, outcome=None):
+        """ log the JSON record of the run, and write it to the metrics file and Prometheus textfile when set
+
+        :param outcome: outcome of the run, e.g. 'skipped' or 'rebuilt'
+        :return: the JSON record
+        """
+
+        record = self.to_dict(outcome)
+        logger.info('metrics: {}'.format(json.dumps(record, sort_keys=True)))
+
+        try:
+            if self.metrics_file:
+                with _file_lock, open(self.metrics_file, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+            if self.prometheus_folder:
+                write_prometheus(record, self.prometheus_folder)
+        except OSError as e:
+            logger.error('unable to write the metrics of {}: {}'.format(self.name, e))
+
+        return record
+
+
+_file_lock = threading.Lock()
+
+
+@contextmanager
+def _no_profile():
+    yield
+
+
+def data_size(data):
+    """ return the bytes of downloaded data, or None for lazy iterators which cannot be measured without consuming them
+
+    :param data: str, bytes, or list of rows
+    """
+
+    if data is None:
+        return None
+    if isinstance(data, bytes):
+        return len(data)
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    if isinstance(data, (list, tuple)):
+        return sum(len(row) if isinstance(row, bytes) else len(row.encode('utf-8')) for row in data)
+    return None
+
+
+def peak_rss():
+    """ return the peak resident memory of the process in bytes, or None where it is not available """
+
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # kilobytes on linux
+
+
+def write_prometheus(record, folder):
+    """ write the metrics of a run in the Prometheus text format, one file per pipeline, for the node_exporter
+    textfile collector. The file is written to a temp file and renamed, so the collector never reads a partial file
+
+    :param record: JSON record returned by PipelineMetrics.to_dict
+    :param folder: folder read by the textfile collector
+    """
+
+    pipeline = record['pipeline'].replace('\\', '\\\\').replace('"', '\\"')
+    lines = []
+
+    def add(metric, help_text, samples):
+        lines.append('# HELP data_pipeline_{} {}'.format(metric, help_text))
+        lines.append('# TYPE data_pipeline_{} gauge'.format(metric))
+        for labels, value in samples:
+            if value is not None:
+                labels = ','.join(['pipeline="{}"'.format(pipeline)] + ['{}="{}"'.format(*label) for label in labels])
+                lines.append('data_pipeline_{}{{{}}} {}'.format(metric, labels, value))
+
+    stages = record['stages']
+    for key, help_text in [('wall_seconds', 'wall time of the stage in seconds'),
+                           ('cpu_seconds', 'cpu time of the stage in seconds'),
+                           ('peak_rss_bytes', 'peak resident memory of the process at the end of the stage'),
+                           ('peak_traced_bytes', 'peak memory allocated by python during the stage')]:
+        add('stage_' + key, help_text, [([('stage', stage)], metrics.get(key)) for stage, metrics in stages.items()])
+
+    for key, help_text in [('downloaded_bytes', 'bytes of downloaded data'),
+                           ('rows', 'rows of the cleaned data'),
+                           ('columns', 'columns of the cleaned data'),
+                           ('exported_bytes', 'bytes of the exported files')]:
+        add(key, help_text, [((), record.get(key))])
+
+    add('last_run_timestamp_seconds', 'time the last run completed', [((), record['timestamp'])])
+    add('last_run_rebuilt', '1 if the last run exported the data, 0 if it was skipped',
+        [((), int(record['outcome'] == 'rebuilt'))])
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'data_pipeline_{}.prom'.format(_file_name(record['pipeline'])))
+    temp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+    with open(temp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
+
+
+class SamplingProfiler:
+    """ samples the stack of a thread at a fixed interval from a background thread, with little overhead on the
+    profiled thread. The samples are written as folded stacks, which can be rendered by flamegraph tools (e.g.
+    flamegraph.pl or speedscope)
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        """
+        :param interval: seconds between samples
+        :param thread_id: identifier of the thread to profile, defaults to the thread that calls start
+        """
+
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        """ return the samples as folded stacks, one 'frame;frame;frame count' line per distinct stack """
+
+        return '\n'.join('{} {}'.format(stack, count) for stack, count in self.samples.most_common())
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.folded() + '\n')
+
+
+@contextmanager
+def sampling_profiler(folder, name, stage, interval=0.005):
+    """ profile a stage with a SamplingProfiler and write the folded stacks to <folder>/<name>.<stage>.folded
+
+    :param folder: folder to write the folded stacks to
+    :param name: name of the pipeline
+    :param stage: name of the stage
+    :param interval: seconds between samples
+    """
+
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, '{}.{}.folded'.format(_file_name(name), stage))
+        profiler.write(path)
+        logger.info('wrote {} samples of {} to {}'.format(sum(profiler.samples.values()), stage, path))
+
+
+def _file_name(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('_')
@@ -5,16 +5,103 @@ import logging
 import configparser
 
 logger = logging.getLogger(__name__)
-config = configparser.ConfigParser()
-config.read('config.ini')
+
+
+class LazyConfig:
+    """ the settings in config.ini, read the first time a setting is used rather than when the package is imported
+
+    config.ini is found at the path in the DATA_PIPELINE_CONFIG environment variable, otherwise in the current working
+    directory, otherwise next to the data_pipeline package. Supports the same lookups as configparser.ConfigParser
+    (e.g. config['HTTP'].getint('retries') and config.has_section('HTTP'))
+    """
+
+    def __init__(self):
+        self._parser = None
+        self._path = None
+
+    def load(self, path=None):
+        """ read config.ini, replacing any settings already loaded
+
+        :param path: path of the config file, defaults to the path described above
+        :return: configparser.ConfigParser
+        """
+
+        parser = configparser.ConfigParser()
+        self._path = path or self.default_path()
+        if not parser.read(self._path):
+            logger.warning('config file {} was not found, using default settings'.format(self._path))
+        self._parser = parser
+        return parser
+
+    @property
+    def path(self):
+        self._get_parser()
+        return self._path
+
+    @staticmethod
+    def default_path():
+        if os.environ.get('DATA_PIPELINE_CONFIG'):
+            return os.environ['DATA_PIPELINE_CONFIG']
+        if os.path.exists('config.ini'):
+            return 'config.ini'
+        package_folder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return os.path.join(package_folder, 'config.ini')
+
+    def _get_parser(self):
+        if self._parser is None:
+            self.load()
+        return self._parser
+
+    def __getattr__(self, name):
+        return getattr(self._get_parser(), name)
+
+    def __getitem__(self, section):
+        return self._get_parser()[section]
+
+    def __setitem__(self, section, values):
+        self._get_parser()[section] = values
+
+    def __contains__(self, section):
+        return section in self._get_parser()
+
+    def __iter__(self):
+        return iter(self._get_parser())
+
+
+config = LazyConfig()
+
+
+class ConfigSetting:
+    """ class attribute read from config.ini when it is first used. Assigning to the attribute on the class (e.g.
+    SourceMetadata.users_local_raw_data_folder = path) replaces the setting """
+
+    def __init__(self, section, option, fallback=None, value_type=str):
+        """
+        :param section: section in config.ini
+        :param option: option in the section
+        :param fallback: value used when the option is not set
+        :param value_type: str, int, float, or bool
+        """
+
+        self.section = section
+        self.option = option
+        self.fallback = fallback
+        self.value_type = value_type
+
+    def __get__(self, instance, owner):
+        if not config.has_section(self.section):
+            return self.fallback
+        getters = {int: config.getint, float: config.getfloat, bool: config.getboolean, str: config.get}
+        return getters[self.value_type](self.section, self.option, fallback=self.fallback)
 
 
 class SourceMetadata:
     """ stores metadata about a data source. Includes information on how to download data (i.e. data format and
     source location) and where to export data (i.e. location of local folder on users computer) """
 
-    users_local_raw_data_folder = config['USER']['DataExportFolder']
-    local = use_local_files = config['SOURCEMETADATA']['use_local_files']
+    users_local_raw_data_folder = ConfigSetting('USER', 'DataExportFolder')
+    use_local_files = ConfigSetting('SOURCEMETADATA', 'use_local_files', fallback=False, value_type=bool)
+    default_chunksize = ConfigSetting('SOURCEMETADATA', 'default_chunksize', fallback=100000, value_type=int)
 
     def __init__(self, sources_metadata, data_category, local=False):
         """
@@ -27,6 +114,18 @@ class SourceMetadata:
         self._source_path = sources_metadata['source_path']
         self._data_categories = sources_metadata['data_categories']
         self.download_type = sources_metadata['data_categories'][data_category]['download_type']
+        self.stream = sources_metadata['data_categories'][data_category].get('stream', False)
+        self.chunksize = sources_metadata['data_categories'][data_category].get('chunksize', self.default_chunksize)
+        self.large_file = sources_metadata['data_categories'][data_category].get('large_file', False)
+        self.remote_zip = sources_metadata['data_categories'][data_category].get('remote_zip', False)
+        self.parallel_parse = sources_metadata['data_categories'][data_category].get('parallel_parse', False)
+        self.csv_engine = sources_metadata['data_categories'][data_category].get('csv_engine', 'c')
+        self.zip_members = sources_metadata['data_categories'][data_category].get('zip_members')
+        self.ftp_files = sources_metadata['data_categories'][data_category].get('ftp_files')
+        self.use_cache = sources_metadata['data_categories'][data_category].get('cache', True)
+        self.use_checkpoints = sources_metadata['data_categories'][data_category].get('checkpoint', True)
+        self.downcast = sources_metadata['data_categories'][data_category].get('downcast', False)
+        self.schema = sources_metadata.get('schema', {}).get(data_category)
         self.source_name = sources_metadata['source_name']
         self.full_name = sources_metadata['full_name']
         self.website = sources_metadata['website']
@@ -35,6 +134,9 @@ class SourceMetadata:
         self.output_path = os.path.join(self.users_local_raw_data_folder, sources_metadata['output_path'][data_category])
         self.downloaded_data = None
         self.dataframe = None
+        self.fingerprint = None
+        self.metrics = None
+        self.checkpoints = None
         self.sources_metadata = sources_metadata
 
     def __repr__(self):
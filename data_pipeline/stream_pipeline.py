@@ -0,0 +1,174 @@
+""" streaming cleaning functions, which receive and yield dataframe chunks instead of a whole dataframe
+
+A streaming cleaning function is marked with the streaming decorator, and is called with the source metadata and an
+iterator of raw dataframe chunks (of the data category's chunksize). It returns, or yields, the cleaned chunks:
+
+    @streaming
+    def clean(source_metadata, chunks):
+        for chunk in chunks:
+            yield chunk[chunk['amount'] > 0]
+
+DataPipeline runs the parsing, the cleaning function, and the export in their own threads, connected by bounded queues,
+so the stages overlap and only a few chunks are held in memory at a time. Cleaning functions that are not marked keep
+receiving the whole dataframe.
+"""
+
+__author__ = 'alsherman'
+
+import queue
+import logging
+import threading
+from .sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def streaming(func=None, **options):
+    """ mark a cleaning function as streaming, used as @streaming or @streaming(sep='|')
+
+    :param func: cleaning function called with the source metadata and an iterator of dataframe chunks
+    :param options: arguments to DataframeCreator used to parse the chunks (e.g. sep or names)
+    """
+
+    def decorate(func):
+        func.streaming = True
+        func.streaming_options = options
+        return func
+
+    return decorate(func) if func is not None else decorate
+
+
+def is_streaming(func):
+    return getattr(func, 'streaming', False)
+
+
+class StreamPipeline:
+    """ runs each stage of a generator pipeline in its own thread. A stage iterates its input and hands the items to
+    the next stage through a bounded queue, so a stage that gets ahead blocks until the next stage catches up
+
+    An error in a stage is raised in the stage that consumes it. Closing the pipeline, e.g. when the last stage fails,
+    stops every stage.
+
+        with StreamPipeline() as pipeline:
+            chunks = pipeline.stage('parse', creator.iter_dataframes())
+            cleaned = pipeline.stage('transform', clean(source_metadata, chunks))
+            for chunk in cleaned:
+                ...
+    """
+
+    def __init__(self, queue_size=4):
+        """
+        :param queue_size: maximum items waiting between two stages
+        """
+
+        self.queue_size = queue_size
+        self._stages = []
+
+    @classmethod
+    def from_config(cls):
+        """ return a pipeline with the settings in the STREAMING section of config.ini """
+
+        if not config.has_section('STREAMING'):
+            return cls()
+        return cls(queue_size=config['STREAMING'].getint('queue_size', fallback=4))
+
+    def stage(self, name, iterable):
+        """ start iterating an iterable in a new thread
+
+        :param name: name of the stage, used to name the thread
+        :param iterable: items of the stage, typically a generator over the previous stage
+        :return: iterator over the items, as they are produced
+        """
+
+        stage = _Stage(name, iterable, self.queue_size)
+        self._stages.append(stage)
+        stage.start()
+        return stage
+
+    def close(self):
+        """ stop every stage and wait for their threads to finish """
+
+        for stage in self._stages:
+            stage.stop()
+        for stage in self._stages:
+            stage.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_item, _done, _error = range(3)
+
+
+class _Stage:
+    """ iterator over the items that a thread produces from an iterable """
+
+    def __init__(self, name, iterable, queue_size):
+        self.name = name
+        self._iterable = iterable
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._produce, name='stream-{}'.format(name), daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self):
+        self._thread.join()
+
+    def _produce(self):
+        try:
+            for item in self._iterable:
+                if not self._put((_item, item)):
+                    return
+        except Exception as e:
+            logger.debug('stream stage {} failed: {!r}'.format(self.name, e))
+            self._put((_error, e))
+        else:
+            self._put((_done, None))
+        finally:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()  # run the cleanup of generators that were stopped early
+
+    def _put(self, message):
+        """ wait for room in the queue, or until the stage is stopped
+
+        :return: False if the stage was stopped
+        """
+
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._finished:
+            try:
+                kind, value = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    break
+                continue
+
+            if kind == _item:
+                return value
+            self._finished = True
+            if kind == _error:
+                raise value
+
+        raise StopIteration
@@ -1,8 +1,18 @@
 __author__ = 'alsherman'
 
-import pandas as pd
-import csv
+import io
+import os
+import copy
 import logging
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .schema import apply_schema, optimize, parser_dtypes
+from .parallel_csv_parser import ParallelCsvParser
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 
 logger = logging.getLogger(__name__)
@@ -11,7 +21,8 @@ logger = logging.getLogger(__name__)
 class DataframeCreator:
     """ Restructures and converts data from many formats (txt, zip, url, ...) into a pandas dataframe """
 
-    def __init__(self, source_metadata, sep=',', txt_helper=None, columns=None, header=0, names=None):
+    def __init__(self, source_metadata, sep=',', txt_helper=None, columns=None, header=0, names=None, chunksize=None,
+                 encoding='utf-8'):
         """
         :param source_metadata: contains metadata about data source
         :param sep: raw data separator
@@ -19,12 +30,26 @@ class DataframeCreator:
         :param columns: dataframe columns
         :param header: default 0 means that the first row of the file is the headers
         :param names: column headers, passed in manually
+        :param chunksize: number of rows per dataframe chunk when the downloaded data is streamed, defaults to the
+               chunksize in the source metadata
+        :param encoding: encoding of the downloaded data
         """
 
         self.local = source_metadata.local
         self.raw_data_path = source_metadata.raw_data_path
         self.download_type = source_metadata.download_type
         self.downloaded_data = source_metadata.downloaded_data
+        self.stream = source_metadata.stream
+        self.parallel_parse = source_metadata.parallel_parse
+        self.csv_engine = source_metadata.csv_engine
+        self.chunksize = chunksize or source_metadata.chunksize
+        self.encoding = encoding
+        self.schema = source_metadata.schema
+        self.schemas = source_metadata.sources_metadata.get('schema', {})
+        self.downcast = source_metadata.downcast
+        self.data_category = source_metadata.data_category
+        self.fingerprint = source_metadata.fingerprint
+        self.checkpoints = source_metadata.checkpoints
         self.columns = columns
         self.header = header
         self.names = names
@@ -34,46 +59,232 @@ class DataframeCreator:
     def create_dataframe(self):
         """ create a dataframe from a local or external source
 
-        :returns: raw data dataframe
+        types set in the source's schema are applied while parsing and, when the data category sets 'downcast', the
+        remaining columns are downcast to reduce memory. Local files of data categories that set 'parallel_parse' are
+        parsed across processes by ParallelCsvParser. Data categories that set 'csv_engine': 'pyarrow' parse
+        downloaded data that is held in memory with the pyarrow csv parser, which is faster but infers some types
+        differently (e.g. it parses dates, which the C parser keeps as strings), so set a schema for columns whose
+        types must not change
+
+        :returns: raw data dataframe, or a dict of file name to dataframe when several files are downloaded from a zip
+                  or an ftp directory (see zip_members and ftp_files in DownloadData), parsed concurrently
         """
 
+        version = self._checkpoint_version()
+        if version is not None:
+            df = self.checkpoints.load('parsed', version)
+            if df is not None:
+                return df
+
+        df = self._create_dataframe()
+        if version is not None:
+            self.checkpoints.save('parsed', df, version)
+        return df
+
+    def _checkpoint_version(self):
+        """ the parsed dataframe is checkpointed when checkpoints are enabled (see CheckpointStore), and resumed if the
+        downloaded data, metadata and parsing arguments are unchanged
+
+        :return: version of the parsed checkpoint, or None if it is not checkpointed
+        """
+
+        if self.checkpoints is None or self.fingerprint is None or self.txt_helper is not None:
+            return None
+        return {'data': self.fingerprint['data'],
+                'metadata': self.fingerprint['metadata'],
+                'arguments': repr((self.sep, self.header, self.names, self.columns, self.encoding))}
+
+    def _create_dataframe(self):
+        if isinstance(self.downloaded_data, dict):
+            return self._create_dataframes()
+
         if self.txt_helper:
-            return pd.DataFrame(self.txt_helper, columns=self.columns)
+            df = pd.DataFrame(self.txt_helper, columns=self.columns)
+        elif self.local and self.parallel_parse:
+            # the ranges are typed like a single read (see ParallelCsvParser), datetimes are converted by optimize
+            df = ParallelCsvParser.from_config(self.raw_data_path).read_csv(
+                sep=self.sep, header=self.header, names=self.names, dtype=parser_dtypes(self.schema) or None,
+                encoding=self.encoding)
         elif self.local:
-            temp_df = pd.read_csv(self.raw_data_path, sep=self.sep, header=self.header, names=self.names)
-            return temp_df
-        elif self.download_type == 'url':
-            df = pd.DataFrame(self.yield_urllib2_helper())
-        elif self.download_type == 'ftp':
-            df = pd.DataFrame(self.yield_ftp_helper())
+            df = pd.read_csv(self.raw_data_path, sep=self.sep, header=self.header, names=self.names,
+                             dtype=parser_dtypes(self.schema) or None, encoding=self.encoding)
         else:
-            df = pd.DataFrame([row for row in csv.reader(self.yield_zip_helper(), delimiter=self.sep)])
+            # a streamed download is a lazy buffer, read in one pass so the types are inferred from all of its rows
+            buffer = self.buffer_helper()
+            df = self._read_csv(buffer, engine=self._engine(buffer))
 
-        if self.names:
-            df.columns = self.names
-        else:
-            logger.info("Current Dataframe headers - {} ".format(df.columns))
-            logger.info("New Dataframe headers {}".format(df.values[0]))
-            df.columns = df.values[0]
-            df.drop(0, inplace=True)
+        return optimize(df, schema=self.schema, downcast_columns=self.downcast, name=self.data_category)
 
-        return df
+    def _create_dataframes(self):
+        """ create a dataframe from each downloaded file. The schema of each file is set in the sources_metadata by its
+        file name, falling back to the schema of the data category
+
+        :returns: dict of file name to raw data dataframe
+        """
+
+        def create(name, data):
+            creator = copy.copy(self)
+            creator.downloaded_data = data
+            creator.data_category = name
+            creator.schema = self.schemas.get(name, self.schema)
+            return creator._create_dataframe()
+
+        members = list(self.downloaded_data.items())
+        with ThreadPoolExecutor(max_workers=min(len(members), os.cpu_count() or 1)) as pool:
+            dataframes = pool.map(lambda member: create(*member), members)
+            return dict(zip([name for name, _ in members], dataframes))
+
+    def iter_dataframes(self):
+        """ lazily convert streamed rows, or a local file, into dataframes of at most chunksize rows, so only one chunk
+        of raw rows is held in memory at a time
+
+        Each chunk is parsed on its own, so the types of the columns that are not in the schema are those inferred from
+        the first chunk, and later chunks are converted to them (see _conform). A column that is numeric in the first
+        chunk and has text in a later chunk raises ValueError, set its type in the schema
+
+        :returns: generator of raw data dataframes
+        """
+
+        chunks = self._read_csv(self.raw_data_path if self.local else self.buffer_helper(), chunksize=self.chunksize)
+        if isinstance(chunks, pd.DataFrame):
+            yield chunks  # no data, always yield at least one, empty, dataframe
+            return
+
+        dtypes = None
+        with chunks:
+            for chunk in chunks:
+                chunk = apply_schema(chunk, self.schema)
+                if dtypes is None:
+                    dtypes = chunk.dtypes
+                else:
+                    chunk = self._conform(chunk, dtypes)
+                yield chunk
+
+    def _conform(self, chunk, dtypes):
+        """ convert the columns of a chunk to the types of the first chunk
+
+        text columns keep the text of values that were parsed as numbers, and integer columns become floats only if
+        a later chunk has missing values
+
+        :param chunk: dataframe chunk
+        :param dtypes: dtypes of the first chunk
+        """
+
+        for column, dtype in dtypes.items():
+            series = chunk[column]
+            if series.dtype == dtype:
+                continue
+
+            if _is_text(dtype):
+                chunk[column] = series.astype(object).where(series.isna(), series.astype(str)).astype(dtype)
+            elif _is_text(series.dtype) and series.notna().any():
+                raise ValueError('{} of {} was parsed as {} from the first chunk, but a later chunk has text values, '
+                                 'set its type in the schema'.format(column, self.raw_data_path, dtype))
+            else:
+                try:
+                    chunk[column] = series.astype(dtype)
+                except (TypeError, ValueError):  # e.g. missing values in an integer column
+                    logger.info('{} of {} has missing values after the first chunk, parsed as {}'.format(
+                        column, self.raw_data_path, series.dtype))
+        return chunk
+
+    def _read_csv(self, buffer, **kwargs):
+        """ parse downloaded data, or a local file, with pandas' native csv parser
+
+        the headers are in the row set by header. When names are passed in for downloaded data, every row is data
+
+        :param buffer: file-like object of the downloaded data
+        :param kwargs: additional arguments to pd.read_csv (e.g. chunksize)
+        :returns: raw data dataframe, or an iterator of dataframes when a chunksize is passed in
+        """
+
+        header = None if self.names and not self.local else self.header
+        try:
+            return pd.read_csv(buffer, sep=self.sep, header=header, names=self.names, encoding=self.encoding,
+                               dtype=parser_dtypes(self.schema) or None, **kwargs)
+        except pd.errors.EmptyDataError:
+            logger.info('no data downloaded from {}'.format(self.raw_data_path))
+            return pd.DataFrame(columns=self.names)
+
+    def _engine(self, buffer):
+        """ use the pyarrow csv parser for data that is already in memory when the data category sets 'csv_engine':
+        'pyarrow', otherwise the C parser, so the inferred types never depend on the installed packages
+
+        :param buffer: file-like object returned by buffer_helper
+        """
+
+        if self.csv_engine != 'pyarrow':
+            return 'c'
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to parse {} with the pyarrow csv engine, install it with: '
+                              'pip install pyarrow'.format(self.data_category))
+
+        in_memory = isinstance(buffer, io.BytesIO) and buffer.getbuffer().nbytes > 0
+        if in_memory and len(self.sep) == 1:
+            return 'pyarrow'
+        return 'c'
+
+    def buffer_helper(self):
+        """ wrap the downloaded data in a file-like object without splitting it into rows
+
+        :returns: file-like object; text from a url is wrapped as is, lists of rows (e.g. from a zip) are joined, and
+                  lazy iterators (e.g. from ftp or a stream) are read as they are consumed
+        """
+
+        data = self.downloaded_data
+        if isinstance(data, str):
+            return io.BytesIO(data.encode(self.encoding))
+        elif isinstance(data, bytes):
+            return io.BytesIO(data)
+        elif isinstance(data, (list, tuple)):
+            return io.BytesIO(b''.join(IterStream.to_bytes(row, self.encoding) for row in data))
+        return io.BufferedReader(IterStream(data, self.encoding), buffer_size=1024 * 1024)
+
+
+def _is_text(dtype):
+    return pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+
+
+class IterStream(io.RawIOBase):
+    """ read-only file-like object over an iterator of bytes or str chunks (e.g. lines), used to pass streamed
+    downloads to pandas without first joining them in memory """
+
+    def __init__(self, iterable, encoding='utf-8'):
+        """
+        :param iterable: iterator of bytes or str chunks
+        :param encoding: used to encode str chunks
+        """
+
+        self._iterator = iter(iterable)
+        self._leftover = b''
+        self.encoding = encoding
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """ fill the buffer with as many chunks as fit, keeping the remainder of the last chunk for the next read """
+
+        view = memoryview(buffer).cast('B')
+        position = 0
+
+        while position < len(view):
+            if not self._leftover:
+                chunk = next(self._iterator, None)
+                if chunk is None:
+                    break
+                self._leftover = memoryview(self.to_bytes(chunk, self.encoding))
+
+            size = min(len(view) - position, len(self._leftover))
+            view[position:position + size] = self._leftover[:size]
+            self._leftover = self._leftover[size:]
+            position += size
+
+        return position
 
-    def yield_zip_helper(self):
-        for row in self.downloaded_data:
-            yield row
-
-    def yield_urllib2_helper(self):
-        raw_data = []
-        for row in self.downloaded_data.split('\n'): # separate each column to convert into DataFrame
-            raw_data.append(row.split(self.sep))
-        return raw_data
-
-    def yield_ftp_helper(self):
-        raw_data = []
-        for row in self.downloaded_data:  # separate each column to convert into DataFrame
-            raw_data.append(row.split(self.sep))
-        return raw_data
+    @staticmethod
+    def to_bytes(chunk, encoding):
+        return chunk.encode(encoding) if isinstance(chunk, str) else chunk
 
 
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+__author__ = 'alsherman'
+
+import io
+import os
+import mmap
+import logging
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from ..sources_metadata.source_metadata import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParallelCsvParser:
+    """ Parses a local csv file across a pool of processes.
+
+    The file is memory mapped and split at line boundaries into byte ranges of at most chunk_size bytes. Each range is
+    parsed by pd.read_csv in a worker process, and the dataframes are concatenated in the order of the ranges, so the
+    rows and index are the same as parsing the file in a single process.
+
+    The file is split on newlines, so rows must not contain quoted line breaks, and the encoding must encode a newline
+    as a single b'\\n' byte (e.g. utf-8 or latin-1, not utf-16). Without a dtype, each range infers its own types. When
+    a column is text in some ranges and numeric or boolean in others (e.g. codes that are only numeric in the first
+    rows), the ranges are parsed again with the column as str, as a single process read would type it. Numeric types
+    are combined by the concatenation (e.g. int64 and float64 to float64).
+    """
+
+    def __init__(self, path, workers=None, chunk_size=64 * 1024 * 1024, min_file_size=16 * 1024 * 1024):
+        """
+        :param path: path of the local csv file
+        :param workers: number of worker processes, defaults to the number of cpus
+        :param chunk_size: maximum bytes parsed by a worker at a time
+        :param min_file_size: files smaller than this are parsed in a single process, where starting the workers
+               costs more than it saves
+        """
+
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_file_size = min_file_size
+
+    @classmethod
+    def from_config(cls, path):
+        """ return a parser with the settings in the PARALLELPARSE section of config.ini
+
+        :param path: path of the local csv file
+        """
+
+        if not config.has_section('PARALLELPARSE'):
+            return cls(path)
+
+        settings = config['PARALLELPARSE']
+        return cls(path,
+                   workers=settings.getint('workers', fallback=None) if settings.get('workers') else None,
+                   chunk_size=settings.getint('chunk_size_mb', fallback=64) * 1024 * 1024,
+                   min_file_size=settings.getint('min_file_size_mb', fallback=16) * 1024 * 1024)
+
+    def read_csv(self, sep=',', header=0, names=None, dtype=None, encoding='utf-8'):
+        """ parse the file with the same arguments as pd.read_csv
+
+        :param sep: raw data separator
+        :param header: line number of the headers, or None when every line is data
+        :param names: column headers, passed in manually. With a header, they replace the headers in the file
+        :param dtype: dict of column name to dtype
+        :param encoding: encoding of the file
+        :return: raw data dataframe
+        """
+
+        kwargs = {'sep': sep, 'dtype': dtype, 'encoding': encoding}
+        size = os.path.getsize(self.path)
+
+        if not self._can_split(header, encoding) or size < max(self.min_file_size, 1) or self.workers < 2:
+            return pd.read_csv(self.path, header=header, names=names, **kwargs)
+
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data_start = self._data_start(mm, header)
+            columns = names
+            if header is not None and names is None:
+                columns = list(pd.read_csv(io.BytesIO(mm[:data_start]), header=header, nrows=0, **kwargs).columns)
+            ranges = self.line_ranges(mm, data_start)
+
+        if not ranges:
+            return pd.DataFrame(columns=columns)
+
+        logger.info('parsing {} in {} ranges with {} processes'.format(self.path, len(ranges), self.workers))
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(ranges))) as pool:
+            dataframes = list(pool.map(_parse_range, *zip(*[(self.path, start, end, columns, kwargs)
+                                                            for start, end in ranges])))
+
+            mixed = self._mixed_columns(dataframes)
+            if mixed:
+                logger.info('{} are text in some ranges of {}, parsing them as str'.format(mixed, self.path))
+                kwargs = dict(kwargs, dtype=dict(dtype or {}, **dict.fromkeys(mixed, str)))
+                reparse = [index for index, df in enumerate(dataframes)
+                           if not all(_is_text(df[column].dtype) for column in mixed)]
+                for index, df in zip(reparse, pool.map(_parse_range, *zip(*[(self.path, *ranges[index], columns, kwargs)
+                                                                            for index in reparse]))):
+                    dataframes[index] = df
+
+        return pd.concat(dataframes, ignore_index=True)
+
+    @staticmethod
+    def _mixed_columns(dataframes):
+        """ return the columns that are text in some ranges and have another type in others
+
+        :param dataframes: dataframe of each range
+        """
+
+        mixed = []
+        for column in dataframes[0].columns:
+            dtypes = [df[column].dtype for df in dataframes if len(df)]
+            if any(_is_text(dtype) for dtype in dtypes) and not all(_is_text(dtype) for dtype in dtypes):
+                mixed.append(column)
+        return mixed
+
+    def line_ranges(self, mm, start=0):
+        """ split the file into byte ranges that end at a line boundary
+
+        the range size is the smaller of chunk_size and an equal share of the file for each worker, so every worker is
+        used for files smaller than workers * chunk_size
+
+        :param mm: memory map of the file
+        :param start: offset of the first data line
+        :return: list of (start, end) byte offsets
+        """
+
+        size = len(mm)
+        range_size = max(1, min(self.chunk_size, -(-(size - start) // self.workers)))
+
+        ranges = []
+        while start < size:
+            end = start + range_size
+            if end < size:
+                end = mm.find(b'\n', end - 1)
+                end = size if end == -1 else end + 1
+            ranges.append((start, min(end, size)))
+            start = end
+        return ranges
+
+    @staticmethod
+    def _data_start(mm, header):
+        """ return the offset after the header lines """
+
+        if header is None:
+            return 0
+
+        position = 0
+        for _ in range(header + 1):
+            position = mm.find(b'\n', position)
+            if position == -1:
+                return len(mm)
+            position += 1
+        return position
+
+    @staticmethod
+    def _can_split(header, encoding):
+        if header is not None and not isinstance(header, int):
+            logger.info('multi-line headers are parsed in a single process')
+            return False
+        if '\n'.encode(encoding) != b'\n':
+            logger.info('{} files are parsed in a single process'.format(encoding))
+            return False
+        return True
+
+
+def _is_text(dtype):
+    return pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+
+
+def _parse_range(path, start, end, columns, kwargs):
+    """ parse a byte range of the file in a worker process, must be defined at the module level to be sent to the
+    process pool
+
+    :return: dataframe of the rows in the range
+    """
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buffer = io.BytesIO(mm[start:end])
+
+    try:
+        return pd.read_csv(buffer, header=None, names=columns, **kwargs)
+    except pd.errors.EmptyDataError:  # only blank lines in the range
+        return pd.DataFrame(columns=columns)
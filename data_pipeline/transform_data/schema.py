@@ -0,0 +1,144 @@
+""" schema-driven dtypes and memory downcasting for dataframes
+
+A schema maps column names to types, and is set per data category (or per XML table) in the sources_metadata:
+
+    'schema': {'data_category': {'id': 'int32',                                  # numpy dtypes, with widths
+                                 'count': {'type': 'int16', 'nullable': True},  # nullable Int16
+                                 'state': 'category',
+                                 'amount': 'float32',
+                                 'date': {'type': 'datetime', 'format': '%Y%m%d'}}}
+
+Columns that are not in the schema keep the type inferred by the parser.
+"""
+
+__author__ = 'alsherman'
+
+import logging
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(schema):
+    """ convert each column type in a schema to a pandas dtype, or a datetime spec
+
+    :param schema: dict of column name to a dtype string or a dict with a 'type' and optional 'nullable' or 'format'
+    :return: dict of column name to dtype string, or {'type': 'datetime', 'format': ...}
+    """
+
+    normalized = {}
+    for column, spec in (schema or {}).items():
+        if not isinstance(spec, dict):
+            spec = {'type': spec}
+
+        dtype = spec['type']
+        if dtype == 'datetime':
+            normalized[column] = {'type': 'datetime', 'format': spec.get('format')}
+            continue
+
+        if spec.get('nullable') and dtype.startswith(('int', 'uint')):
+            dtype = dtype[0].upper() + dtype[1:]  # int16 -> Int16, pandas nullable integer
+        elif spec.get('nullable') and dtype == 'bool':
+            dtype = 'boolean'
+        normalized[column] = dtype
+
+    return normalized
+
+
+def parser_dtypes(schema):
+    """ return the dtypes that can be applied while parsing (e.g. the dtype argument of pd.read_csv)
+
+    :param schema: dict of column name to type
+    :return: dict of column name to dtype, datetimes are excluded and converted by apply_schema after parsing
+    """
+
+    return {column: dtype for column, dtype in normalize(schema).items() if not isinstance(dtype, dict)}
+
+
+def apply_schema(df, schema):
+    """ convert the columns of a dataframe to the types in the schema
+
+    :param df: dataframe
+    :param schema: dict of column name to type
+    :return: dataframe with converted columns
+    """
+
+    for column, dtype in normalize(schema).items():
+        if column not in df.columns:
+            logger.info('schema column {} is not in the dataframe'.format(column))
+            continue
+
+        if isinstance(dtype, dict):
+            df[column] = pd.to_datetime(df[column], format=dtype['format'])
+        elif str(df[column].dtype) != dtype:
+            df[column] = df[column].astype(dtype)
+
+    return df
+
+
+def downcast(df, categorical_threshold=0.5, exclude=()):
+    """ reduce the memory of a dataframe: use the smallest int and float types that fit each numeric column, and
+    convert string columns with few unique values to categoricals
+
+    :param df: dataframe
+    :param categorical_threshold: convert string columns with fewer unique values than this share of the rows
+    :param exclude: columns to leave unchanged, e.g. those with types set in a schema
+    :return: dataframe with downcast columns
+    """
+
+    for column in df.columns:
+        if column in exclude:
+            continue
+
+        series = df[column]
+        if pd.api.types.is_integer_dtype(series.dtype) and not pd.api.types.is_extension_array_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='unsigned' if len(series) and series.min() >= 0 else 'integer')
+        elif pd.api.types.is_float_dtype(series.dtype) and not pd.api.types.is_extension_array_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='float')
+        elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+            if len(series) and series.nunique() < categorical_threshold * len(series):
+                df[column] = series.astype('category')
+
+    return df
+
+
+def memory_report(df):
+    """ return the memory used by a dataframe, in total and for each column
+
+    :param df: dataframe
+    :return: dict with the number of rows, total bytes, and the dtype and bytes of each column
+    """
+
+    usage = df.memory_usage(deep=True, index=False)
+    return {'rows': len(df),
+            'bytes': int(usage.sum()),
+            'columns': {column: {'dtype': str(df[column].dtype), 'bytes': int(usage[column])} for column in df.columns}}
+
+
+def optimize(df, schema=None, downcast_columns=False, name=None):
+    """ apply a schema and optionally downcast the remaining columns, logging the memory before and after
+
+    :param df: dataframe
+    :param schema: dict of column name to type
+    :param downcast_columns: downcast numeric columns and convert low cardinality strings not in the schema
+    :param name: name of the dataframe used in the log
+    :return: dataframe with converted columns
+    """
+
+    if not schema and not downcast_columns:
+        return df
+
+    before = memory_report(df)
+    df = apply_schema(df, schema)
+    if downcast_columns:
+        df = downcast(df, exclude=set(normalize(schema)))
+    after = memory_report(df)
+
+    logger.info('memory of {}: {:.1f} MB before, {:.1f} MB after'.format(name, before['bytes'] / 2 ** 20, after['bytes'] / 2 ** 20))
+    for column, report in after['columns'].items():
+        logger.debug('{} - {}: {} -> {}, {} bytes -> {} bytes'.format(
+            name, column, before['columns'][column]['dtype'], report['dtype'],
+            before['columns'][column]['bytes'], report['bytes']))
+
+    return df
@@ -0,0 +1,111 @@
+__author__ = 'alsherman'
+
+import io
+import os
+import logging
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .xml_parser import XmlElementParser
+from .xml_stream_parser import XmlStreamParser
+
+
+logger = logging.getLogger(__name__)
+
+
+class ParallelXmlParser:
+    """ Parses the items of an XML document across a pool of processes.
+
+    The items are read with iterparse and split into shards of shard_size items. Each shard is parsed in a worker
+    process with the same data_list specs as XmlElementParser, and the rows from each shard are merged into
+    XmlElementParser.all_data in the order the items appear in the document, so the result is identical to parsing the
+    document in a single process. Afterwards, call XmlElementParser.create_dataframes as usual.
+
+    Lists cannot be shared between processes, so the third value of each data_list spec is the name of the table in
+    XmlElementParser.all_data rather than the list itself:
+
+        data_list = [(['name', ('record', 'id')], None, 'records'),
+                     (['tag'], 'tags', 'tags')]
+    """
+
+    def __init__(self, source, item_name, workers=None, shard_size=1000, explode=False):
+        """
+        :param source: path or binary file-like object of the XML document
+        :param item_name: name of the repeated XML element to pass to the parser, one item at a time
+        :param workers: number of worker processes, defaults to the number of cpus
+        :param shard_size: number of items parsed by a worker at a time
+        :param explode: add every combination of one to many children as its own row, see XmlElementParser.compile
+        """
+
+        self.source = source
+        self.item_name = item_name
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.explode = explode
+
+    def extract_data(self, data_list, row_start=None):
+        """ parse every item and append the rows to the tables in XmlElementParser.all_data
+
+        :param data_list: list of (children_names, parent_names, table name)
+        :param row_start: list prepended to every row, or a function called with each item that returns the list. The
+               function is sent to the worker processes, so it must be defined at the module level (not a lambda)
+        """
+
+        for _, _, table_name in data_list:
+            if not isinstance(table_name, str):
+                raise TypeError('parallel parsing requires table names in the data list, not lists: {}'.format(table_name))
+            XmlElementParser.all_data.setdefault(table_name, [])
+
+        shards = self._iter_shards()
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # keep a bounded number of shards in flight, so the document is never fully held in memory
+            for shard in shards:
+                pending.append(pool.submit(_parse_shard, shard, self.item_name, data_list, row_start, self.explode))
+                if len(pending) >= self.workers * 2:
+                    self._merge(pending.popleft().result())
+
+            while pending:
+                self._merge(pending.popleft().result())
+
+    def _iter_shards(self):
+        """ yield serialized documents of at most shard_size items """
+
+        items = []
+        for item in XmlStreamParser(self.source, self.item_name).iter_items():
+            items.append(ET.tostring(item.elem))
+            if len(items) == self.shard_size:
+                yield _to_document(items)
+                items = []
+
+        if items:
+            yield _to_document(items)
+
+    @staticmethod
+    def _merge(tables):
+        """ append the rows parsed from a shard to XmlElementParser.all_data
+
+        :param tables: dict of table name to the rows parsed from a shard
+        """
+
+        for table_name, rows in tables.items():
+            XmlElementParser.all_data[table_name].extend(rows)
+
+
+def _to_document(items):
+    return b'<shard>' + b''.join(items) + b'</shard>'
+
+
+def _parse_shard(shard, item_name, data_list, row_start, explode):
+    """ parse a shard in a worker process, must be defined at the module level to be sent to the process pool
+
+    :return: dict of table name to the parsed rows
+    """
+
+    tables = {table_name: [] for _, _, table_name in data_list}
+    plans = XmlElementParser.compile([(children_names, parent_names, tables[table_name])
+                                      for children_names, parent_names, table_name in data_list], explode=explode)
+
+    XmlStreamParser(io.BytesIO(shard), item_name).extract_data(plans, row_start=row_start)
+    return tables
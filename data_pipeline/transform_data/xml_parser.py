@@ -3,6 +3,7 @@ __author__ = 'alsherman'
 import logging
 from itertools import product
 import pandas as pd
+from .schema import optimize
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +33,7 @@ class XmlElementParser:
     """
 
     all_data = {}
+    _compiled = (None, None)
 
     def __init__(self, item):
         """
@@ -42,21 +44,51 @@ class XmlElementParser:
     def extract_data(self, data_list, row_start=None):
         """
         :param data_list: class dict that stores all lists to append extracted rows. Lists are converted to dataframes
-               in the create dataframes method
+               in the create dataframes method. May also be the extraction plans returned by XmlElementParser.compile
         :param row_start - used if additional items should be prepended to the start of the row (e.g. unique id or name)
                that does not exist in the xml item passed to the parser
         """
+
+        for plan in self._get_plans(data_list):
+            self.run_plan(plan, row_start=row_start)
+
+    @classmethod
+    def compile(cls, data_list, explode=False):
+        """ compile the data_list specs into extraction plans, so the specs are interpreted once rather than for
+        every XML item
+
+        :param data_list: list of (children_names, parent_names, class_list)
+        :param explode: add every combination (cartesian product) of one to many children as its own row, by default
+               only the first combination is added
+        :return: list of ExtractionPlans, which can be passed to extract_data in place of the data_list
+        """
+
         if len(data_list[0]) != 3:
             logger.error('data list is missing or has excess children_names, parent_names, or class_list: {}'.format(data_list[0]))
             raise ValueError('data list is missing or has excess children_names, parent_names, or a class_list')
 
-        for children_names, parent_names, class_list in data_list:
-            logger.debug('row_start_items: {} | parent: {}'.format(row_start, parent_names))
+        return [ExtractionPlan(children_names, parent_names, class_list, explode=explode)
+                for children_names, parent_names, class_list in data_list]
+
+    @classmethod
+    def _get_plans(cls, data_list):
+        """ return the compiled plans for a data_list, compiling it on first use
+
+        Note: the plans for the most recent data_list are cached by identity, create a new data_list rather than
+        changing one in place. Parsers of other data_lists may replace the cache from other threads at any time, so it
+        is read once and the plans compiled here are returned rather than read back from the cache
+        """
+
+        if data_list and isinstance(data_list[0], ExtractionPlan):
+            return data_list
+
+        cached_list, cached_plans = XmlElementParser._compiled
+        if cached_list is data_list:
+            return cached_plans
 
-            self.get_nested(children_names=children_names,
-                            parent_names=parent_names,
-                            class_list=class_list,
-                            row_start=row_start)
+        compiled = cls.compile(data_list)
+        XmlElementParser._compiled = (data_list, compiled)
+        return compiled
 
     def get_nested(self, children_names, parent_names, class_list, row_start=None):
         """ Search in parent_names to determine the level of nesting. Collect each element in children_names and
@@ -73,107 +105,88 @@ class XmlElementParser:
         important for one to many mappings to get all possible pairings, does nothing special for one to one mappings
         """
 
+        self.run_plan(ExtractionPlan(children_names, parent_names, class_list), row_start=row_start)
+
+    def run_plan(self, plan, row_start=None):
+        """ extract the rows described by a compiled plan from the xml item
+
+        :param plan: ExtractionPlan
+        :param row_start - used if additional items should be prepended to the start of the row (e.g. unique id or name)
+                           that does not exist in the xml item passed to the parser
+        """
+
         # check if the row should include values not included in the xml item passed to the parser
         if row_start is None:
             row = []
         else:
             row = row_start
 
-        # determine the nested structure of xml and filter to the level of the child element of interest
-        if isinstance(parent_names, list):
-            if len(parent_names) < 2:
-                logger.info('persistent parent should only be a list if there are at least two parents: {}'.format(parent_names))
-                raise TypeError('persistent parent should only be a list if there are at least two parents')
-
-            grandparents = parent_names[0:-1]
-            parent = parent_names[-1]
-
-            # if parent names is a list, then there should always be at least one grandparent
-            first_grandparent = grandparents[0]
-            grandparent = self.item.find(first_grandparent)
-            # if multiple grandparents, traverse to the last parent, containing the children elements of interest
-            if len(grandparents) >= 2:
-                other_grandparents = grandparents[1:]
-                for next_grandparent in other_grandparents:
-                    grandparent = grandparent.find(next_grandparent)
-
-            parent_xml = grandparent.find_all(parent)
-        elif parent_names is None:
+        # filter to the level of the child element of interest
+        if plan.grandparents:
+            grandparent = self.item
+            for next_grandparent in plan.grandparents:
+                grandparent = grandparent.find(next_grandparent)
+            parent_xml = grandparent.find_all(plan.parent)
+        elif plan.parent is None:
             # used when parent category == self.item
-            # (no need to get nested elements as persistent parent is the top level of the hierarchy)
-            parent_xml = self.item
+            parent_xml = [self.item]
         else:
-            # means that there is only one persistent parent
             # every element shares a parent: <parent><item1></item1><item2></item2></parent>
-            parent_xml = self.item.find(parent_names)
+            parent_xml = self.item.find(plan.parent)
+            if parent_xml is not None:
+                parent_xml = [parent_xml]
 
         # ignore categories that do not exist in the raw data
         if parent_xml is None:
-            logger.info('parent: {} is None for row: {}'.format(parent_names, row))
+            logger.info('parent: {} is None for row: {}'.format(plan.parent_names, row))
             return
 
-        # if only one parent or one category, cast the string to a list to avoid iterating over characters of a string
-        if not isinstance(children_names, list):
-            children_names = [children_names]
-        if not isinstance(parent_xml, list):
-            parent_xml = [parent_xml]
-
-        # create a list of lists, then get the cartesian product. This is important for one to many mappings
-        # to get all possible pairings; does nothing special for one to one mappings
         for selected_xml in parent_xml:
 
             children_list = []
-            for xml_elem in children_names:
+            for element, attribute in plan.children:
 
-                searching_for_attribute = isinstance(xml_elem, tuple)
-                if searching_for_attribute:
-                    element = xml_elem[0]
-                    attribute = xml_elem[1]
-
-                    if parent_names is None:
+                if attribute is not None:
+                    if plan.parent is None:
                         # searching for attribute on highest level of xml elements - no need to find inner elements
-                        result = self.item[attribute]
+                        children_list.append((self.item[attribute],))
                     else:
-                        result = selected_xml.find(element)[attribute]
-
-                    # turn into a list as I extract the first list element for other child_list during cartesian product
-                    children_list.append([result])
+                        children_list.append((selected_xml.find(element)[attribute],))
                     continue
 
-                # search for an element (not an attribute)
-                children = selected_xml.find_all(xml_elem)
+                # search for an element (not an attribute). Only the first match is needed unless exploding rows
+                if plan.explode:
+                    children = [child.text for child in selected_xml.find_all(element)]
+                else:
+                    child = selected_xml.find(element)
+                    children = (child.text,) if child is not None else ()
+
                 if len(children) == 0:
                     logger.info('parent and child xml elements share name (e.g. <a><a><instance></a></a>),'
-                                ' skipping value: {}'.format(xml_elem))
+                                ' skipping value: {}'.format(element))
                     continue
-
-                child_list = []
-                for child in children:
-                    # if there are more than one of the child xml element
-                    try:
-                        result = child.text
-                    except TypeError('Child is None in XML parser') as e:
-                        logger.info(e)
-                        result = ''
-
-                    child_list.append(result)
-                children_list.append(child_list)
+                children_list.append(children)
 
             # happens if child and parent share name (e.g. <a><a><instance></a></a>)
             if len(children_list) == 0:
                 logger.info('child and parent share name, skipping row')
                 continue
 
-            # get all combinations (cartesian product) of elements in children list
-            # convert tuple in list to a list itself and add row ids, if exist
-            complete_row = row[:] + list(list(product(*children_list))[0])
-            class_list.append(complete_row)
+            if plan.explode:
+                # add every combination (cartesian product) of elements in the children list as its own row
+                for combination in product(*children_list):
+                    plan.class_list.append(row + list(combination))
+            else:
+                # the first combination of the cartesian product is the first value of each child
+                plan.class_list.append(row + [values[0] for values in children_list])
 
     @classmethod
-    def create_dataframes(cls, sources_metadata):
+    def create_dataframes(cls, sources_metadata, downcast=False):
         """ converts every list in all_data dict (a dict of lists for each row of parsed xml) into dataframes
 
-        :param sources_metadata: contains column headers used to create the dataframe
+        :param sources_metadata: contains column headers used to create the dataframe, and optionally a schema of
+               column types for each table
+        :param downcast: downcast numeric columns and convert low cardinality strings that are not in the schema
         """
 
         for name, data_list in cls.all_data.items():
@@ -183,6 +196,106 @@ class XmlElementParser:
             if len(data_list) == 0:
                 # if there is no data, replace the list with the files headers
                 cls.all_data[name] = sources_metadata['headers'][name]
+            elif isinstance(data_list, ColumnarBuffer):
+                cls.all_data[name] = data_list.to_dataframe(columns=sources_metadata['headers'][name])
             else:
                 # convert the list into a dataframe to export from CsvCreator
                 cls.all_data[name] = pd.DataFrame(data_list, columns=sources_metadata['headers'][name])
+
+            if isinstance(cls.all_data[name], pd.DataFrame):
+                cls.all_data[name] = optimize(cls.all_data[name],
+                                              schema=sources_metadata.get('schema', {}).get(name),
+                                              downcast_columns=downcast,
+                                              name=name)
+
+
+class ExtractionPlan:
+    """ a single data_list spec (children_names, parent_names, class_list), validated and normalized once """
+
+    __slots__ = ('parent_names', 'grandparents', 'parent', 'children', 'class_list', 'explode')
+
+    def __init__(self, children_names, parent_names, class_list, explode=False):
+        """
+        :param children_names: select xml elements to extract, an element name or (element name, attribute) tuple,
+               or a list of them
+        :param parent_names: Contains the XML hierarchy to search, see XmlElementParser.get_nested
+        :param class_list: list or ColumnarBuffer to append each completed row
+        :param explode: add every combination of one to many children as its own row
+        """
+
+        # determine the nested structure of xml once, rather than for every item
+        if isinstance(parent_names, list):
+            if len(parent_names) < 2:
+                logger.info('persistent parent should only be a list if there are at least two parents: {}'.format(parent_names))
+                raise TypeError('persistent parent should only be a list if there are at least two parents')
+            grandparents = tuple(parent_names[0:-1])
+            parent = parent_names[-1]
+        else:
+            grandparents = ()
+            parent = parent_names
+
+        # if only one category, cast the string to a list to avoid iterating over characters of a string
+        if not isinstance(children_names, list):
+            children_names = [children_names]
+
+        self.parent_names = parent_names
+        self.grandparents = grandparents
+        self.parent = parent
+        self.children = tuple(child if isinstance(child, tuple) else (child, None) for child in children_names)
+        self.class_list = class_list
+        self.explode = explode
+
+    def __repr__(self):
+        return "<class: extraction_plan>: {} - {}".format(self.parent_names, [child for child, _ in self.children])
+
+
+class ColumnarBuffer:
+    """ row sink that can replace the lists in XmlElementParser.all_data. Each column is stored in its own list, so
+    converting to a dataframe does not require a list of lists intermediate
+
+    e.g. XmlElementParser.all_data['records'] = ColumnarBuffer()
+    """
+
+    __slots__ = ('columns', '_length')
+
+    def __init__(self):
+        self.columns = []
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        """ iterate over rows, missing trailing values are None """
+
+        return iter(zip(*self.columns)) if self.columns else iter(())
+
+    def append(self, row):
+        """ add a row, padding with None when rows have different lengths (matching pd.DataFrame on a list of lists)
+
+        :param row: list of values
+        """
+
+        columns = self.columns
+        if len(row) > len(columns):
+            columns.extend([None] * self._length for _ in range(len(row) - len(columns)))
+        for column, value in zip(columns, row):
+            column.append(value)
+        for column in columns[len(row):]:
+            column.append(None)
+        self._length += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def to_dataframe(self, columns=None):
+        """ convert the buffer into a dataframe
+
+        :param columns: column headers
+        """
+
+        df = pd.DataFrame(dict(enumerate(self.columns)))
+        if columns is not None:
+            df.columns = columns
+        return df
@@ -0,0 +1,124 @@
+__author__ = 'alsherman'
+
+import logging
+import xml.etree.ElementTree as ET
+from .xml_parser import XmlElementParser
+
+
+logger = logging.getLogger(__name__)
+
+
+class XmlStreamParser:
+    """ Parses XML incrementally with ElementTree.iterparse, running the same data_list specs as XmlElementParser.
+
+    Only one item (the repeated XML section, e.g. <record>) is held in memory at a time: each item is passed to
+    XmlElementParser as soon as its closing tag is read and is cleared once its rows are extracted, so memory is
+    bounded by the size of a single item rather than the size of the document.
+    """
+
+    def __init__(self, source, item_name):
+        """
+        :param source: path or binary file-like object of the XML document
+        :param item_name: name of the repeated XML element to pass to the parser, one item at a time
+        """
+
+        self.source = source
+        self.item_name = item_name
+
+    def extract_data(self, data_list, row_start=None):
+        """ extract rows from every item, appending them to the class_list of each spec in the data_list
+
+        :param data_list: list of (children_names, parent_names, class_list), as used by XmlElementParser.extract_data
+        :param row_start: list prepended to every row, or a function called with each item that returns the list
+               (e.g. lambda item: [item['id']])
+        """
+
+        for item in self.iter_items():
+            start = row_start(item) if callable(row_start) else row_start
+            XmlElementParser(item).extract_data(data_list, row_start=start)
+
+    def iter_rows(self, data_list, row_start=None):
+        """ lazily yield rows as they are extracted, instead of appending them to the class_lists
+
+        :param data_list: list of (children_names, parent_names, class_list), as used by XmlElementParser.extract_data
+        :param row_start: list prepended to every row, or a function called with each item that returns the list
+        :return: generator of (index of the spec in the data_list, row)
+        """
+
+        buffers = [[] for _ in data_list]
+        buffered_data_list = [(children_names, parent_names, buffer)
+                              for (children_names, parent_names, _), buffer in zip(data_list, buffers)]
+
+        for item in self.iter_items():
+            start = row_start(item) if callable(row_start) else row_start
+            XmlElementParser(item).extract_data(buffered_data_list, row_start=start)
+
+            for index, buffer in enumerate(buffers):
+                for row in buffer:
+                    yield index, row
+                del buffer[:]
+
+    def iter_items(self):
+        """ yield each item once its closing tag is parsed, then clear it and its parsed siblings from memory
+
+        :return: generator of items that support the find, find_all, [attribute] and text lookups used by
+                 XmlElementParser
+        """
+
+        open_elements = []
+        for event, elem in ET.iterparse(self.source, events=('start', 'end')):
+            if event == 'start':
+                open_elements.append(elem)
+                continue
+
+            open_elements.pop()
+            elem.tag = _local_name(elem.tag)
+            if elem.tag == self.item_name:
+                yield StreamElement(elem)
+                elem.clear()
+                if open_elements:
+                    open_elements[-1].remove(elem)  # drop the reference from the parent to the processed item
+
+
+def _local_name(tag):
+    """ remove the namespace from a tag, {http://namespace}name -> name """
+
+    if tag[0] == '{':
+        return tag.split('}', 1)[1]
+    return tag
+
+
+class StreamElement:
+    """ wraps an ElementTree element with the BeautifulSoup style lookups used by XmlElementParser """
+
+    __slots__ = ('elem',)
+
+    def __init__(self, elem):
+        """
+        :param elem: xml.etree.ElementTree.Element
+        """
+
+        self.elem = elem
+
+    def __repr__(self):
+        return "<class: stream_element>: {}".format(self.elem.tag)
+
+    def __getitem__(self, attribute):
+        return self.elem.attrib[attribute]
+
+    def find(self, name):
+        """ return the first descendant element with the given name, or None """
+
+        elem = self.elem.find('.//' + name)
+        if elem is None:
+            return None
+        return StreamElement(elem)
+
+    def find_all(self, name):
+        """ return every descendant element with the given name """
+
+        return [StreamElement(elem) for elem in self.elem.iterfind('.//' + name)]
+
+    @property
+    def text(self):
+        return ''.join(self.elem.itertext())
@@ -0,0 +1,72 @@
+""" fixtures shared by the tests: fast retries, and the local HTTP and FTP stand-ins of the benchmarks serving a
+temporary folder """
+
+__author__ = 'alsherman'
+
+import pytest
+from benchmarks.servers import HttpServer, FtpServer
+from data_pipeline.sources_metadata.source_metadata import config
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    """ retry without waiting, and restore the settings in config.ini after each test
+
+    :return: function to override settings, e.g. settings({'CHECKPOINT': {'enabled': 'True'}})
+    """
+
+    def override(sections):
+        config.read_dict({section: {key: str(value) for key, value in values.items()}
+                          for section, values in sections.items()})
+
+    override({'HTTP': {'retries': 2, 'backoff_factor': 0, 'backoff_max': 0, 'timeout': 5.0}})
+    yield override
+    config.load()
+
+
+@pytest.fixture
+def served_folder(tmp_path):
+    folder = tmp_path / 'served'
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def http_server(served_folder):
+    with HttpServer(str(served_folder)) as server:
+        yield server
+
+
+@pytest.fixture
+def ftp_server(served_folder):
+    with FtpServer(str(served_folder)) as server:
+        yield server
+
+
+@pytest.fixture
+def output_folder(tmp_path, monkeypatch):
+    """ export folder of the sources, set on SourceMetadata """
+
+    from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+
+    folder = tmp_path / 'output'
+    folder.mkdir()
+    monkeypatch.setattr(SourceMetadata, 'users_local_raw_data_folder', str(folder))
+    return folder
+
+
+@pytest.fixture
+def make_source():
+    """ return a function that builds the sources_metadata of a source with a single data category named 'data' """
+
+    def make_source(url, download_type='url', **options):
+        return {'source_name': 'test',
+                'full_name': 'test',
+                'website': '',
+                'source_path': '',
+                'headers': {'data': None},
+                'output_path': {'data': 'data.csv'},
+                'data_categories': {'data': dict({'download_type': download_type, 'external': url, 'cache': False},
+                                                 **options)}}
+
+    return make_source
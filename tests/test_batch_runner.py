@@ -0,0 +1,78 @@
+__author__ = 'alsherman'
+
+import time
+import threading
+from benchmarks import servers
+from data_pipeline.batch_runner import BatchRunner
+from data_pipeline.stream_pipeline import streaming
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+def clean(source_metadata):
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def fail(source_metadata):
+    raise ValueError('cleaning failed')
+
+
+def counting_clean(counts):
+    """ return a streaming cleaning function that records the most cleaning functions running at a time """
+
+    lock = threading.Lock()
+
+    @streaming
+    def clean(source_metadata, chunks):
+        with lock:
+            counts['running'] += 1
+            counts['max_running'] = max(counts['max_running'], counts['running'])
+        try:
+            for chunk in chunks:
+                time.sleep(0.2)
+                yield chunk
+        finally:
+            with lock:
+                counts['running'] -= 1
+
+    return clean
+
+
+def test_jobs_with_the_same_name_are_recorded_separately(served_folder, http_server, output_folder, make_source):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    sources_metadata = make_source(http_server.url('data.csv'))
+
+    summary = BatchRunner([(sources_metadata, 'data', clean), (sources_metadata, 'data', fail)],
+                          use_processes=False, force=True).run()
+
+    assert [result.status for result in summary.results] == ['success', 'failure']
+    assert summary.failures[0].stage == 'transform'
+
+
+def test_streaming_jobs_hold_the_host_limit_until_the_stream_is_consumed(served_folder, http_server, output_folder,
+                                                                         make_source):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    counts = {'running': 0, 'max_running': 0}
+    jobs = [(make_source(http_server.url('data.csv'), stream=True), 'data', counting_clean(counts)) for _ in range(3)]
+
+    summary = BatchRunner(jobs, download_workers=3, per_host_limit=1, use_processes=False, force=True).run()
+
+    assert len(summary.rebuilt) == 3
+    assert counts['max_running'] == 1
+
+
+def test_streamed_downloads_hold_the_host_limit_until_cleaned(served_folder, http_server, output_folder, make_source,
+                                                              monkeypatch):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    copy = servers._copy
+
+    def slow_copy(source, write, length, chunk_size=1024 * 1024):
+        time.sleep(0.2)
+        copy(source, write, length, chunk_size)
+
+    monkeypatch.setattr(servers, '_copy', slow_copy)
+    jobs = [(make_source(http_server.url('data.csv'), stream=True), 'data', clean) for _ in range(3)]
+
+    summary = BatchRunner(jobs, download_workers=3, per_host_limit=1, use_processes=False, force=True).run()
+
+    assert len(summary.rebuilt) == 3
+    assert http_server.max_active == 1
@@ -0,0 +1,87 @@
+__author__ = 'alsherman'
+
+import pandas as pd
+import pytest
+from data_pipeline.checkpoint import CheckpointStore
+from data_pipeline.data_pipeline import DataPipeline
+from data_pipeline.export_data.create_csv import CSVCreator
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CheckpointStore(str(tmp_path / 'checkpoints'))
+
+
+@pytest.mark.parametrize('file_format', ['feather', 'parquet'])
+def test_dataframe_types_round_trip(tmp_path, file_format):
+    store = CheckpointStore(str(tmp_path / 'checkpoints'), file_format=file_format)
+    df = pd.DataFrame({'ints': pd.Series([1, None, 3], dtype=object),
+                       'strings': pd.Series(['a', 'b', None], dtype=object),
+                       'floats': [1.5, 2.5, None]})
+
+    assert store.save('source/data', 'cleaned', df, version='v1')
+    pd.testing.assert_frame_equal(store.load('source/data', 'cleaned', version='v1'), df)
+
+
+def test_version_mismatch_is_not_resumed(store):
+    store.save('source/data', 'raw', b'a,b\n1,2\n', version={'raw_data_path': 'http://a/data.csv'})
+
+    assert store.load('source/data', 'raw', version={'raw_data_path': 'http://b/data.csv'}) is None
+    assert store.load('source/data', 'raw', version={'raw_data_path': 'http://a/data.csv'}) == b'a,b\n1,2\n'
+
+
+def test_lazy_data_is_not_checkpointed(store):
+    assert not store.save('source/data', 'raw', iter([b'a,b\n']))
+    assert store.load('source/data', 'raw') is None
+
+
+def test_resumed_run_exports_the_same_data(tmp_path, served_folder, http_server, output_folder, make_source,
+                                           settings, monkeypatch):
+    settings({'CHECKPOINT': {'enabled': True, 'checkpoint_folder': tmp_path / 'checkpoints', 'max_size_mb': 100,
+                             'max_age_hours': 1, 'format': 'feather'}})
+    (served_folder / 'data.csv').write_text('id,name\n1,a\n2,\n3,c\n')
+    sources_metadata = make_source(http_server.url('data.csv'))
+    calls = []
+
+    def clean(source_metadata):
+        calls.append(None)
+        df = DataframeCreator(source_metadata).create_dataframe()
+        df['code'] = pd.Series([1, None, 3], dtype=object)
+        return df
+
+    def run():
+        DataPipeline('test', sources_metadata, 'data', clean, force=True).run_pipeline()
+        return (output_folder / 'data.csv').read_bytes()
+
+    expected = run()
+    (output_folder / 'data.csv').unlink()
+
+    create_csv = CSVCreator.create_csv
+    monkeypatch.setattr(CSVCreator, 'create_csv', lambda *args: (_ for _ in ()).throw(OSError('disk full')))
+    with pytest.raises(OSError):
+        run()
+    monkeypatch.setattr(CSVCreator, 'create_csv', create_csv)
+
+    (served_folder / 'data.csv').write_text('id,name\n9,changed\n')  # the resumed run does not download again
+    assert run() == expected
+    assert len(calls) == 2  # the cleaned data was resumed from the checkpoint
+
+
+def test_raw_checkpoint_of_another_url_is_not_resumed(tmp_path, served_folder, http_server, output_folder,
+                                                      make_source, settings, monkeypatch):
+    settings({'CHECKPOINT': {'enabled': True, 'checkpoint_folder': tmp_path / 'checkpoints'}})
+    (served_folder / 'old.csv').write_text('id\n1\n')
+    (served_folder / 'new.csv').write_text('id\n2\n')
+
+    def clean(source_metadata):
+        return DataframeCreator(source_metadata).create_dataframe()
+
+    create_csv = CSVCreator.create_csv
+    monkeypatch.setattr(CSVCreator, 'create_csv', lambda *args: (_ for _ in ()).throw(OSError('disk full')))
+    with pytest.raises(OSError):
+        DataPipeline('test', make_source(http_server.url('old.csv')), 'data', clean).run_pipeline()
+    monkeypatch.setattr(CSVCreator, 'create_csv', create_csv)
+
+    DataPipeline('test', make_source(http_server.url('new.csv')), 'data', clean).run_pipeline()
+    assert pd.read_csv(output_folder / 'data.csv')['id'].tolist() == [2]
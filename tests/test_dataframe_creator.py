@@ -0,0 +1,90 @@
+__author__ = 'alsherman'
+
+import io
+import datetime
+import pandas as pd
+import pytest
+from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+data = 'id,day\n1,2024-01-31\n2,2024-02-29\n'
+
+
+def create_dataframe(make_source, **options):
+    source_metadata = SourceMetadata(make_source('http://localhost/data.csv', **options), 'data')
+    source_metadata.downloaded_data = data
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def test_c_engine_by_default(make_source):
+    assert create_dataframe(make_source)['day'].tolist() == ['2024-01-31', '2024-02-29']
+
+
+def test_pyarrow_engine_is_opt_in(make_source):
+    pytest.importorskip('pyarrow')
+    df = create_dataframe(make_source, csv_engine='pyarrow')
+    assert df['day'].tolist() == [datetime.date(2024, 1, 31), datetime.date(2024, 2, 29)]
+    assert df['id'].tolist() == [1, 2]
+
+
+def test_header_row(make_source):
+    source_metadata = SourceMetadata(make_source('http://localhost/data.csv'), 'data')
+    source_metadata.downloaded_data = 'title\nid,day\n1,2024-01-31\n'
+    df = DataframeCreator(source_metadata, header=1).create_dataframe()
+    assert list(df.columns) == ['id', 'day'] and df['id'].tolist() == [1]
+
+
+def test_names_of_downloaded_data(make_source):
+    source_metadata = SourceMetadata(make_source('http://localhost/data.csv'), 'data')
+    source_metadata.downloaded_data = '1,2024-01-31\n'
+    df = DataframeCreator(source_metadata, names=['id', 'day']).create_dataframe()
+    assert df['id'].tolist() == [1]
+
+
+def test_encoding_of_local_files(output_folder, make_source):
+    (output_folder / 'data.csv').write_bytes('id,name\n1,caf\xe9\n'.encode('latin-1'))
+    source_metadata = SourceMetadata(make_source('', local='data.csv'), 'data', local=True)
+    assert DataframeCreator(source_metadata, encoding='latin-1').create_dataframe()['name'].tolist() == ['caf\xe9']
+
+
+def streamed_creator(make_source, text, chunksize=1000):
+    source_metadata = SourceMetadata(make_source('http://localhost/data.csv', stream=True), 'data')
+    source_metadata.downloaded_data = iter(text.encode('utf-8').splitlines(keepends=True))
+    return DataframeCreator(source_metadata, chunksize=chunksize)
+
+
+def test_streamed_download_has_the_types_of_a_single_read(make_source):
+    text = 'id,code\n' + ''.join('{},{}\n'.format(i, i if i < 1500 else 'X{}'.format(i)) for i in range(1510))
+    df = streamed_creator(make_source, text).create_dataframe()
+    pd.testing.assert_frame_equal(df, pd.read_csv(io.StringIO(text)))
+
+
+def test_streamed_chunks_have_the_types_of_the_first_chunk(make_source):
+    text = 'id,code,amount\n' + ''.join('{},{},{}\n'.format(i, 'X{}'.format(i) if i < 1000 else i, i if i < 1000 else '')
+                                       for i in range(1500))
+    chunks = list(streamed_creator(make_source, text).iter_dataframes())
+    assert len(chunks) == 2
+    assert chunks[1]['code'].dtype == chunks[0]['code'].dtype and chunks[1]['code'].iloc[0] == '1000'
+    assert chunks[1]['amount'].isna().all()
+
+
+def test_text_after_a_numeric_first_chunk_raises(make_source):
+    text = 'id,code\n' + ''.join('{},{}\n'.format(i, i if i < 1500 else 'X{}'.format(i)) for i in range(1510))
+    with pytest.raises(ValueError):
+        list(streamed_creator(make_source, text).iter_dataframes())
+
+
+def test_without_a_schema_the_parsed_types_are_kept(make_source):
+    pd.testing.assert_frame_equal(create_dataframe(make_source), pd.read_csv(io.StringIO(data)))
+
+
+def test_schema_and_downcast(make_source):
+    sources_metadata = make_source('http://localhost/data.csv', downcast=True)
+    sources_metadata['schema'] = {'data': {'day': {'type': 'datetime', 'format': '%Y-%m-%d'}}}
+    source_metadata = SourceMetadata(sources_metadata, 'data')
+    source_metadata.downloaded_data = data
+
+    df = DataframeCreator(source_metadata).create_dataframe()
+
+    assert str(df['id'].dtype) == 'uint8'
+    assert df['day'].tolist() == [pd.Timestamp('2024-01-31'), pd.Timestamp('2024-02-29')]
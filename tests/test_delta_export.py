@@ -0,0 +1,74 @@
+__author__ = 'alsherman'
+
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from data_pipeline.data_pipeline import DataPipeline
+from data_pipeline.export_data.create_csv import CSVCreator
+from data_pipeline.export_data.delta_export import DeltaExport
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+def clean(source_metadata):
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def export(path, df, output_format='csv'):
+    source_metadata = SimpleNamespace(output_path=str(path), data_category='data', dataframe=df,
+                                      create_output_path=lambda data_category, sources_metadata: str(path))
+    return CSVCreator(source_metadata).create_csv({'output_format': output_format, 'delta_keys': ['id']})
+
+
+def read(path, change):
+    return pd.read_csv(DeltaExport(str(path), ['id']).delta_path(change))
+
+
+def test_first_export_copies_the_snapshot_as_inserted(tmp_path):
+    path = tmp_path / 'data.csv'
+    df = pd.DataFrame({'id': [1, 2], 'amount': [3, 4]})
+
+    assert export(path, iter([df.iloc[:1], df.iloc[1:]])) == [str(path)] + DeltaExport(str(path), ['id']).delta_paths()
+    assert (tmp_path / 'data.inserted.csv').read_bytes() == path.read_bytes()
+    assert read(path, 'updated').empty and list(read(path, 'updated').columns) == ['id', 'amount']
+    assert read(path, 'deleted').empty and list(read(path, 'deleted').columns) == ['id']
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_changes_since_the_previous_export(tmp_path, output_format):
+    path = tmp_path / 'data.{}'.format(output_format)
+    export(path, pd.DataFrame({'id': [1, 2, 3], 'amount': [1, 2, 3]}), output_format)
+    export(path, pd.DataFrame({'id': [1, 2, 4], 'amount': [1, 5, 4]}), output_format)
+
+    delta = DeltaExport(str(path), ['id'])
+    read_file = pd.read_csv if output_format == 'csv' else pd.read_parquet
+    assert read_file(delta.delta_path('inserted')).to_dict('list') == {'id': [4], 'amount': [4]}
+    assert read_file(delta.delta_path('updated')).to_dict('list') == {'id': [2], 'amount': [5]}
+    assert read_file(delta.delta_path('deleted')).to_dict('list') == {'id': [3]}
+
+
+def test_duplicate_keys_leave_no_change_sets(tmp_path):
+    path = tmp_path / 'data.csv'
+    export(path, pd.DataFrame({'id': [1, 2], 'amount': [1, 2]}))
+
+    assert export(path, pd.DataFrame({'id': [1, 1], 'amount': [1, 2]})) == [str(path)]
+    assert not any((tmp_path / name).exists() for name in ['data.inserted.csv', 'data.updated.csv', 'data.deleted.csv'])
+
+
+def test_skipped_run_empties_the_change_sets(served_folder, http_server, output_folder, make_source):
+    (served_folder / 'data.csv').write_text('id,amount\n1,2\n3,4\n')
+    sources_metadata = dict(make_source(http_server.url('data.csv')), delta_keys=['id'])
+
+    def run():
+        return DataPipeline('test', sources_metadata, 'data', clean).run_pipeline()
+
+    assert run() == 'rebuilt'
+    assert len(read(output_folder / 'data.csv', 'inserted')) == 2
+
+    assert run() == 'skipped'
+    for change, columns in [('inserted', ['id', 'amount']), ('updated', ['id', 'amount']), ('deleted', ['id'])]:
+        df = read(output_folder / 'data.csv', change)
+        assert df.empty and list(df.columns) == columns
+
+    # the change sets are outputs of the run, so a missing change set rebuilds the source
+    (output_folder / 'data.updated.csv').unlink()
+    assert run() == 'rebuilt'
@@ -0,0 +1,77 @@
+__author__ = 'alsherman'
+
+import os
+import time
+import pytest
+from data_pipeline.download_data.download_cache import DownloadCache
+from data_pipeline.download_data.download_data import DownloadData
+from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DownloadCache(str(tmp_path / 'cache'))
+
+
+def statuses(server):
+    return [status for method, path, byte_range, status in server.requests]
+
+
+def test_hit_is_revalidated_with_a_conditional_request(served_folder, http_server, cache):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    url = http_server.url('data.csv')
+
+    path = cache.fetch(url)
+    assert cache.fetch(url) == path
+    assert open(path).read() == 'id\n1\n'
+    assert statuses(http_server) == [200, 304]
+
+
+def test_changed_file_is_downloaded_again(served_folder, http_server, cache):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    url = http_server.url('data.csv')
+    cache.fetch(url)
+
+    (served_folder / 'data.csv').write_text('id\n2\n')
+    os.utime(served_folder / 'data.csv', (0, time.time() + 60))
+
+    assert open(cache.fetch(url)).read() == 'id\n2\n'
+    assert statuses(http_server) == [200, 200]
+
+
+def test_not_modified_without_a_cached_copy_is_a_miss(served_folder, http_server, cache):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    url = http_server.url('data.csv')
+    path = cache.fetch(url)
+
+    # the index is lost, while a proxy still answers a conditional request with 304
+    etag = cache.entry(url)['etag']
+    os.remove(os.path.join(cache.cache_folder, cache.index_name))
+    os.remove(path)
+
+    assert open(cache._download(url, cache._key(url), None, {'If-None-Match': etag}, 1024)).read() == 'id\n1\n'
+    assert statuses(http_server) == [200, 304, 200]
+
+
+def test_least_recently_used_payloads_are_evicted(served_folder, http_server, tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_size=25)
+    for name in ['a', 'b', 'c']:
+        (served_folder / name).write_bytes(b'x' * 10)
+
+    path_a = cache.fetch(http_server.url('a'))
+    path_b = cache.fetch(http_server.url('b'))
+    cache.fetch(http_server.url('a'))  # a is now more recently used than b
+    path_c = cache.fetch(http_server.url('c'))
+
+    assert os.path.exists(path_a) and os.path.exists(path_c)
+    assert not os.path.exists(path_b)
+    assert cache.entry(http_server.url('b')) is None
+
+
+def test_download_through_the_cache(served_folder, http_server, cache, make_source):
+    (served_folder / 'data.csv').write_text('id\n1\n')
+    source_metadata = SourceMetadata(make_source(http_server.url('data.csv'), cache=True), 'data')
+
+    for _ in range(2):
+        assert DownloadData(source_metadata, cache=cache).download('url') == 'id\n1\n'
+    assert statuses(http_server) == [200, 304]
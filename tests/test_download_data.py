@@ -0,0 +1,99 @@
+__author__ = 'alsherman'
+
+import io
+import gzip
+import zipfile
+import pandas as pd
+import pytest
+from data_pipeline.download_data.download_data import DownloadData
+from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+# streamed urls are read in blocks of this size, see DownloadData._download_and_extract_url
+BLOCK_SIZE = 1024 * 1024
+
+
+def write_source(folder, download_type, text):
+    """ write the text as a file of the download type in the served folder
+
+    :return: name of the served file
+    """
+
+    data = text.encode('utf-8')
+    if download_type == 'url':
+        (folder / 'data.csv').write_bytes(data)
+        return 'data.csv'
+    if download_type == 'gzip':
+        (folder / 'data.csv.gz').write_bytes(gzip.compress(data))
+        return 'data.csv.gz'
+    with zipfile.ZipFile(str(folder / 'data.zip'), 'w', zipfile.ZIP_DEFLATED) as zfile:
+        zfile.writestr('data.csv', data)
+    return 'data.zip'
+
+
+def stream_source(served_folder, http_server, make_source, download_type, text, chunksize=1000):
+    """ download the text as a stream, as DataPipeline does for data categories that set 'stream'
+
+    :return: DataframeCreator of the streamed download
+    """
+
+    url = http_server.url(write_source(served_folder, download_type, text))
+    source_metadata = SourceMetadata(make_source(url, download_type=download_type, stream=True), 'data')
+    source_metadata.downloaded_data = DownloadData(source_metadata).download(download_type)
+    assert not isinstance(source_metadata.downloaded_data, (str, bytes, list))  # lazy, read as it is parsed
+    return DataframeCreator(source_metadata, chunksize=chunksize)
+
+
+def rows_across_a_block(rows):
+    """ csv text in which a multi-byte character and a row are split by the end of the first streamed block """
+
+    row = 'café {},{}\n'
+    lines = ['name,id\n']
+    size = len(lines[0])
+    while size < BLOCK_SIZE - 100:
+        lines.append(row.format(len(lines), 1))
+        size += len(lines[-1].encode('utf-8'))
+    lines.append('x' * (BLOCK_SIZE - 1 - size - len('caf')) + row.format(0, 1))
+    text = ''.join(lines)
+    assert text.encode('utf-8')[BLOCK_SIZE - 1:BLOCK_SIZE + 1] == 'é'.encode('utf-8')
+    return text + ''.join(row.format(i, i) for i in range(rows))
+
+
+@pytest.mark.parametrize('download_type', ['url', 'gzip', 'zip'])
+def test_streamed_chunks_match_a_single_read(served_folder, http_server, output_folder, make_source, download_type):
+    text = rows_across_a_block(1000)
+    creator = stream_source(served_folder, http_server, make_source, download_type, text, chunksize=7919)
+
+    chunks = list(creator.iter_dataframes())
+
+    assert len(chunks) > 2
+    assert all(len(chunk) == 7919 for chunk in chunks[:-1])
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), pd.read_csv(io.StringIO(text)))
+
+
+@pytest.mark.parametrize('download_type', ['url', 'gzip', 'zip'])
+def test_streamed_download_in_one_pass(served_folder, http_server, output_folder, make_source, download_type):
+    text = rows_across_a_block(10)
+    creator = stream_source(served_folder, http_server, make_source, download_type, text)
+
+    pd.testing.assert_frame_equal(creator.create_dataframe(), pd.read_csv(io.StringIO(text)))
+
+
+@pytest.mark.parametrize('download_type', ['url', 'gzip', 'zip'])
+@pytest.mark.parametrize('text, columns', [('', []), ('id,name\n', ['id', 'name'])])
+def test_empty_streamed_download_yields_one_empty_chunk(served_folder, http_server, output_folder, make_source,
+                                                        download_type, text, columns):
+    chunks = list(stream_source(served_folder, http_server, make_source, download_type, text).iter_dataframes())
+
+    assert len(chunks) == 1
+    assert chunks[0].empty
+    assert list(chunks[0].columns) == columns
+
+
+@pytest.mark.parametrize('download_type', ['url', 'gzip', 'zip'])
+def test_rows_of_exactly_one_chunk(served_folder, http_server, output_folder, make_source, download_type):
+    text = 'id\n' + ''.join('{}\n'.format(i) for i in range(20))
+    chunks = list(stream_source(served_folder, http_server, make_source, download_type, text,
+                                chunksize=10).iter_dataframes())
+
+    assert [chunk['id'].tolist() for chunk in chunks] == [list(range(10)), list(range(10, 20))]
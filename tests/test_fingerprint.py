@@ -0,0 +1,126 @@
+__author__ = 'alsherman'
+
+import sys
+import copy
+import importlib.util
+import multiprocessing
+import pytest
+from data_pipeline import fingerprint
+from data_pipeline.data_pipeline import DataPipeline
+from data_pipeline.fingerprint import FingerprintManifest
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+def clean(source_metadata):
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+@pytest.fixture
+def sources_metadata(served_folder, http_server, output_folder, make_source):
+    (served_folder / 'data.csv').write_text('id,amount\n1,2\n3,4\n')
+    return make_source(http_server.url('data.csv'))
+
+
+def run(sources_metadata):
+    return DataPipeline('test', sources_metadata, 'data', clean).run_pipeline()
+
+
+def test_unchanged_source_is_skipped(sources_metadata):
+    assert run(sources_metadata) == 'rebuilt'
+    assert run(copy.deepcopy(sources_metadata)) == 'skipped'
+
+
+@pytest.mark.parametrize('option, value', [('schema', {'data': {'amount': 'float64'}}),
+                                           ('output_format', 'csv.gz'),
+                                           ('output_options', {'compression_level': 1}),
+                                           ('delta_keys', ['id'])])
+def test_changed_metadata_is_rebuilt(sources_metadata, option, value):
+    assert run(sources_metadata) == 'rebuilt'
+
+    changed = dict(copy.deepcopy(sources_metadata), **{option: value})
+    assert run(changed) == 'rebuilt'
+    assert run(changed) == 'skipped'
+
+
+def load_module(path, source):
+    """ write a module of cleaning functions and import it, as the command line imports a jobs file """
+
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location(path.stem, str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+HELPERS = '''
+def scale(value):
+    return value * 2
+'''
+
+JOBS = '''
+import functools
+import pandas as pd
+import helpers
+
+THRESHOLD = 5
+
+
+def keep(df):
+    return df[df['amount'] > THRESHOLD]
+
+
+def unused(df):
+    return df
+
+
+def clean(source_metadata, column='amount'):
+    df = pd.DataFrame({'amount': [helpers.scale(1)]})
+    return [keep(chunk) for chunk in [df]]
+
+
+def make_clean(func):
+    def wrapped(source_metadata):
+        return func(source_metadata)
+    return wrapped
+
+
+wrapped = make_clean(clean)
+partial = functools.partial(clean, column='amount')
+'''
+
+
+@pytest.mark.parametrize('name', ['clean', 'wrapped', 'partial'])
+@pytest.mark.parametrize('path, old, new, changed', [
+    ('jobs.py', 'return df[df', 'return df.loc[df', True),   # a helper in the same module
+    ('jobs.py', 'THRESHOLD = 5', 'THRESHOLD = 6', True),     # a constant
+    ('helpers.py', 'value * 2', 'value * 3', True),           # an imported module
+    ('jobs.py', 'def unused(df):\n    return df', 'def unused(df):\n    return df.copy()', False)])
+def test_cleaning_function_code_includes_its_helpers(tmp_path, monkeypatch, name, path, old, new, changed):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    sources = {'helpers.py': HELPERS, 'jobs.py': JOBS}
+
+    def func_hash():
+        monkeypatch.delitem(sys.modules, 'helpers', raising=False)
+        for module_path in ('helpers.py', 'jobs.py'):
+            module = load_module(tmp_path / module_path, sources[module_path])
+        return fingerprint._hash_bytes(fingerprint._func_code(getattr(module, name)))
+
+    before = func_hash()
+    assert func_hash() == before
+
+    sources[path] = sources[path].replace(old, new)
+    assert (func_hash() != before) == changed
+
+
+def test_manifest_records_from_many_processes(tmp_path):
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        pool.starmap(record_many, [(str(tmp_path), worker) for worker in range(4)])
+
+    entries = FingerprintManifest(str(tmp_path)).entries()
+    assert sorted(entries) == sorted('{}/{}'.format(worker, i) for worker in range(4) for i in range(25))
+
+
+def record_many(folder, worker):
+    manifest = FingerprintManifest(folder)
+    for i in range(25):
+        manifest.record('{}/{}'.format(worker, i), {'data': str(i)}, [])
@@ -0,0 +1,132 @@
+__author__ = 'alsherman'
+
+import os
+import pytest
+from benchmarks import servers
+from data_pipeline.data_pipeline import DataPipeline
+from data_pipeline.download_data.download_data import DownloadData
+from data_pipeline.download_data.download_error import DownloadError
+from data_pipeline.download_data.ftp_download import FtpDownloader
+from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+@pytest.fixture
+def data(served_folder):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    (served_folder / 'data.bin').write_bytes(data)
+    return data
+
+
+@pytest.fixture
+def downloader():
+    with FtpDownloader(workers=2, block_size=256 * 1024, timeout=5) as downloader:
+        yield downloader
+
+
+@pytest.fixture
+def drop_transfers(monkeypatch):
+    """ end the next transfers after 1 MB, as if the connection dropped
+
+    :return: function setting the number of transfers to drop
+    """
+
+    drops = [0]
+    copy = servers._copy
+
+    def short_copy(source, write, length, chunk_size=1024 * 1024):
+        if drops[0]:
+            drops[0] -= 1
+            length = min(length, 1024 * 1024)
+        copy(source, write, length, chunk_size)
+
+    monkeypatch.setattr(servers, '_copy', short_copy)
+
+    def drop(transfers):
+        drops[0] = transfers
+    return drop
+
+
+def test_read(ftp_server, downloader, data):
+    assert downloader.read(ftp_server.url('data.bin')) == data
+    assert b''.join(downloader.stream(ftp_server.url('data.bin'))) == data
+
+
+def test_interrupted_transfer_is_resumed(ftp_server, downloader, data, drop_transfers):
+    drop_transfers(2)
+    assert downloader.read(ftp_server.url('data.bin')) == data
+
+
+def test_missing_file(ftp_server, downloader):
+    with pytest.raises(DownloadError):
+        downloader.read(ftp_server.url('missing.bin'))
+
+
+def interrupted_download(ftp_server, downloader, path, drop_transfers, settings):
+    settings({'HTTP': {'retries': 0}})
+    drop_transfers(1)
+    with pytest.raises(DownloadError):
+        downloader.download(ftp_server.url('data.bin'), path)
+    settings({'HTTP': {'retries': 2}})
+    assert os.path.getsize(path + '.part') == 1024 * 1024
+
+
+def test_partial_download_is_resumed(tmp_path, ftp_server, downloader, data, drop_transfers, settings, monkeypatch):
+    path = str(tmp_path / 'data.bin')
+    interrupted_download(ftp_server, downloader, path, drop_transfers, settings)
+
+    offsets = []
+    iter_file = downloader.iter_file
+    monkeypatch.setattr(downloader, 'iter_file', lambda url, offset=0, size=None: offsets.append(offset) or iter_file(
+        url, offset, size))
+    downloader.download(ftp_server.url('data.bin'), path)
+
+    assert offsets == [1024 * 1024]
+    assert open(path, 'rb').read() == data
+    assert not os.path.exists(path + '.part.json')
+
+
+def test_partial_download_of_a_changed_file_restarts(tmp_path, served_folder, ftp_server, downloader, data,
+                                                     drop_transfers, settings):
+    path = str(tmp_path / 'data.bin')
+    interrupted_download(ftp_server, downloader, path, drop_transfers, settings)
+
+    changed = os.urandom(len(data))  # the same size, modified later
+    (served_folder / 'data.bin').write_bytes(changed)
+    os.utime(served_folder / 'data.bin', (0, os.path.getmtime(served_folder / 'data.bin') + 60))
+
+    downloader.download(ftp_server.url('data.bin'), path)
+    assert open(path, 'rb').read() == changed
+
+
+def test_fetch_skips_unchanged_files(tmp_path, served_folder, ftp_server, downloader, monkeypatch):
+    (served_folder / 'files').mkdir()
+    for name in ['a.csv', 'b.csv', 'c.CSV', 'notes.txt']:
+        (served_folder / 'files' / name).write_text('id\n1\n')
+    folder = str(tmp_path / 'downloads')
+
+    paths = downloader.fetch(ftp_server.url('files/'), '*.csv', folder)
+    assert sorted(paths) == ['a.csv', 'b.csv']  # patterns are case sensitive, as for zip_members
+
+    downloaded = []
+    download = downloader.download
+    monkeypatch.setattr(downloader, 'download', lambda url, *args, **kwargs: downloaded.append(url) or download(
+        url, *args, **kwargs))
+    downloader.fetch(ftp_server.url('files/'), '*.csv', folder)
+    assert downloaded == []
+
+    os.utime(served_folder / 'files' / 'b.csv', (0, 1000))
+    downloader.fetch(ftp_server.url('files/'), '*.csv', folder)
+    assert downloaded == [ftp_server.url('files/b.csv')]
+
+
+def test_pipeline(served_folder, ftp_server, output_folder, make_source):
+    (served_folder / 'data.csv').write_text('id,name\n1,a\n2,b\n')
+    sources_metadata = make_source(ftp_server.url('data.csv'), download_type='ftp')
+
+    source_metadata = SourceMetadata(sources_metadata, 'data')
+    assert DownloadData(source_metadata).download('ftp') == b'id,name\n1,a\n2,b\n'
+
+    DataPipeline('test', sources_metadata, 'data',
+                 lambda source_metadata: DataframeCreator(source_metadata).create_dataframe()).run_pipeline()
+    assert (output_folder / 'data.csv').read_text() == 'id,name\n1,a\n2,b\n'
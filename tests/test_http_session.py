@@ -0,0 +1,69 @@
+__author__ = 'alsherman'
+
+import pytest
+from data_pipeline.download_data import http_session
+from data_pipeline.download_data.download_error import DownloadError
+from data_pipeline.download_data.http_session import request, with_retries
+
+
+def count_calls(func):
+    calls = []
+
+    def wrapper():
+        calls.append(None)
+        return func()
+    return wrapper, calls
+
+
+def test_invalid_url_fails_without_retries():
+    func, calls = count_calls(lambda: http_session.send('SET TO USERS LOCAL EXPORT DATA PATH'))
+    with pytest.raises(DownloadError):
+        with_retries(func, 'SET TO USERS LOCAL EXPORT DATA PATH')
+    assert len(calls) == 1
+
+
+def test_missing_schema_fails_without_retries():
+    func, calls = count_calls(lambda: http_session.send('data.csv'))
+    with pytest.raises(DownloadError):
+        with_retries(func, 'data.csv')
+    assert len(calls) == 1
+
+
+def test_local_io_errors_propagate():
+    def write():
+        raise PermissionError('read-only file system')
+
+    func, calls = count_calls(write)
+    with pytest.raises(PermissionError):
+        with_retries(func, 'http://example.com/data.csv')
+    assert len(calls) == 1
+
+
+def test_connection_errors_are_retried():
+    def connect():
+        if len(calls) < 3:
+            raise http_session.requests.ConnectionError('connection reset')
+        return 'data'
+
+    func, calls = count_calls(connect)
+    assert with_retries(func, 'http://example.com/data.csv') == 'data'
+    assert len(calls) == 3
+
+
+def test_request(http_server, served_folder):
+    (served_folder / 'data.csv').write_text('a,b\n1,2\n')
+
+    assert request(http_server.url('data.csv')).text == 'a,b\n1,2\n'
+    with pytest.raises(DownloadError):
+        request(http_server.url('missing.csv'))
+
+
+def test_raw_read_timeouts_are_retried():
+    def read():
+        if len(calls) < 2:
+            raise http_session.urllib3.exceptions.ReadTimeoutError(None, None, 'Read timed out.')
+        return b'data'
+
+    func, calls = count_calls(read)
+    assert with_retries(func, 'http://example.com/data.csv') == b'data'
+    assert len(calls) == 2
@@ -0,0 +1,184 @@
+__author__ = 'alsherman'
+
+import re
+import json
+import time
+import pandas as pd
+import pytest
+from data_pipeline.data_pipeline import DataPipeline
+from data_pipeline.instrumentation import PipelineMetrics, sampling_profiler, write_prometheus
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+SAMPLE = re.compile(r'^(data_pipeline_\w+)\{([^}]*)\} (\S+)$')
+
+
+def clean(source_metadata):
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def read_samples(path):
+    """ parse a Prometheus textfile into {(metric, labels): value}, checking every metric has its HELP and TYPE """
+
+    samples = {}
+    described = set()
+    with open(str(path)) as f:
+        for line in f.read().splitlines():
+            if line.startswith('# HELP '):
+                described.add(line.split()[2])
+                continue
+            if line.startswith('# TYPE '):
+                assert line.split()[2] in described and line.split()[3] == 'gauge'
+                continue
+
+            metric, labels, value = SAMPLE.match(line).groups()
+            assert metric in described
+            labels = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels)))
+            samples[metric, labels] = float(value)
+    return samples
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_stage_records_time_and_memory():
+    metrics = PipelineMetrics('test')
+
+    with metrics.stage('transform'):
+        busy(0.05)
+    with pytest.raises(ValueError):
+        with metrics.stage('load'):
+            raise ValueError('load failed')
+
+    assert metrics.stages['transform']['wall_seconds'] >= 0.05
+    assert metrics.stages['transform']['cpu_seconds'] > 0
+    assert metrics.stages['transform']['peak_rss_bytes'] > 0
+    assert 'peak_traced_bytes' not in metrics.stages['transform']
+    assert 'wall_seconds' in metrics.stages['load']
+
+
+def test_trace_memory():
+    metrics = PipelineMetrics('test', trace_memory=True)
+
+    with metrics.stage('transform'):
+        data = bytearray(10 * 2 ** 20)
+    del data
+
+    assert metrics.stages['transform']['peak_traced_bytes'] >= 10 * 2 ** 20
+
+
+def test_record_downloaded_bytes():
+    metrics = PipelineMetrics('test')
+
+    assert metrics.record_downloaded({'a.csv': b'abc', 'b.csv': 'dé'}) == {'a.csv': b'abc', 'b.csv': 'dé'}
+    assert metrics.values['downloaded_bytes'] == 6
+
+    # lazy downloads are counted as they are consumed
+    chunks = metrics.record_downloaded(iter([b'ab', b'cde']))
+    assert metrics.values['downloaded_bytes'] == 6
+    assert list(chunks) == [b'ab', b'cde']
+    assert metrics.values['downloaded_bytes'] == 11
+
+
+def test_record_dataframes_and_chunks():
+    metrics = PipelineMetrics('test')
+    metrics.record_dataframes({'a': pd.DataFrame({'x': [1, 2]}), 'b': pd.DataFrame({'x': [1], 'y': [2]})})
+    assert metrics.values == {'rows': 3, 'columns': 3,
+                              'tables': {'a': {'rows': 2, 'columns': 1}, 'b': {'rows': 1, 'columns': 2}}}
+
+    metrics = PipelineMetrics('test')
+    chunks = metrics.record_chunks(iter([pd.DataFrame({'x': [1, 2]}), pd.DataFrame({'x': [3]})]))
+    assert len(list(chunks)) == 2
+    assert metrics.values == {'rows': 3, 'columns': 1}
+
+
+def test_emit_writes_the_metrics_file_and_prometheus_textfile(tmp_path):
+    metrics = PipelineMetrics('test "pipeline"', metrics_file=str(tmp_path / 'metrics.jsonl'),
+                              prometheus_folder=str(tmp_path / 'prometheus'))
+    for stage in ('extract', 'transform'):
+        with metrics.stage(stage):
+            pass
+    metrics.record(downloaded_bytes=100, rows=10, columns=2)
+
+    record = metrics.emit('rebuilt')
+    metrics.emit('skipped')
+
+    with open(str(tmp_path / 'metrics.jsonl')) as f:
+        records = [json.loads(line) for line in f]
+    assert [r['outcome'] for r in records] == ['rebuilt', 'skipped']
+    assert records[0]['stages'] == record['stages']
+
+    samples = read_samples(tmp_path / 'prometheus' / 'data_pipeline_test_pipeline.prom')
+    pipeline = ('pipeline', 'test \\"pipeline\\"')
+    for stage in ('extract', 'transform'):
+        labels = (pipeline, ('stage', stage))
+        assert samples['data_pipeline_stage_wall_seconds', labels] == pytest.approx(
+            record['stages'][stage]['wall_seconds'])
+        assert ('data_pipeline_stage_cpu_seconds', labels) in samples
+        assert ('data_pipeline_stage_peak_rss_bytes', labels) in samples
+        assert ('data_pipeline_stage_peak_traced_bytes', labels) not in samples  # not traced
+
+    assert samples['data_pipeline_downloaded_bytes', (pipeline,)] == 100
+    assert samples['data_pipeline_rows', (pipeline,)] == 10
+    assert samples['data_pipeline_columns', (pipeline,)] == 2
+    assert ('data_pipeline_exported_bytes', (pipeline,)) not in samples
+    assert samples['data_pipeline_last_run_rebuilt', (pipeline,)] == 0  # the textfile holds the last run
+    assert ('data_pipeline_last_run_timestamp_seconds', (pipeline,)) in samples
+    assert not list((tmp_path / 'prometheus').glob('*.tmp'))
+
+
+def test_prometheus_textfile_is_replaced(tmp_path):
+    record = {'pipeline': 'test', 'outcome': 'rebuilt', 'timestamp': 1.0, 'stages': {}, 'rows': 5}
+    write_prometheus(record, str(tmp_path))
+    write_prometheus(dict(record, rows=7), str(tmp_path))
+
+    samples = read_samples(tmp_path / 'data_pipeline_test.prom')
+    assert samples['data_pipeline_rows', (('pipeline', 'test'),)] == 7
+    assert samples['data_pipeline_last_run_rebuilt', (('pipeline', 'test'),)] == 1
+
+
+def test_sampling_profiler_writes_folded_stacks(tmp_path):
+    metrics = PipelineMetrics('test', profiler=lambda name, stage: sampling_profiler(str(tmp_path), name, stage,
+                                                                                      interval=0.001))
+    with metrics.stage('transform'):
+        busy(0.2)
+
+    with open(str(tmp_path / 'test.transform.folded')) as f:
+        lines = f.read().splitlines()
+    assert lines
+    assert all(re.match(r'^\S.* \d+$', line) for line in lines)
+    assert any('busy (test_instrumentation.py' in line for line in lines)
+
+
+def test_from_config(settings, tmp_path):
+    settings({'INSTRUMENTATION': {'metrics_file': str(tmp_path / 'metrics.jsonl'), 'trace_memory': 'True',
+                                  'profile_folder': str(tmp_path / 'profiles'), 'profile_interval': '0.01'}})
+
+    metrics = PipelineMetrics.from_config('test')
+
+    assert metrics.metrics_file == str(tmp_path / 'metrics.jsonl')
+    assert metrics.prometheus_folder is None
+    assert metrics.trace_memory
+    assert metrics.profiler.keywords == {'interval': 0.01}
+
+
+def test_pipeline_run_emits_every_stage(settings, served_folder, http_server, output_folder, make_source, tmp_path):
+    (served_folder / 'data.csv').write_text('id,name\n1,a\n2,b\n3,c\n')
+    settings({'INSTRUMENTATION': {'metrics_file': str(tmp_path / 'metrics.jsonl'),
+                                  'prometheus_folder': str(tmp_path / 'prometheus')}})
+
+    assert DataPipeline('test', make_source(http_server.url('data.csv')), 'data', clean, force=True).run_pipeline() \
+        == 'rebuilt'
+
+    with open(str(tmp_path / 'metrics.jsonl')) as f:
+        record = json.loads(f.read())
+    assert set(record['stages']) >= {'extract', 'transform', 'load'}
+    assert (record['rows'], record['columns']) == (3, 2)
+    assert record['downloaded_bytes'] == len('id,name\n1,a\n2,b\n3,c\n')
+    assert record['exported_bytes'] > 0
+
+    samples = read_samples(tmp_path / 'prometheus' / 'data_pipeline_test.prom')
+    assert samples['data_pipeline_rows', (('pipeline', 'test'),)] == 3
+    assert samples['data_pipeline_last_run_rebuilt', (('pipeline', 'test'),)] == 1
@@ -0,0 +1,130 @@
+__author__ = 'alsherman'
+
+import os
+import configparser
+import pytest
+from data_pipeline.__main__ import main
+
+JOBS = '''
+from data_pipeline.transform_data.dataframe_creator import DataframeCreator
+
+
+def clean(source_metadata):
+    return DataframeCreator(source_metadata).create_dataframe()
+
+
+def fail(source_metadata):
+    raise ValueError('cleaning failed')
+
+
+def source(name, url, func):
+    return ({{'source_name': name,
+              'full_name': name,
+              'website': '',
+              'source_path': '',
+              'headers': {{'data': None}},
+              'output_path': {{'data': name + '.csv'}},
+              'data_categories': {{'data': {{'download_type': 'url', 'external': url, 'cache': False}}}}}},
+            'data', func)
+
+
+jobs = [source('census', '{url}', clean),
+        source('weather', '{url}', clean),
+        source('broken', '{url}', fail)]
+'''
+
+
+@pytest.fixture
+def cli(tmp_path, served_folder, http_server):
+    """ write a config with an export folder in tmp_path, and a jobs file of sources served by http_server
+
+    :return: function that runs main with the config and jobs file, e.g. cli('run', '--only', 'census*')
+    """
+
+    (served_folder / 'data.csv').write_text('id,name\n1,a\n2,b\n')
+    export_folder = tmp_path / 'export'
+    export_folder.mkdir()
+
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'))
+    parser.read_dict({'USER': {'DataExportFolder': str(export_folder)},
+                      'HTTP': {'retries': '2', 'backoff_factor': '0', 'backoff_max': '0', 'timeout': '5'}})
+    config_path = tmp_path / 'config.ini'
+    with open(str(config_path), 'w') as f:
+        parser.write(f)
+
+    jobs_path = tmp_path / 'jobs.py'
+    jobs_path.write_text(JOBS.format(url=http_server.url('data.csv')))
+
+    def run(command, *args):
+        return main(['--config', str(config_path), command, str(jobs_path)] + list(args))
+
+    run.export_folder = export_folder
+    return run
+
+
+def test_list(cli, capsys):
+    assert cli('list', '--only', 'census*', '--only', 'weather*') == 0
+
+    out = capsys.readouterr().out
+    assert 'census - data\n    url: http' in out
+    assert 'output: {}'.format(cli.export_folder / 'weather.csv') in out
+    assert 'broken' not in out
+
+
+def test_dry_run_plans_without_downloading(cli, capsys, http_server):
+    assert cli('dry-run') == 0
+
+    out = capsys.readouterr().out
+    assert out.count('plan: rebuild, never exported') == 3
+    assert 'clean: clean' in out and 'clean: fail' in out
+    assert not [request for request in http_server.requests if request[1].endswith('data.csv')]
+
+
+def test_dry_run_of_invalid_metadata(cli, tmp_path, capsys):
+    jobs_path = tmp_path / 'invalid_jobs.py'
+    jobs_path.write_text("jobs = [({'source_name': 'invalid', 'data_categories': {'data': {}}}, 'data', print)]\n")
+
+    assert main(['dry-run', str(jobs_path)]) == 1
+    assert 'invalid metadata' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('mode', [['--serial'], ['--threads'], []])
+def test_run_and_status(cli, capsys, mode):
+    assert cli('run', '--only', 'census*', *mode) == 0
+    assert (cli.export_folder / 'census.csv').read_text() == 'id,name\n1,a\n2,b\n'
+    assert not (cli.export_folder / 'weather.csv').exists()
+    capsys.readouterr()
+
+    assert cli('status') == 0
+    out = capsys.readouterr().out
+    assert '{}  0.0 MB  modified'.format(cli.export_folder / 'census.csv') in out
+    assert 'weather - data\n    never exported' in out
+
+    (cli.export_folder / 'census.csv').unlink()
+    assert cli('status') == 0
+    assert 'missing, the next run will rebuild it' in capsys.readouterr().out
+
+    assert cli('dry-run', '--only', 'census*') == 0
+    assert 'plan: rebuild if the source' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('mode', [['--serial'], ['--threads'], []])
+def test_run_with_a_failing_job(cli, capsys, mode):
+    assert cli('run', *mode) == 1
+    assert (cli.export_folder / 'census.csv').exists()
+    assert 'cleaning failed' in capsys.readouterr().out
+
+
+def test_run_without_matching_jobs(cli):
+    assert cli('run', '--only', 'missing*') == 1
+
+
+@pytest.mark.parametrize('argv', [[], ['unknown', 'jobs.py'], ['run'], ['run', 'jobs.py', '--workers', 'many'],
+                                  ['list', 'jobs.py', '--force']])
+def test_bad_arguments_exit_with_usage_error(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(argv)
+
+    assert exit_info.value.code == 2
+    assert 'usage: python -m data_pipeline' in capsys.readouterr().err
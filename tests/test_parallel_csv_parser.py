@@ -0,0 +1,39 @@
+__author__ = 'alsherman'
+
+import pandas as pd
+import pytest
+from data_pipeline.transform_data.parallel_csv_parser import ParallelCsvParser
+
+
+def parse(path, **kwargs):
+    return ParallelCsvParser(str(path), workers=2, chunk_size=64 * 1024, min_file_size=0).read_csv(**kwargs)
+
+
+@pytest.fixture
+def mixed_csv(tmp_path):
+    """ code is numeric in the first 15000 rows, and text after them, so the ranges infer different types """
+
+    path = tmp_path / 'data.csv'
+    rows = ['{},{},{}'.format(i, i if i < 15000 else 'X{}'.format(i), 'a' if i % 2 else '') for i in range(20000)]
+    path.write_text('id,code,flag\n' + '\n'.join(rows) + '\n')
+    return path
+
+
+def test_same_as_a_single_process_read(mixed_csv):
+    parser = ParallelCsvParser(str(mixed_csv), workers=2, chunk_size=64 * 1024, min_file_size=0)
+    with open(str(mixed_csv), 'rb') as f:
+        assert len(parser.line_ranges(f.read())) > 2
+
+    pd.testing.assert_frame_equal(parse(mixed_csv), pd.read_csv(str(mixed_csv)))
+
+
+def test_schema_dtypes_are_kept(mixed_csv):
+    df = parse(mixed_csv, dtype={'id': 'int32'})
+    assert df['id'].dtype == 'int32'
+    pd.testing.assert_frame_equal(df, pd.read_csv(str(mixed_csv), dtype={'id': 'int32'}))
+
+
+def test_numeric_types_are_combined(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('id,amount\n' + '\n'.join('{},{}'.format(i, i if i < 15000 else '') for i in range(20000)) + '\n')
+    pd.testing.assert_frame_equal(parse(path), pd.read_csv(str(path)))
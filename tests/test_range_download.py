@@ -0,0 +1,170 @@
+__author__ = 'alsherman'
+
+import os
+import time
+import zipfile
+import pytest
+from benchmarks import servers
+from benchmarks.servers import HttpServer
+from data_pipeline.download_data.download_data import DownloadData
+from data_pipeline.download_data.download_error import DownloadError
+from data_pipeline.download_data.range_download import RangeDownloader, RangeFile
+from data_pipeline.sources_metadata.source_metadata import SourceMetadata
+
+segment_size = 64 * 1024
+segments = 5
+
+
+@pytest.fixture
+def data(served_folder):
+    data = os.urandom(segment_size * segments - 100)
+    (served_folder / 'data.bin').write_bytes(data)
+    return data
+
+
+@pytest.fixture
+def downloader():
+    return RangeDownloader(segment_size=segment_size, workers=2)
+
+
+def range_requests(server):
+    return [byte_range for method, path, byte_range, status in server.requests if method == 'GET' and byte_range]
+
+
+def interrupted_download(server, downloader, path, settings, monkeypatch):
+    """ download every segment but the third, which ends halfway, as if the connection dropped """
+
+    copy = servers._copy
+
+    def short_copy(source, write, length, chunk_size=1024 * 1024):
+        if source.tell() == 2 * segment_size:
+            copy(source, write, length // 2, chunk_size)
+            raise ConnectionAbortedError('connection dropped')  # the server closes the connection
+        copy(source, write, length, chunk_size)
+
+    settings({'HTTP': {'retries': 0}})
+    monkeypatch.setattr(servers, '_copy', short_copy)
+    with pytest.raises(DownloadError):
+        downloader.download(server.url('data.bin'), path)
+    monkeypatch.setattr(servers, '_copy', copy)
+    settings({'HTTP': {'retries': 2}})
+    del server.requests[:]
+
+
+def test_segmented_download(tmp_path, http_server, downloader, data):
+    path = str(tmp_path / 'data.bin')
+    downloader.download(http_server.url('data.bin'), path)
+
+    assert open(path, 'rb').read() == data
+    assert len(range_requests(http_server)) == segments
+    assert not os.path.exists(path + '.part') and not os.path.exists(path + '.part.json')
+
+
+def test_resume_after_a_partial_segment(tmp_path, http_server, downloader, data, settings, monkeypatch):
+    path = str(tmp_path / 'data.bin')
+    interrupted_download(http_server, downloader, path, settings, monkeypatch)
+
+    downloader.download(http_server.url('data.bin'), path)
+    assert open(path, 'rb').read() == data
+    assert range_requests(http_server) == ['bytes={}-{}'.format(2 * segment_size, 3 * segment_size - 1)]
+
+
+def test_restart_when_the_file_changed(tmp_path, served_folder, http_server, downloader, data, settings,
+                                       monkeypatch):
+    path = str(tmp_path / 'data.bin')
+    interrupted_download(http_server, downloader, path, settings, monkeypatch)
+
+    changed = os.urandom(len(data))  # the same size, with a new ETag and Last-Modified
+    (served_folder / 'data.bin').write_bytes(changed)
+    os.utime(served_folder / 'data.bin', (0, time.time() + 60))
+
+    downloader.download(http_server.url('data.bin'), path)
+    assert open(path, 'rb').read() == changed
+    assert len(range_requests(http_server)) == segments
+
+
+def test_restart_without_validators(tmp_path, served_folder, data, downloader, settings, monkeypatch):
+    path = str(tmp_path / 'data.bin')
+    with HttpServer(str(served_folder), validators=False) as server:
+        interrupted_download(server, downloader, path, settings, monkeypatch)
+
+        downloader.download(server.url('data.bin'), path)
+        assert open(path, 'rb').read() == data
+        assert len(range_requests(server)) == segments
+
+
+def test_truncated_range_is_requested_again(tmp_path, served_folder, data, downloader):
+    path = str(tmp_path / 'data.bin')
+    with HttpServer(str(served_folder), truncated_ranges=1) as server:
+        downloader.download(server.url('data.bin'), path)
+        requested = range_requests(server)
+
+    assert open(path, 'rb').read() == data
+    assert len(requested) == segments + 1 and len(set(requested)) == segments  # one range is requested again
+
+
+def test_truncated_range_file_block_is_requested_again(served_folder, data):
+    with HttpServer(str(served_folder), truncated_ranges=1) as server:
+        f = RangeFile(server.url('data.bin'), len(data), block_size=segment_size)
+        assert f.read(segment_size) == data[:segment_size]
+        assert range_requests(server) == ['bytes=0-{}'.format(segment_size - 1)] * 2
+
+
+def test_single_stream_without_range_support(tmp_path, served_folder, data, downloader):
+    path = str(tmp_path / 'data.bin')
+    with HttpServer(str(served_folder), accept_ranges=False) as server:
+        downloader.download(server.url('data.bin'), path)
+        assert range_requests(server) == []
+    assert open(path, 'rb').read() == data
+
+
+def test_range_file(http_server, data):
+    f = RangeFile(http_server.url('data.bin'), len(data), block_size=segment_size)
+    f.seek(-10, os.SEEK_END)
+    assert f.read(10) == data[-10:]
+    f.seek(segment_size - 5)
+    assert f.read(10) == data[segment_size - 5:segment_size + 5]
+
+
+def test_range_file_raises_if_the_file_changes(served_folder, http_server, data):
+    url = http_server.url('data.bin')
+    probe = RangeDownloader.probe(url)
+    f = RangeFile(url, probe['size'], validator=probe['etag'], block_size=segment_size)
+    assert f.read(10) == data[:10]
+
+    (served_folder / 'data.bin').write_bytes(os.urandom(len(data)))
+    os.utime(served_folder / 'data.bin', (0, time.time() + 60))
+
+    f.seek(segment_size)
+    with pytest.raises(DownloadError):
+        f.read(10)
+
+
+@pytest.fixture
+def zip_source(served_folder, make_source):
+    """ return a function that builds the source metadata of a zip with two members, served by a server """
+
+    with zipfile.ZipFile(str(served_folder / 'data.zip'), 'w') as zfile:
+        zfile.writestr('a.csv', 'id\n1\n')
+        zfile.writestr('b.csv', 'id\n2\n')
+
+    return lambda server, **options: SourceMetadata(make_source(server.url('data.zip'), download_type='zip',
+                                                                zip_members='*.csv', **options), 'data')
+
+
+def test_zip_is_downloaded_whole_by_default(http_server, zip_source):
+    members = DownloadData(zip_source(http_server)).download('zip')
+    assert members == {'a.csv': [b'id\n', b'1\n'], 'b.csv': [b'id\n', b'2\n']}
+    assert range_requests(http_server) == []
+
+
+def test_remote_zip_is_read_with_range_requests(http_server, zip_source):
+    members = DownloadData(zip_source(http_server, remote_zip=True)).download('zip')
+    assert members == {'a.csv': [b'id\n', b'1\n'], 'b.csv': [b'id\n', b'2\n']}
+    assert range_requests(http_server)
+
+
+def test_remote_zip_without_validators_is_downloaded_whole(served_folder, zip_source):
+    with HttpServer(str(served_folder), validators=False) as server:
+        assert DownloadData(zip_source(server, remote_zip=True)).download('zip')['b.csv'] == [b'id\n', b'2\n']
+        assert range_requests(server) == []
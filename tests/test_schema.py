@@ -0,0 +1,106 @@
+__author__ = 'alsherman'
+
+import numpy as np
+import pandas as pd
+from data_pipeline.transform_data.schema import normalize, parser_dtypes, apply_schema, downcast, optimize
+
+
+SCHEMA = {'id': 'int32',
+          'count': {'type': 'int16', 'nullable': True},
+          'flag': {'type': 'bool', 'nullable': True},
+          'state': 'category',
+          'amount': 'float32',
+          'date': {'type': 'datetime', 'format': '%Y%m%d'}}
+
+
+def frame():
+    return pd.DataFrame({'id': [1, 2, 3, 4],
+                         'count': [1.0, None, 3.0, 4.0],
+                         'flag': [True, None, False, True],
+                         'state': ['VA', 'VA', 'MD', 'VA'],
+                         'amount': [1.5, 2.5, 3.5, 4.5],
+                         'date': ['20170101', '20170102', '20170103', '20170104']})
+
+
+def test_normalize_maps_nullable_types():
+    assert normalize(SCHEMA) == {'id': 'int32',
+                                 'count': 'Int16',
+                                 'flag': 'boolean',
+                                 'state': 'category',
+                                 'amount': 'float32',
+                                 'date': {'type': 'datetime', 'format': '%Y%m%d'}}
+
+
+def test_parser_dtypes_exclude_datetimes():
+    assert parser_dtypes(SCHEMA) == {'id': 'int32', 'count': 'Int16', 'flag': 'boolean', 'state': 'category',
+                                     'amount': 'float32'}
+
+
+def test_parser_dtypes_are_accepted_by_read_csv(tmp_path):
+    path = tmp_path / 'data.csv'
+    frame().to_csv(str(path), index=False)
+
+    df = pd.read_csv(str(path), dtype=parser_dtypes(SCHEMA))
+
+    assert {column: str(dtype) for column, dtype in df.dtypes.items()} == {
+        'id': 'int32', 'count': 'Int16', 'flag': 'boolean', 'state': 'category', 'amount': 'float32', 'date': 'int64'}
+
+
+def test_apply_schema_converts_every_column():
+    df = apply_schema(frame(), dict(SCHEMA, missing='int8'))
+
+    assert [str(dtype) for dtype in df.dtypes][:5] == ['int32', 'Int16', 'boolean', 'category', 'float32']
+    assert pd.api.types.is_datetime64_dtype(df['date'].dtype)
+    assert df['count'].isna().tolist() == [False, True, False, False]
+    assert df['date'].iloc[1] == pd.Timestamp('2017-01-02')
+    assert 'missing' not in df.columns
+
+
+def test_downcast_integers_floats_and_categories():
+    df = pd.DataFrame({'small': np.arange(100, dtype='int64'),
+                       'negative': np.arange(-50, 50, dtype='int64'),
+                       'large': np.arange(100, dtype='int64') * 100000,
+                       'amount': np.linspace(0, 1, 100),
+                       'state': ['VA', 'MD'] * 50,
+                       'name': ['name {}'.format(i) for i in range(100)]})
+
+    df = downcast(df)
+
+    assert {column: str(dtype) for column, dtype in df.dtypes.items()} == {
+        'small': 'uint8', 'negative': 'int8', 'large': 'uint32', 'amount': 'float32', 'state': 'category',
+        'name': str(df['name'].dtype)}
+    assert df['name'].dtype != 'category'  # every name is unique
+    assert df['large'].max() == 9900000
+
+
+def test_downcast_leaves_excluded_and_nullable_columns():
+    df = pd.DataFrame({'id': np.arange(10, dtype='int64'),
+                       'count': pd.array(range(10), dtype='Int64'),
+                       'state': ['VA'] * 10})
+
+    df = downcast(df, exclude={'id'})
+
+    assert [str(dtype) for dtype in df.dtypes] == ['int64', 'Int64', 'category']
+
+
+def test_downcast_empty_dataframe():
+    df = downcast(pd.DataFrame({'id': pd.Series([], dtype='int64'), 'state': pd.Series([], dtype=object)}))
+
+    assert str(df['id'].dtype) in ('int8', 'uint8')
+    assert df['state'].dtype != 'category'
+
+
+def test_optimize_without_a_schema_returns_the_dataframe_unchanged():
+    df = frame()
+    assert optimize(df) is df
+    assert optimize(df, schema={}) is df
+    pd.testing.assert_frame_equal(df, frame())
+
+
+def test_optimize_downcasts_columns_that_are_not_in_the_schema():
+    df = optimize(pd.concat([frame()] * 4, ignore_index=True), schema={'id': 'int32'}, downcast_columns=True,
+                  name='data')
+
+    assert str(df['id'].dtype) == 'int32'
+    assert str(df['amount'].dtype) == 'float32'
+    assert df['state'].dtype == 'category'
@@ -0,0 +1,85 @@
+__author__ = 'alsherman'
+
+import time
+import itertools
+import pytest
+from data_pipeline.stream_pipeline import StreamPipeline
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def counting(items, counts):
+    """ yield the items, recording how many were produced and whether the generator was closed """
+
+    try:
+        for item in items:
+            counts['produced'] += 1
+            yield item
+    finally:
+        counts['closed'] = True
+
+
+def failing(items, after):
+    for item in items:
+        if item == after:
+            raise ValueError('stage failed')
+        yield item
+
+
+def test_items_pass_through_every_stage_in_order():
+    with StreamPipeline(queue_size=2) as pipeline:
+        parsed = pipeline.stage('parse', iter(range(100)))
+        cleaned = pipeline.stage('transform', (item * 2 for item in parsed))
+        assert list(cleaned) == [item * 2 for item in range(100)]
+
+
+@pytest.mark.parametrize('failing_stage', ['parse', 'transform'])
+def test_stage_error_reaches_the_caller_and_stops_every_stage(failing_stage):
+    counts = {'produced': 0, 'closed': False}
+    received = []
+
+    with pytest.raises(ValueError, match='stage failed'):
+        with StreamPipeline(queue_size=2) as pipeline:
+            items = counting(itertools.count(), counts)
+            if failing_stage == 'parse':
+                items = failing(items, after=5)
+            parsed = pipeline.stage('parse', items)
+            cleaned = pipeline.stage('transform', failing(parsed, after=5) if failing_stage == 'transform' else parsed)
+            for item in cleaned:
+                received.append(item)
+
+    assert received == [0, 1, 2, 3, 4]
+    assert not any(stage._thread.is_alive() for stage in pipeline._stages)
+    if failing_stage == 'transform':
+        # the parse stage was stopped while it waited for room in its queue
+        assert counts['closed']
+
+
+def test_slow_consumer_blocks_producers_at_the_queue_size():
+    counts = {'produced': 0, 'closed': False}
+
+    with StreamPipeline(queue_size=3) as pipeline:
+        parsed = pipeline.stage('parse', counting(itertools.count(), counts))
+
+        # the queue is full, and the producer holds one more item while it waits for room
+        wait_for(lambda: counts['produced'] == 4)
+        time.sleep(0.3)
+        assert counts['produced'] == 4
+
+        assert next(parsed) == 0
+        wait_for(lambda: counts['produced'] == 5)
+        time.sleep(0.3)
+        assert counts['produced'] == 5
+
+    assert not parsed._thread.is_alive()
+    assert counts['closed']
+
+
+def test_queue_size_from_config(settings):
+    settings({'STREAMING': {'queue_size': '7'}})
+    assert StreamPipeline.from_config().queue_size == 7
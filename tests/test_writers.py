@@ -0,0 +1,114 @@
+__author__ = 'alsherman'
+
+import gzip
+import pandas as pd
+import pytest
+from types import SimpleNamespace
+from data_pipeline.export_data.create_csv import CSVCreator
+from data_pipeline.export_data.writers import create_writer
+
+
+def chunks():
+    yield pd.DataFrame({'id': [1, 2], 'name': [None, None]})
+    yield pd.DataFrame({'id': [3, 4], 'name': ['c', None]})
+
+
+@pytest.mark.parametrize('output_format, read', [('parquet', pd.read_parquet), ('feather', pd.read_feather)])
+def test_column_without_values_in_the_first_chunk(tmp_path, output_format, read):
+    path = str(tmp_path / 'data.{}'.format(output_format))
+    create_writer(path).write(chunks(), path)
+
+    df = read(path)
+    assert df['id'].tolist() == [1, 2, 3, 4]
+    assert df['name'].tolist()[2] == 'c'
+    assert df['name'].isna().tolist() == [True, True, False, True]
+
+
+@pytest.mark.parametrize('output_format, read', [('parquet', pd.read_parquet), ('feather', pd.read_feather)])
+def test_column_without_any_values(tmp_path, output_format, read):
+    path = str(tmp_path / 'data.{}'.format(output_format))
+    create_writer(path, batch_size=1).write(pd.DataFrame({'id': [1, 2], 'name': [None, None]}), path)
+
+    df = read(path)
+    assert df['id'].tolist() == [1, 2]
+    assert df['name'].isna().all()
+
+
+def test_gzip_default_level(tmp_path, monkeypatch):
+    levels = []
+    gzip_open = gzip.open
+    monkeypatch.setattr(gzip, 'open', lambda *args, **kwargs: levels.append(kwargs['compresslevel']) or gzip_open(
+        *args, **kwargs))
+
+    path = str(tmp_path / 'data.csv.gz')
+    create_writer(path).write(pd.DataFrame({'id': [1, 2]}), path)
+    assert levels == [6]
+    assert pd.read_csv(path)['id'].tolist() == [1, 2]
+
+
+@pytest.mark.parametrize('output_options, expected', [
+    ({'compression': 'zstd'}, {'compression': 'zstd'}),
+    ({'data': {'compression': 'zstd'}, 'other': {'compression': 'gzip'}}, {'compression': 'zstd'}),
+    ({'other': {'compression': 'gzip'}}, None)])
+def test_output_options_for_every_output_or_each_category(output_options, expected):
+    assert CSVCreator._get_option({'output_options': output_options}, 'output_options', 'data') == expected
+
+
+def test_export_with_options_for_every_output(tmp_path):
+    source_metadata = SimpleNamespace(output_path=str(tmp_path / 'data.parquet'), data_category='data',
+                                      dataframe=pd.DataFrame({'id': [1, 2]}),
+                                      create_output_path=lambda name, sources_metadata: str(tmp_path / 'data.parquet'))
+    outputs = CSVCreator(source_metadata).create_csv({'output_options': {'compression': 'zstd'}})
+
+    import pyarrow.parquet
+    assert pyarrow.parquet.ParquetFile(outputs[0]).metadata.row_group(0).column(0).compression == 'ZSTD'
+
+
+def failing_chunks():
+    yield pd.DataFrame({'id': [3, 4], 'name': ['c', 'd']})
+    raise ValueError('cleaning failed')
+
+
+def read_output(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+
+@pytest.mark.parametrize('name', ['data.csv', 'data.csv.gz', 'data.csv.zst', 'data.parquet', 'data.feather'])
+@pytest.mark.parametrize('error', [ValueError, KeyboardInterrupt])
+def test_failed_write_keeps_the_previous_output(tmp_path, monkeypatch, name, error):
+    if name.endswith('.zst'):
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / name)
+    previous = pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']})
+    create_writer(path).write(previous, path)
+
+    def chunks():
+        yield pd.DataFrame({'id': [3, 4], 'name': ['c', 'd']})
+        raise error('cleaning failed')
+
+    with pytest.raises(error):
+        create_writer(path, batch_size=1).write(chunks(), path)
+
+    pd.testing.assert_frame_equal(read_output(path), previous)
+    assert [p.name for p in tmp_path.iterdir()] == [name]
+
+
+def test_failed_output_does_not_stop_the_other_outputs(tmp_path):
+    previous = pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']})
+    for name in ('good.csv', 'bad.csv'):
+        previous.to_csv(str(tmp_path / name), index=False)
+
+    source_metadata = SimpleNamespace(output_path=str(tmp_path / 'good.csv'), data_category='good',
+                                      dataframe={'good': pd.DataFrame({'id': [5]}), 'bad': failing_chunks()},
+                                      create_output_path=lambda name, sources_metadata: str(tmp_path / (name + '.csv')))
+
+    with pytest.raises(ValueError, match='cleaning failed'):
+        CSVCreator(source_metadata, workers=2).create_csv({})
+
+    assert pd.read_csv(str(tmp_path / 'good.csv'))['id'].tolist() == [5]
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmp_path / 'bad.csv')), previous)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['bad.csv', 'good.csv']
@@ -0,0 +1,153 @@
+__author__ = 'alsherman'
+
+import io
+import sys
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+from data_pipeline.transform_data.xml_parser import XmlElementParser, ColumnarBuffer
+from data_pipeline.transform_data.xml_stream_parser import XmlStreamParser
+from data_pipeline.transform_data.xml_parallel_parser import ParallelXmlParser
+
+
+# a default and a prefixed namespace, items missing a child element, a parent element, and the nested elements
+DOCUMENT = b'''<?xml version="1.0"?>
+<records xmlns="http://example.com/records" xmlns:t="http://example.com/tags">
+<record id="1"><name>one</name><meta><info><value kind="a">10</value></info></meta>
+  <t:tags><t:tag>x</t:tag><t:tag>y</t:tag></t:tags></record>
+<t:record id="2"><meta><info><value kind="b">20</value></info></meta><tags><tag>z</tag></tags></t:record>
+<record id="3"><name>three</name><meta><info><value kind="c">30</value></info></meta></record>
+<record id="4"><name>four</name><meta><info><value kind="d">40</value></info></meta>
+  <tags><tag>v</tag><tag>w</tag></tags></record>
+<record id="5"><name>five</name><meta><info><value kind="e">50</value></info></meta><tags></tags></record>
+</records>
+'''
+
+
+def data_list():
+    return [(['name', ('record', 'id')], None, []),
+            (['tag'], 'tags', []),
+            ([('value', 'kind'), 'value'], ['meta', 'info'], [])]
+
+
+def record_id(item):
+    return [item['id']]
+
+
+def tables(specs):
+    return [list(class_list) for _, _, class_list in specs]
+
+
+def parse_tree(specs):
+    """ the BeautifulSoup tree that every other engine must match """
+
+    for item in BeautifulSoup(DOCUMENT, 'xml').find_all('record'):
+        XmlElementParser(item).extract_data(specs, row_start=record_id(item))
+    return specs
+
+
+@pytest.fixture(autouse=True)
+def parser_state(monkeypatch):
+    """ the tables and the plan cache are class attributes, do not share them between tests """
+
+    monkeypatch.setattr(XmlElementParser, 'all_data', {})
+    monkeypatch.setattr(XmlElementParser, '_compiled', (None, None))
+
+
+def test_tree_covers_the_missing_elements():
+    records, tags, values = tables(parse_tree(data_list()))
+
+    assert records == [['1', 'one', '1'], ['2', '2'], ['3', 'three', '3'], ['4', 'four', '4'], ['5', 'five', '5']]
+    assert tags == [['1', 'x'], ['2', 'z'], ['4', 'v']]
+    assert values[1] == ['2', 'b', '20']
+
+
+def test_stream_matches_tree():
+    specs = data_list()
+    XmlStreamParser(io.BytesIO(DOCUMENT), 'record').extract_data(specs, row_start=record_id)
+
+    assert tables(specs) == tables(parse_tree(data_list()))
+
+
+def test_stream_rows_match_tree():
+    rows = [[], [], []]
+    for index, row in XmlStreamParser(io.BytesIO(DOCUMENT), 'record').iter_rows(data_list(), row_start=record_id):
+        rows[index].append(row)
+
+    assert rows == tables(parse_tree(data_list()))
+
+
+@pytest.mark.parametrize('explode', [False, True])
+def test_compiled_plans_match_tree(explode):
+    lists = data_list()
+    parse_tree(XmlElementParser.compile(lists, explode=explode))
+    expected = tables(lists)
+
+    specs = [(children_names, parent_names, ColumnarBuffer()) for children_names, parent_names, _ in data_list()]
+    plans = XmlElementParser.compile(specs, explode=explode)
+    for item in BeautifulSoup(DOCUMENT, 'xml').find_all('record'):
+        XmlElementParser(item).extract_data(plans, row_start=record_id(item))
+
+    # the buffer pads short rows with None, as a dataframe of the lists does
+    for (_, _, buffer), rows in zip(specs, expected):
+        pd.testing.assert_frame_equal(buffer.to_dataframe(), pd.DataFrame(rows))
+    if explode:
+        assert ['1', 'y'] in expected[1]
+
+
+def test_columnar_buffer_pads_like_a_list_of_lists():
+    rows = tables(parse_tree(data_list()))[0]
+    buffer = ColumnarBuffer()
+    buffer.extend(rows)
+
+    pd.testing.assert_frame_equal(buffer.to_dataframe(columns=['id', 'name', 'record_id']),
+                                  pd.DataFrame(rows, columns=['id', 'name', 'record_id']))
+
+
+def test_parallel_matches_tree():
+    specs = [(children_names, parent_names, str(table)) for table, (children_names, parent_names, _)
+             in enumerate(data_list())]
+    ParallelXmlParser(io.BytesIO(DOCUMENT), 'record', workers=2, shard_size=2).extract_data(specs, row_start=record_id)
+
+    assert [XmlElementParser.all_data[str(table)] for table in range(3)] == tables(parse_tree(data_list()))
+
+
+def test_plan_cache_is_not_shared_across_data_lists():
+    first, second = data_list(), data_list()
+    items = BeautifulSoup(DOCUMENT, 'xml').find_all('record')
+
+    # alternate between data lists, so each one replaces the cached plans of the other
+    for item in items:
+        XmlElementParser(item).extract_data(first, row_start=record_id(item))
+        XmlElementParser(item).extract_data(second, row_start=record_id(item))
+
+    assert tables(first) == tables(second) == tables(parse_tree(data_list()))
+
+
+def test_plan_cache_replaced_by_another_data_list():
+    """ another thread may cache the plans of its own data list between any two lines of _get_plans """
+
+    first, other = data_list(), data_list()
+    other_plans = XmlElementParser.compile(other)
+
+    def switch_threads(frame, event, arg):
+        if frame.f_code.co_name != '_get_plans':
+            return None
+
+        def replace_cache(frame, event, arg):
+            if event == 'line' and XmlElementParser._compiled[0] is first:
+                XmlElementParser._compiled = (other, other_plans)
+            return replace_cache
+
+        return replace_cache
+
+    item = BeautifulSoup(DOCUMENT, 'xml').find('record')
+    trace = sys.gettrace()
+    sys.settrace(switch_threads)
+    try:
+        XmlElementParser(item).extract_data(first, row_start=record_id(item))
+    finally:
+        sys.settrace(trace)
+
+    assert tables(first)[0] == [['1', 'one', '1']]
+    assert tables(other) == [[], [], []]